@@ -0,0 +1,107 @@
+# bench_json_codec.py
+"""Compares the JSON backends available to `src.utils.json_codec` on the repository's own data files: parsing
+the raw API responses and the combined all_json_data.json, writing them compact and pretty-printed, and a
+line-delimited write/read round trip.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_json_codec
+    python -m benchmarks.bench_json_codec --files data/processed/all_json_data.json --repeats 10
+
+Functions include:
+
+    `run_benchmarks(file_paths, repeats=5)`:
+        Times each operation with each installed backend on each file.
+
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_processing import save_results
+from src.utils import json_codec
+
+
+DEFAULT_FILES = ["data/processed/all_json_data.json"] + sorted(glob.glob("data/raw/JSON_response/*.json"))[-1:]
+
+
+def _time(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings), 6)
+
+
+def _records(obj):
+    """Flattens the data files into one record per video (the shape line-delimited files hold)."""
+    files = obj if isinstance(obj, list) else [obj]
+    return [dict(video, videoID=video_id)
+            for file_data in files for channel in file_data.values()
+            for video_id, video in channel["video_data"].items()]
+
+
+def run_benchmarks(file_paths=DEFAULT_FILES, repeats=5):
+    """Times loads, compact dumps, pretty dumps and a line-delimited round trip for every installed backend.
+
+    Returns
+    -------
+    results : dict
+        {file name: {backend: {operation: median seconds}}}
+
+    """
+    backends = json_codec.available_backends()
+    print(f"Backends: {backends}")
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lines_path = os.path.join(tmp, "records.jsonl")
+
+        for file_path in file_paths:
+            with open(file_path, "rb") as f:
+                raw = f.read()
+            name = os.path.basename(file_path)
+            print(f"\n{name} ({len(raw) / 1024 ** 2:.1f} MB)")
+            print(f"  {'backend':<10}{'loads':>10}{'compact':>10}{'pretty':>10}{'ndjson':>10}")
+
+            results[name] = {"size_mb": round(len(raw) / 1024 ** 2, 3)}
+            for backend in backends:
+                json_codec.set_backend(backend)
+                obj = json_codec.loads(raw)
+                records = _records(obj)
+
+                def ndjson_round_trip():
+                    json_codec.write_lines(records, lines_path)
+                    for _ in json_codec.iter_lines(lines_path):
+                        pass
+
+                timings = {"loads": _time(lambda: json_codec.loads(raw), repeats),
+                           "dumps_compact": _time(lambda: json_codec.dumps(obj), repeats),
+                           "dumps_pretty": _time(lambda: json_codec.dumps(obj, pretty=True), repeats),
+                           "ndjson_round_trip": _time(ndjson_round_trip, repeats)}
+                results[name][backend] = timings
+
+                print(f"  {backend:<10}" + "".join(f"{t * 1000:>8.1f}ms" for t in timings.values()))
+
+    json_codec.set_backend("auto")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare JSON backends on the repository's data files.")
+    parser.add_argument("--files", nargs="+", default=DEFAULT_FILES)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output-folder", default="benchmarks/results")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.files, repeats=args.repeats)
+    save_results(results, folder=args.output_folder, name="json_codec")
+
+
+if __name__ == "__main__":
+    main()
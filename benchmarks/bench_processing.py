@@ -0,0 +1,286 @@
+# bench_processing.py
+"""Times and memory-profiles the processing, feature-engineering and visualisation-prep functions, one by one
+and as the end-to-end chain, on synthetic data of increasing size. Results are saved as JSON so runs on
+different commits can be compared.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_processing                         # 1k, 100k and 1M videos
+    python -m benchmarks.bench_processing --sizes 1000 100000     # choose the sizes
+    python -m benchmarks.bench_processing --compare old.json new.json
+
+Functions include:
+
+    `measure(func, *args, repeats=3)`:
+        Returns the output of `func` and its wall time, peak allocated memory and rows in/out.
+
+    `run_benchmarks(sizes, repeats=3)`:
+        Benchmarks each step and the end-to-end chain for every size.
+
+    `save_results(results, folder="benchmarks/results")`:
+        Saves the results (and the commit they were run on) as JSON.
+
+    `compare_results(old_path, new_path, threshold=1.1)`:
+        Prints the change in time and memory per step and returns the steps that got slower.
+
+"""
+
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import generate_json_response
+from src.processing.process_json_data import json_response_to_dataframe, remove_prefixes, drop_columns
+from src.processing.feature_engineering import (create_year_month_columns, create_video_counts_columns,
+                                                duration_to_hhmmss)
+from src.processing.chop_dataframe import split_into_video_series
+from src.visualisation.visualisations import prep_df_for_visualisation
+
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+VIDEO_SERIES = ["Keeping the Ball on the Ground"]
+
+
+def _rows(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, list):
+        # raw JSON: count the videos across the files
+        return sum(len(data["video_data"]) for file_data in obj for data in file_data.values()
+                   if isinstance(data, dict) and "video_data" in data)
+    return None
+
+
+def measure(func, *args, repeats=3):
+    """Runs `func(*args)` `repeats` times to time it, then once more under tracemalloc to find the peak
+    memory it allocates (tracemalloc slows code down, so it isn't used for the timings).
+
+    Returns
+    -------
+    result : the output of the last call
+
+    metrics : dict
+        seconds_min, seconds_median, peak_memory_mb, rows_in, rows_out.
+
+    """
+    timings = []
+    result = None
+
+    # silence the prints in the processing functions (e.g. missing columns in drop_columns)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = func(*args)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    metrics = {"seconds_min": round(min(timings), 6),
+               "seconds_median": round(statistics.median(timings), 6),
+               "peak_memory_mb": round(peak / 1024 ** 2, 3),
+               "rows_in": _rows(args[0]) if args else None,
+               "rows_out": _rows(result)}
+
+    return result, metrics
+
+
+##### Steps of the chain (the same order as the pipeline) #####
+
+def _clean(df):
+    df_ = df.copy()
+    df_.columns = df_.columns.map(remove_prefixes)
+    df_ = drop_columns(df_)
+    for column in ["viewCount", "likeCount", "favoriteCount", "commentCount"]:
+        df_[column] = pd.to_numeric(df_[column], errors="coerce")
+    return df_
+
+
+def _durations(df):
+    df_ = df.copy()
+    durations = df_["duration"].apply(duration_to_hhmmss)
+    df_["duration_timedelta"] = durations.str[0]
+    df_["duration_hhmmss"] = durations.str[1]
+    return df_
+
+
+def _series(df):
+    return split_into_video_series(df, VIDEO_SERIES)
+
+
+def _end_to_end(json_response_data):
+    df = json_response_to_dataframe(json_response_data)
+    df = _clean(df)
+    df = _durations(df)
+    df = create_year_month_columns(df)
+    df = create_video_counts_columns(df)
+    df = _series(df)
+    return prep_df_for_visualisation(df)
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeats=3):
+    """Benchmarks each step and the end-to-end chain on synthetic data of each size.
+
+    Parameters
+    ----------
+    sizes : list
+        Numbers of videos to generate.
+
+    repeats : int
+        Number of timed runs per step (the minimum and median are reported).
+
+    Returns
+    -------
+    results : dict
+        {size: {step name: metrics}}
+
+    """
+    results = {}
+
+    for size in sizes:
+        print(f"\nGenerating {size:,} synthetic videos...")
+        json_response_data = generate_json_response(size)
+
+        # fewer repeats for the largest sizes to keep the run time reasonable
+        n = repeats if size <= 100_000 else 1
+        size_results = {}
+
+        steps = [("json_response_to_dataframe", json_response_to_dataframe),
+                 ("drop_columns", _clean),
+                 ("duration_to_hhmmss", _durations),
+                 ("create_year_month_columns", create_year_month_columns),
+                 ("create_video_counts_columns", create_video_counts_columns),
+                 ("split_into_video_series", _series),
+                 ("prep_df_for_visualisation", prep_df_for_visualisation)]
+
+        # each step takes the output of the one before it
+        value = json_response_data
+        for name, func in steps:
+            value, metrics = measure(func, value, repeats=n)
+            size_results[name] = metrics
+            print(f"  {name:<30}{metrics['seconds_median']:>10.3f}s{metrics['peak_memory_mb']:>10.1f} MB")
+
+        _, metrics = measure(_end_to_end, json_response_data, repeats=n)
+        size_results["end_to_end"] = metrics
+        print(f"  {'end_to_end':<30}{metrics['seconds_median']:>10.3f}s{metrics['peak_memory_mb']:>10.1f} MB")
+
+        results[str(size)] = size_results
+
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results, folder="benchmarks/results", name="processing"):
+    """Saves the results as JSON along with the commit, library versions and machine they were run on.
+
+    Returns
+    -------
+    file_path : string
+
+    """
+    commit = _git_commit()
+    timestamp = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H-%M-%SZ")
+
+    output = {"meta": {"commit": commit,
+                       "timestamp": timestamp,
+                       "python": platform.python_version(),
+                       "pandas": pd.__version__,
+                       "numpy": np.__version__,
+                       "platform": platform.platform(),
+                       "cpu_count": os.cpu_count()},
+              "results": results}
+
+    os.makedirs(folder, exist_ok=True)
+    file_path = os.path.join(folder, f"{name}_{timestamp}_{commit}.json")
+    with open(file_path, "w") as f:
+        json.dump(output, f, indent=4)
+
+    print(f"\nResults saved: {file_path}")
+    return file_path
+
+
+def compare_results(old_path, new_path, threshold=1.1):
+    """Prints the ratio of new to old time and peak memory for every step and size present in both files.
+
+    Parameters
+    ----------
+    old_path, new_path : string
+        Paths of two results files saved by `save_results`.
+
+    threshold : float
+        A step whose median time ratio is above this is reported as a regression.
+
+    Returns
+    -------
+    regressions : list
+        (size, step, time ratio) for each step that got slower than the threshold.
+
+    """
+    with open(old_path, "r") as f:
+        old = json.load(f)
+    with open(new_path, "r") as f:
+        new = json.load(f)
+
+    print(f"old: {old['meta']['commit']} ({old['meta']['timestamp']})")
+    print(f"new: {new['meta']['commit']} ({new['meta']['timestamp']})\n")
+    print(f"{'size':>10}  {'step':<30}{'time':>10}{'memory':>10}")
+
+    regressions = []
+    for size, steps in new["results"].items():
+        for step, metrics in steps.items():
+            previous = old["results"].get(size, {}).get(step)
+            if previous is None:
+                continue
+
+            time_ratio = metrics["seconds_median"] / max(previous["seconds_median"], 1e-9)
+            memory_ratio = metrics["peak_memory_mb"] / max(previous["peak_memory_mb"], 1e-9)
+            flag = "  <-- slower" if time_ratio > threshold else ""
+            print(f"{size:>10}  {step:<30}{time_ratio:>9.2f}x{memory_ratio:>9.2f}x{flag}")
+
+            if time_ratio > threshold:
+                regressions.append((size, step, time_ratio))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the processing functions on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output-folder", default="benchmarks/results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two results files instead of running the benchmarks.")
+    parser.add_argument("--threshold", type=float, default=1.1)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        regressions = compare_results(*args.compare, threshold=args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    results = run_benchmarks(args.sizes, repeats=args.repeats)
+    save_results(results, folder=args.output_folder)
+
+
+if __name__ == "__main__":
+    main()
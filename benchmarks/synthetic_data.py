@@ -0,0 +1,147 @@
+# synthetic_data.py
+"""Contains functions that generate synthetic YouTube API responses in the same layout as the raw JSON files
+in data/raw/JSON_response, so the processing functions can be benchmarked at sizes far beyond the real data.
+
+Functions include:
+
+    `generate_video(rng, video_id, published_at, channel_id)`:
+        Returns a single video's data ({"snippet": ..., "statistics": ..., "contentDetails": ...}).
+
+    `generate_json_response(n_videos, n_files=8, seed=0)`:
+        Returns a list of raw-file dictionaries (the layout of all_json_data.json) with `n_videos` videos.
+
+"""
+
+import datetime as dt
+import random
+import string
+
+
+CHANNEL_ID = "UCArk93C2pbOvkv6jWz-3kAg"
+
+# words and title patterns in the style of the real channel
+WORDS = ["celtic", "rangers", "derby", "review", "goal", "manager", "transfer", "season", "striker", "keeper",
+         "penalty", "referee", "var", "champions", "league", "scotland", "glasgow", "stories", "legend", "debut",
+         "captain", "return", "interview", "reunited", "debate", "heated", "funny", "classic", "window", "cup"]
+NAMES = ["KIERAN TIERNEY", "BARRY FERGUSON", "AIDEN McGEADY", "CHARLIE MULGREW", "JOHN HIGGINS", "ALLY McCOIST",
+         "ANDY HALLIDAY", "CHRIS SUTTON", "JAMIE CARRAGHER", "ANGE POSTECOGLOU", "GORDON STRACHAN", "SI FERRY"]
+SERIES = ["Keeping the Ball on the Ground", "Open Goal Meets...", "Open Goal", "Open Goal Broadcasting"]
+BOILERPLATE = ("SUBSCRIBE to Open Goal - https://bit.ly/2QGY26R\n\nFollow Open Goal on social media:\n"
+               "Twitter - https://twitter.com/opengoalpod\nInstagram - https://instagram.com/opengoalpod\n\n")
+THUMBNAIL_SIZES = {"default": (120, 90), "medium": (320, 180), "high": (480, 360),
+                   "standard": (640, 480), "maxres": (1280, 720)}
+
+
+def _sentence(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def generate_video(rng, video_id, published_at, channel_id=CHANNEL_ID):
+    """Returns the data for a single synthetic video in the layout returned by `YouTubeStats.get_videos_data`.
+
+    Titles are ~40-100 characters and descriptions ~300-2000 characters including the channel's
+    "SUBSCRIBE to Open Goal" boilerplate, similar to the real data. Durations are ISO 8601 strings
+    (e.g. "PT1H21M36S") from a few seconds to about two hours.
+    """
+    title = f"{rng.choice(NAMES)} {' '.join(rng.choice(WORDS).upper() for _ in range(rng.randint(1, 6)))} | " \
+            f"{rng.choice(SERIES)}"
+    description = BOILERPLATE + " ".join(_sentence(rng, rng.randint(6, 20)) for _ in range(rng.randint(2, 20)))
+
+    # skew towards longer podcast-style videos with some short clips
+    seconds = int(rng.choice([rng.uniform(15, 600), rng.uniform(1200, 7500)]))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    duration = "PT" + (f"{hours}H" if hours else "") + (f"{minutes}M" if minutes else "") + \
+               (f"{seconds}S" if seconds else "")
+    if duration == "PT":
+        duration = "PT0S"
+
+    views = int(rng.lognormvariate(10, 1.2))
+
+    return {
+        "snippet": {
+            "publishedAt": published_at,
+            "channelId": channel_id,
+            "title": title,
+            "description": description,
+            "thumbnails": {size: {"url": f"https://i.ytimg.com/vi/{video_id}/{size}.jpg", "width": w, "height": h}
+                           for size, (w, h) in THUMBNAIL_SIZES.items()},
+            "channelTitle": "Open Goal",
+            "tags": [rng.choice(WORDS) for _ in range(rng.randint(0, 15))],
+            "categoryId": "17",
+            "liveBroadcastContent": "none",
+            "defaultAudioLanguage": "en-GB",
+            "localized": {"title": title, "description": description},
+        },
+        "statistics": {
+            "viewCount": str(views),
+            "likeCount": str(int(views * rng.uniform(0.005, 0.04))),
+            "favoriteCount": "0",
+            "commentCount": str(int(views * rng.uniform(0.0005, 0.005))),
+        },
+        "contentDetails": {
+            "duration": duration,
+            "dimension": "2d",
+            "definition": "hd",
+            "caption": "false",
+            "licensedContent": True,
+            "contentRating": {},
+            "projection": "rectangular",
+        },
+    }
+
+
+def generate_json_response(n_videos, n_files=8, seed=0, start="2017-01-01", days=2500,
+                           channel_id=CHANNEL_ID):
+    """Returns synthetic data in the layout of data/processed/all_json_data.json: a list of `n_files`
+    dictionaries, each {channel_id: {"channel_statistics": ..., "video_data": ...}}, with the videos split
+    across the files by publish date as the real date-window files are.
+
+    Parameters
+    ----------
+    n_videos : int
+        Total number of videos to generate.
+
+    n_files : int
+        Number of raw files (date windows) to split the videos across.
+
+    seed : int
+        Random seed, so the same data is generated on every run.
+
+    start : string
+        Date of the earliest video.
+
+    days : int
+        Number of days the videos are spread over.
+
+    Returns
+    -------
+    json_response_data : list
+
+    """
+    rng = random.Random(seed)
+    start_date = dt.datetime.fromisoformat(start)
+    alphabet = string.ascii_letters + string.digits + "-_"
+
+    # generate publish times in order so they can be split into date windows
+    offsets = sorted(rng.uniform(0, days * 86400) for _ in range(n_videos))
+
+    files = []
+    per_file = -(-n_videos // n_files)  # ceiling division
+
+    for file_number in range(n_files):
+        video_data = {}
+        for offset in offsets[file_number * per_file:(file_number + 1) * per_file]:
+            video_id = "".join(rng.choice(alphabet) for _ in range(11))
+            published_at = (start_date + dt.timedelta(seconds=offset)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            video_data[video_id] = generate_video(rng, video_id, published_at, channel_id)
+
+        channel_statistics = {"viewCount": str(50_000_000 + file_number * 1000),
+                              "subscriberCount": "112000",
+                              "hiddenSubscriberCount": False,
+                              "videoCount": str(n_videos),
+                              "title": "open_goal"}
+
+        files.append({channel_id: {"channel_statistics": channel_statistics, "video_data": video_data}})
+
+    return files
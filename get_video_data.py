@@ -22,3 +22,6 @@ yt_stats.get_videos_data()
 
 # output the data to JSON format
 yt_stats.export_to_json()
+
+# print the per-endpoint request metrics (latency, retries, quota units spent)
+yt_stats.metrics.print_summary()
@@ -0,0 +1,9 @@
+# __main__.py
+"""Allows the command line interface to be run with `python -m src` (see `src/cli.py`)."""
+
+import sys
+
+from src.cli import main
+
+
+sys.exit(main())
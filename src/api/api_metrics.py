@@ -0,0 +1,192 @@
+# api_metrics.py
+"""Contains the in-process registry that records metrics for every request made to the YouTube API, so we
+can see where time and quota go and when requests are being throttled.
+
+Per endpoint ('search', 'videos', 'channels', 'playlistItems', ...) the registry records:
+- request count
+- latency histogram and percentiles
+- response bytes
+- HTTP status classes (2xx, 3xx, 4xx, 5xx, and 'error' for requests that raised)
+- retries
+- 304 (Not Modified) cache hits
+- quota units spent
+
+Class MetricsRegistry:
+- `MetricsRegistry()`
+
+MetricsRegistry methods:
+- `record_request(self, endpoint, seconds, status, n_bytes=0)`
+- `record_retry(self, endpoint)`
+- `percentile(self, endpoint, q)`
+- `quota_used(self)`
+- `summary(self)`
+- `print_summary(self)`
+- `reset(self)`
+
+`REGISTRY` is the default registry shared by every `YouTubeStats` instance.
+
+Resources
+----------
+Quota costs:
+    https://developers.google.com/youtube/v3/determine_quota_cost
+
+"""
+
+import bisect
+import random
+import threading
+from urllib.parse import urlparse
+
+
+# quota units charged per request, by endpoint (list methods)
+QUOTA_COSTS = {"search": 100, "videos": 1, "channels": 1, "playlists": 1, "playlistItems": 1,
+               "commentThreads": 1, "comments": 1}
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf")]
+
+# latencies kept per endpoint for the percentiles (a uniform sample once there are more requests)
+RESERVOIR_SIZE = 1024
+
+
+def endpoint_from_url(url):
+    """Returns the endpoint name of a YouTube API url, e.g. 'search' for
+    https://www.googleapis.com/youtube/v3/search?..."""
+    return urlparse(url).path.rstrip("/").split("/")[-1]
+
+
+def status_class(status):
+    """Returns '2xx', '3xx', '4xx' or '5xx' for an HTTP status code, or 'error' if there was no response."""
+    if status is None:
+        return "error"
+    return f"{int(status) // 100}xx"
+
+
+class _EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.quota_units = 0
+        self.status_classes = {}
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        # a fixed-size uniform sample of the latencies (reservoir sampling), so memory and the cost of a
+        # request stay constant however long the process runs
+        self.latencies = []
+        self._random = random.Random(0)
+
+    def add_latency(self, seconds):
+        if len(self.latencies) < RESERVOIR_SIZE:
+            self.latencies.append(seconds)
+            return
+        # the request-th latency replaces a sampled one with probability RESERVOIR_SIZE / requests
+        slot = self._random.randrange(self.requests)
+        if slot < RESERVOIR_SIZE:
+            self.latencies[slot] = seconds
+
+
+class MetricsRegistry:
+    """Thread-safe registry of per-endpoint request metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _get(self, endpoint):
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = _EndpointMetrics()
+        return self._endpoints[endpoint]
+
+    def record_request(self, endpoint, seconds, status, n_bytes=0):
+        """Records a completed (or failed) request.
+
+        Parameters
+        ----------
+        endpoint : string
+            Endpoint name, e.g. 'search' (see `endpoint_from_url`).
+
+        seconds : float
+            Latency of the request.
+
+        status : int
+            HTTP status code, or None if the request raised before a response was received.
+
+        n_bytes : int
+            Size of the response body.
+
+        """
+        with self._lock:
+            m = self._get(endpoint)
+            m.requests += 1
+            m.bytes += n_bytes
+            m.quota_units += QUOTA_COSTS.get(endpoint, 1)
+
+            status_class_ = status_class(status)
+            m.status_classes[status_class_] = m.status_classes.get(status_class_, 0) + 1
+            if status == 304:
+                m.cache_hits += 1
+
+            m.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            m.add_latency(seconds)
+
+    def record_retry(self, endpoint):
+        with self._lock:
+            self._get(endpoint).retries += 1
+
+    def percentile(self, endpoint, q):
+        """Returns the `q`th percentile (0-100) latency of an endpoint in seconds (None if no requests). After
+        RESERVOIR_SIZE requests it is estimated from a uniform sample of the latencies."""
+        with self._lock:
+            latencies = sorted(self._endpoints[endpoint].latencies) if endpoint in self._endpoints else []
+            if not latencies:
+                return None
+            index = min(len(latencies) - 1, max(0, int(round(q / 100 * (len(latencies) - 1)))))
+            return latencies[index]
+
+    def quota_used(self):
+        """Returns the total quota units spent across all endpoints."""
+        with self._lock:
+            return sum(m.quota_units for m in self._endpoints.values())
+
+    def summary(self):
+        """Returns a dictionary of metrics per endpoint."""
+        summary = {}
+        for endpoint in list(self._endpoints):
+            m = self._endpoints[endpoint]
+            summary[endpoint] = {
+                "requests": m.requests,
+                "bytes": m.bytes,
+                "retries": m.retries,
+                "cache_hits": m.cache_hits,
+                "quota_units": m.quota_units,
+                "status_classes": dict(m.status_classes),
+                "latency_p50": self.percentile(endpoint, 50),
+                "latency_p90": self.percentile(endpoint, 90),
+                "latency_p99": self.percentile(endpoint, 99),
+                "latency_histogram": {f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS, m.bucket_counts)},
+            }
+        return summary
+
+    def print_summary(self):
+        """Prints a table of the metrics per endpoint (e.g. at the end of a run)."""
+        summary = self.summary()
+        if not summary:
+            print("No API requests made.")
+            return
+
+        print(f"\n{'endpoint':<16}{'requests':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'KB':>10}"
+              f"{'retries':>9}{'304s':>7}{'quota':>8}  status")
+        for endpoint, m in sorted(summary.items()):
+            statuses = " ".join(f"{k}:{v}" for k, v in sorted(m["status_classes"].items()))
+            print(f"{endpoint:<16}{m['requests']:>9}{m['latency_p50'] * 1000:>9.0f}{m['latency_p90'] * 1000:>9.0f}"
+                  f"{m['latency_p99'] * 1000:>9.0f}{m['bytes'] / 1024:>10.1f}{m['retries']:>9}{m['cache_hits']:>7}"
+                  f"{m['quota_units']:>8}  {statuses}")
+        print(f"Total quota units: {self.quota_used()}")
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+REGISTRY = MetricsRegistry()
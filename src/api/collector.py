@@ -0,0 +1,388 @@
+# collector.py
+"""Contains the class for a long-running collector that keeps video statistics up to date without anyone
+having to edit dates and rerun `get_video_data.py`.
+
+Every tick the collector:
+    1. Polls the channel's uploads playlist (on its own, slower schedule) and adds any new videos.
+    2. Works out which videos are due a refresh. Recent videos are refreshed often and older videos less
+       often (see DEFAULT_TIERS).
+    3. Requests the statistics of all due videos in batches of 50 IDs (one 'videos' request, 1 quota unit,
+       per batch) and appends them to a `SnapshotStore` as each batch arrives.
+
+The quota spent is tracked per UTC day and the collector never spends more than `daily_quota_budget` units;
+when the budget is tight the newest videos are refreshed first. Uploads and statistics are read from the
+uploads playlist and the videos endpoint (1 unit per request), never from search (100 units per request).
+
+Usage (from the repository root):
+
+    python -m src collect --channel-id UCArk93C2pbOvkv6jWz-3kAg --seed-folder data/raw/JSON_response
+
+Class Collector:
+- `Collector(yt_stats, store=None, state_path="data/collector_state.json", tiers=DEFAULT_TIERS,
+  poll_interval_seconds=900, tick_seconds=60, daily_quota_budget=2000, max_concurrency=4)`
+
+Collector methods:
+- `seed_from_json(self, folder_path)`
+- `refresh_interval(self, age_seconds)`
+- `due_videos(self, now=None)`
+- `poll_uploads(self)`
+- `refresh(self, video_ids)`
+- `tick(self)`
+- `run(self, max_ticks=None)`
+- `run_forever(self, max_ticks=None)`
+- `save_state(self)`
+
+"""
+
+import asyncio
+import calendar
+import glob
+import os
+import time
+
+from src.api.api_metrics import QUOTA_COSTS, endpoint_from_url
+from src.monitoring.instrumentation import span
+from src.utils import json_codec
+
+
+# (maximum video age in seconds, refresh interval in seconds); the last tier applies to all older videos
+DEFAULT_TIERS = [
+    (2 * 86400, 15 * 60),       # published in the last 2 days: every 15 minutes
+    (14 * 86400, 60 * 60),      # last 2 weeks: hourly
+    (90 * 86400, 6 * 60 * 60),  # last 3 months: every 6 hours
+    (None, 24 * 60 * 60),       # older: daily
+]
+
+BATCH_SIZE = 50  # maximum number of IDs the videos endpoint accepts per request
+
+API_URL = "https://www.googleapis.com/youtube/v3"
+
+
+def _to_epoch_seconds(timestamp):
+    """Converts an API timestamp ("2023-11-01T12:00:00Z") to seconds since the epoch."""
+    return calendar.timegm(time.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S"))
+
+
+class Collector:
+    """Polls a channel for new uploads and refreshes video statistics on a tiered schedule.
+
+    Parameters
+    ----------
+    yt_stats : YouTubeStats
+        Used for its api key, channel id and `_get` (retries, ETags and request metrics).
+
+    store : SnapshotStore
+        Where the statistics are written. Defaults to `SnapshotStore()` (data/snapshots).
+
+    state_path : string
+        JSON file holding the known videos (publish time and last refresh), so the collector can be
+        restarted without losing its schedule.
+
+    tiers : list
+        (maximum age in seconds or None, refresh interval in seconds) pairs, youngest first.
+
+    poll_interval_seconds : int
+        How often the uploads playlist is checked for new videos.
+
+    tick_seconds : int
+        Time between ticks.
+
+    daily_quota_budget : int
+        Maximum quota units to spend per UTC day (the API's default quota is 10,000 per day).
+
+    max_concurrency : int
+        Maximum number of requests in flight at once.
+
+    """
+
+    def __init__(self, yt_stats, store=None, state_path="data/collector_state.json", tiers=DEFAULT_TIERS,
+                 poll_interval_seconds=900, tick_seconds=60, daily_quota_budget=2000, max_concurrency=4):
+        if store is None:
+            from src.storage.snapshot_store import SnapshotStore
+            store = SnapshotStore()
+
+        self.yt_stats = yt_stats
+        self.store = store
+        self.state_path = state_path
+        self.tiers = tiers
+        self.poll_interval_seconds = poll_interval_seconds
+        self.tick_seconds = tick_seconds
+        self.daily_quota_budget = daily_quota_budget
+        self.max_concurrency = max_concurrency
+
+        # video_id -> {"publishedAt": epoch seconds, "lastRefreshed": epoch seconds or None}
+        self.videos = {}
+        self.uploads_playlist_id = None
+        self.last_poll = None
+        # next page of a poll that was cut short by the quota budget
+        self.poll_page_token = None
+        self.quota_day = None
+        self.quota_spent = 0
+
+        self._load_state()
+
+    ##### State #####
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return
+
+        state = json_codec.load(self.state_path)
+        self.videos = state.get("videos", {})
+        self.uploads_playlist_id = state.get("uploads_playlist_id")
+        self.last_poll = state.get("last_poll")
+        self.poll_page_token = state.get("poll_page_token")
+        self.quota_day = state.get("quota_day")
+        self.quota_spent = state.get("quota_spent", 0)
+
+    def save_state(self):
+        """Writes the known videos, schedule and quota spent today to `state_path`."""
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        state = {"channel_id": self.yt_stats.channel_id,
+                 "uploads_playlist_id": self.uploads_playlist_id,
+                 "last_poll": self.last_poll,
+                 "poll_page_token": self.poll_page_token,
+                 "quota_day": self.quota_day,
+                 "quota_spent": self.quota_spent,
+                 "videos": self.videos}
+
+        # write to a temporary file first so a crash can't leave a half-written state file
+        json_codec.dump(state, self.state_path + ".tmp")
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def seed_from_json(self, folder_path):
+        """Adds the videos in the raw JSON files in `folder_path` to the known videos, so the first poll
+        doesn't have to page through the whole uploads playlist.
+
+        Returns
+        -------
+        n : int
+            Number of videos added.
+        """
+        n = 0
+        for file_path in sorted(glob.glob(os.path.join(folder_path, "*.json"))):
+            for channel_data in json_codec.load(file_path).values():
+                for video_id, video_data in channel_data.get("video_data", {}).items():
+                    published_at = video_data.get("snippet", {}).get("publishedAt")
+                    if video_id not in self.videos and published_at:
+                        self.videos[video_id] = {"publishedAt": _to_epoch_seconds(published_at),
+                                                 "lastRefreshed": None}
+                        n += 1
+
+        print(f"Seeded {n} videos from {folder_path}")
+        return n
+
+    ##### Quota #####
+
+    def _quota_remaining(self, now):
+        # quota is tracked per UTC day (the API resets at midnight Pacific time, so this is conservative
+        # for part of the day)
+        today = time.strftime("%Y-%m-%d", time.gmtime(now))
+        if today != self.quota_day:
+            self.quota_day = today
+            self.quota_spent = 0
+        return self.daily_quota_budget - self.quota_spent
+
+    def _get_with_attempts(self, url, cache):
+        data = self.yt_stats._get(url, cache=cache)
+        return data, self.yt_stats.last_request_attempts()
+
+    async def _get(self, url, semaphore, cache=True):
+        """Runs `YouTubeStats._get` in a worker thread so requests don't block the event loop. `cache=False`
+        is for urls that aren't requested again (their responses aren't kept). Every request sent, retries
+        included, is charged to the quota."""
+        async with semaphore:
+            data, attempts = await asyncio.to_thread(self._get_with_attempts, url, cache)
+
+        self.quota_spent += attempts * QUOTA_COSTS.get(endpoint_from_url(url), 1)
+        return data
+
+    ##### Scheduling #####
+
+    def refresh_interval(self, age_seconds):
+        """Returns the refresh interval (seconds) for a video of the given age."""
+        for max_age, interval in self.tiers:
+            if max_age is None or age_seconds <= max_age:
+                return interval
+        return self.tiers[-1][1]
+
+    def due_videos(self, now=None):
+        """Returns the IDs of the videos due a refresh, newest first."""
+        now = time.time() if now is None else now
+
+        due = []
+        for video_id, video in self.videos.items():
+            last = video["lastRefreshed"]
+            if last is None or now - last >= self.refresh_interval(now - video["publishedAt"]):
+                due.append((-video["publishedAt"], video_id))
+
+        return [video_id for _, video_id in sorted(due)]
+
+    ##### Requests #####
+
+    async def poll_uploads(self, semaphore=None):
+        """Checks the channel's uploads playlist for videos we don't know about yet. The playlist is
+        newest first, so paging stops at the first page that holds no new videos.
+
+        Paging also stops when the quota budget is spent (e.g. the first poll of a large channel with no
+        saved state). The next page is saved and the next poll carries on from it after checking the first
+        page for new uploads.
+
+        Returns
+        -------
+        new_video_ids : list
+        """
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        key = self.yt_stats.api_key
+
+        if self.uploads_playlist_id is None:
+            if self._quota_remaining(time.time()) < QUOTA_COSTS.get("channels", 1):
+                return []
+            data = await self._get(f"{API_URL}/channels?part=contentDetails&id={self.yt_stats.channel_id}"
+                                   f"&key={key}", semaphore)
+            try:
+                self.uploads_playlist_id = data["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+            except (KeyError, IndexError) as e:
+                print(f"Uploads playlist not found ({type(e).__name__}: {e})")
+                return []
+
+        new_video_ids = []
+        page_token = None
+        while True:
+            if self._quota_remaining(time.time()) < QUOTA_COSTS.get("playlistItems", 1):
+                print("Quota budget reached: the uploads poll continues on a later tick")
+                if page_token is not None:
+                    self.poll_page_token = page_token
+                break
+
+            url = (f"{API_URL}/playlistItems?part=contentDetails&maxResults={BATCH_SIZE}"
+                   f"&playlistId={self.uploads_playlist_id}&key={key}")
+            if page_token:
+                url += f"&pageToken={page_token}"
+
+            # the first page is polled every time (and is usually unchanged); later pages aren't
+            data = await self._get(url, semaphore, cache=page_token is None)
+            if "items" not in data:
+                print(f"playlistItems request failed: {data.get('error', {}).get('message')}")
+                break
+
+            page_new = 0
+            for item in data["items"]:
+                video_id = item["contentDetails"]["videoId"]
+                published_at = item["contentDetails"].get("videoPublishedAt")
+                if video_id not in self.videos and published_at:
+                    self.videos[video_id] = {"publishedAt": _to_epoch_seconds(published_at), "lastRefreshed": None}
+                    new_video_ids.append(video_id)
+                    page_new += 1
+
+            page_token = data.get("nextPageToken")
+            if page_token is None:
+                # reached the oldest upload
+                self.poll_page_token = None
+                break
+            if page_new == 0:
+                # caught up with the known videos; carry on where a poll cut short by the budget stopped
+                if self.poll_page_token is None:
+                    break
+                page_token, self.poll_page_token = self.poll_page_token, None
+
+        self.last_poll = time.time()
+        if new_video_ids:
+            print(f"{len(new_video_ids)} new videos")
+
+        return new_video_ids
+
+    async def _refresh_batch(self, video_ids, semaphore):
+        ids = ",".join(video_ids)
+        data = await self._get(f"{API_URL}/videos?part=statistics&id={ids}&key={self.yt_stats.api_key}",
+                               semaphore, cache=False)
+        snapshot_ts = int(time.time())  # the store keeps whole seconds since the epoch
+
+        if "items" not in data:
+            print(f"videos request failed: {data.get('error', {}).get('message')}")
+            return 0
+
+        stats = {item["id"]: item.get("statistics", {}) for item in data["items"]}
+        found = [video_id for video_id in video_ids if video_id in stats]
+
+        # videos that were deleted or made private are no longer returned; stop refreshing them
+        for video_id in set(video_ids) - set(found):
+            self.videos.pop(video_id, None)
+
+        self.store.append(found, snapshot_ts,
+                          [stats[v].get("viewCount") for v in found],
+                          [stats[v].get("likeCount") for v in found],
+                          [stats[v].get("commentCount") for v in found])
+
+        for video_id in found:
+            self.videos[video_id]["lastRefreshed"] = snapshot_ts
+
+        return len(found)
+
+    async def refresh(self, video_ids, semaphore=None):
+        """Refreshes the statistics of `video_ids` in batches of 50, writing each batch to the store as it
+        arrives. Only as many batches as the remaining quota allows are requested.
+
+        Returns
+        -------
+        n : int
+            Number of videos refreshed.
+        """
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        batches = [video_ids[i:i + BATCH_SIZE] for i in range(0, len(video_ids), BATCH_SIZE)]
+
+        affordable = max(0, self._quota_remaining(time.time()) // QUOTA_COSTS["videos"])
+        if len(batches) > affordable:
+            print(f"Quota budget reached: refreshing {affordable} of {len(batches)} batches")
+            batches = batches[:affordable]
+
+        results = await asyncio.gather(*(self._refresh_batch(batch, semaphore) for batch in batches))
+        return sum(results)
+
+    ##### Loop #####
+
+    async def tick(self):
+        """Runs one collection cycle: poll for uploads if due, then refresh every due video.
+
+        Returns
+        -------
+        n : int
+            Number of videos refreshed.
+        """
+        now = time.time()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        with span("collector.tick") as record:
+            if self.last_poll is None or now - self.last_poll >= self.poll_interval_seconds:
+                if self._quota_remaining(now) > 0:
+                    await self.poll_uploads(semaphore)
+
+            n = await self.refresh(self.due_videos(now), semaphore)
+            self.save_state()
+
+            if record is not None:
+                record["rows_out"] = n
+
+        if n:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}: refreshed {n} videos "
+                  f"(quota used today: {self.quota_spent}/{self.daily_quota_budget})")
+        return n
+
+    async def run(self, max_ticks=None):
+        """Runs ticks every `tick_seconds` until cancelled (or for `max_ticks` ticks)."""
+        ticks = 0
+        while max_ticks is None or ticks < max_ticks:
+            started = time.time()
+            await self.tick()
+            ticks += 1
+            if max_ticks is None or ticks < max_ticks:
+                await asyncio.sleep(max(0.0, self.tick_seconds - (time.time() - started)))
+
+    def run_forever(self, max_ticks=None):
+        """Blocking entry point: runs the collector until interrupted (Ctrl+C), saving its state on exit."""
+        try:
+            asyncio.run(self.run(max_ticks=max_ticks))
+        except KeyboardInterrupt:
+            print("Collector stopped.")
+        finally:
+            self.save_state()
@@ -0,0 +1,243 @@
+# comment_harvester.py
+"""Contains the class that downloads the comments of many videos at once from the YouTube API's
+commentThreads endpoint and streams them to line-delimited JSON files as they arrive.
+
+- Videos are harvested concurrently: a pool of workers each pages through one video at a time (a video's
+  pages have to be fetched in order, since each page gives the token for the next).
+- All workers share one rate limit (requests per second) and one quota budget (1 unit per page).
+- Each page is appended to <output_folder>/<video_id>.jsonl (one comment per line) as soon as it arrives,
+  so only one page per worker is ever held in memory.
+- After each page the video's next page token is saved to a checkpoint file, so a harvest that is stopped
+  (or runs out of quota) carries on from where it left off when run again.
+
+Usage (from the repository root):
+
+    python -m src comments --top 10
+    python -m src comments --video-id uaI_p7L3128 --video-id O5qbZOxtc9E
+
+Class CommentHarvester:
+- `CommentHarvester(yt_stats, output_folder="data/raw/comments", checkpoint_path=None, workers=8,
+  requests_per_second=10, quota_budget=2000, max_pages_per_video=None)`
+
+CommentHarvester methods:
+- `harvest(self, video_ids)`
+- `harvest_async(self, video_ids)`
+- `iter_comments(self, video_id)`
+- `save_checkpoints(self)`
+
+Resources
+----------
+commentThreads: list:
+    https://developers.google.com/youtube/v3/docs/commentThreads/list
+
+"""
+
+import asyncio
+import os
+import time
+
+from src.monitoring.instrumentation import span
+from src.utils import json_codec
+
+
+API_URL = "https://www.googleapis.com/youtube/v3"
+
+
+class _RateLimiter:
+    """Spaces out requests so that, across all workers, no more than `requests_per_second` are started
+    per second."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _comment_record(video_id, comment, thread_id, is_reply):
+    """Flattens a comment resource into the record written to the output file."""
+    snippet = comment.get("snippet", {})
+    return {"videoID": video_id,
+            "commentId": comment.get("id"),
+            "threadId": thread_id,
+            "isReply": is_reply,
+            "authorDisplayName": snippet.get("authorDisplayName"),
+            "textOriginal": snippet.get("textOriginal"),
+            "likeCount": snippet.get("likeCount"),
+            "publishedAt": snippet.get("publishedAt"),
+            "updatedAt": snippet.get("updatedAt")}
+
+
+def _page_records(video_id, data):
+    """Yields the records of a commentThreads page: each top level comment followed by the replies
+    included with it."""
+    for thread in data.get("items", []):
+        thread_snippet = thread.get("snippet", {})
+        top_level = thread_snippet.get("topLevelComment", {})
+        record = _comment_record(video_id, top_level, thread.get("id"), False)
+        record["totalReplyCount"] = thread_snippet.get("totalReplyCount", 0)
+        yield record
+
+        for reply in thread.get("replies", {}).get("comments", []):
+            yield _comment_record(video_id, reply, thread.get("id"), True)
+
+
+class CommentHarvester:
+    """Harvests comment threads for many videos concurrently.
+
+    Parameters
+    ----------
+    yt_stats : YouTubeStats
+        Used for its api key and `_get` (retries and request metrics).
+
+    output_folder : string
+        Folder for the <video_id>.jsonl files.
+
+    checkpoint_path : string
+        JSON file with each video's progress. Defaults to <output_folder>/_checkpoints.json.
+
+    workers : int
+        Number of videos harvested at the same time.
+
+    requests_per_second : float
+        Shared limit on the rate requests are started, across all workers.
+
+    quota_budget : int
+        Maximum quota units (pages) to spend in this run.
+
+    max_pages_per_video : int
+        Optional cap on the pages (100 threads each) fetched per video in this run.
+
+    """
+
+    def __init__(self, yt_stats, output_folder="data/raw/comments", checkpoint_path=None, workers=8,
+                 requests_per_second=10, quota_budget=2000, max_pages_per_video=None):
+        self.yt_stats = yt_stats
+        self.output_folder = output_folder
+        self.checkpoint_path = checkpoint_path or os.path.join(output_folder, "_checkpoints.json")
+        self.workers = workers
+        self.requests_per_second = requests_per_second
+        self.quota_budget = quota_budget
+        self.max_pages_per_video = max_pages_per_video
+
+        # video_id -> {"next_page_token": str or None, "done": bool, "pages": int, "comments": int, "error": str}
+        self.checkpoints = {}
+        if os.path.exists(self.checkpoint_path):
+            self.checkpoints = json_codec.load(self.checkpoint_path)
+
+        self.quota_spent = 0
+
+    def save_checkpoints(self):
+        """Writes every video's progress to `checkpoint_path`."""
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        json_codec.dump(self.checkpoints, self.checkpoint_path + ".tmp")
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def _output_path(self, video_id):
+        return os.path.join(self.output_folder, f"{video_id}.jsonl")
+
+    async def _harvest_video(self, video_id, limiter):
+        checkpoint = self.checkpoints.setdefault(video_id, {"next_page_token": None, "done": False,
+                                                            "pages": 0, "comments": 0, "error": None})
+        pages_this_run = 0
+
+        while not checkpoint["done"]:
+            if self.quota_spent >= self.quota_budget:
+                return
+            if self.max_pages_per_video is not None and pages_this_run >= self.max_pages_per_video:
+                return
+
+            url = (f"{API_URL}/commentThreads?part=snippet,replies&videoId={video_id}&maxResults=100"
+                   f"&textFormat=plainText&key={self.yt_stats.api_key}")
+            if checkpoint["next_page_token"]:
+                url += f"&pageToken={checkpoint['next_page_token']}"
+
+            # reserve the quota unit before waiting, so workers can't overshoot the budget between them
+            self.quota_spent += 1
+            await limiter.wait()
+            # pages are only requested once, so they aren't kept for conditional requests
+            data = await asyncio.to_thread(self.yt_stats._get, url, cache=False)
+
+            if "error" in data:
+                errors = data["error"].get("errors") or [{}]
+                reason = errors[0].get("reason") or data["error"].get("message")
+                # comments turned off or the video removed: nothing to harvest, don't try again
+                if reason in ("commentsDisabled", "videoNotFound", "forbidden"):
+                    checkpoint.update(done=True, error=reason)
+                else:
+                    print(f"{video_id}: commentThreads request failed ({reason})")
+                    checkpoint["error"] = reason
+                self.save_checkpoints()
+                return
+
+            # append the page to the video's file before recording the page token, so a crash can at
+            # worst repeat a page (`iter_comments` drops the repeats)
+            n = json_codec.write_lines(_page_records(video_id, data), self._output_path(video_id), append=True)
+
+            checkpoint["next_page_token"] = data.get("nextPageToken")
+            checkpoint["done"] = checkpoint["next_page_token"] is None
+            checkpoint["pages"] += 1
+            checkpoint["comments"] += n
+            checkpoint["error"] = None
+            pages_this_run += 1
+            self.save_checkpoints()
+
+    async def harvest_async(self, video_ids):
+        """Coroutine version of `harvest`."""
+        os.makedirs(self.output_folder, exist_ok=True)
+        limiter = _RateLimiter(self.requests_per_second)
+
+        queue = asyncio.Queue()
+        for video_id in dict.fromkeys(video_ids):
+            if not self.checkpoints.get(video_id, {}).get("done"):
+                queue.put_nowait(video_id)
+
+        async def worker():
+            while not queue.empty():
+                video_id = queue.get_nowait()
+                await self._harvest_video(video_id, limiter)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, queue.qsize()))))
+
+    def harvest(self, video_ids):
+        """Harvests the comments of `video_ids`, skipping videos already finished in a previous run.
+
+        Returns
+        -------
+        summary : dict
+            Comments and pages fetched so far for each video, and whether it is finished.
+        """
+        with span("comments.harvest", rows_in=len(video_ids)) as record:
+            asyncio.run(self.harvest_async(video_ids))
+            if record is not None:
+                record["rows_out"] = sum(self.checkpoints.get(v, {}).get("comments", 0) for v in video_ids)
+
+        if self.quota_spent >= self.quota_budget:
+            print(f"Quota budget of {self.quota_budget} units reached; run again to continue.")
+
+        summary = {video_id: self.checkpoints.get(video_id) for video_id in video_ids}
+        done = sum(1 for c in summary.values() if c and c["done"])
+        comments = sum(c["comments"] for c in summary.values() if c)
+        print(f"{comments} comments, {done}/{len(video_ids)} videos finished ({self.quota_spent} quota units)")
+        return summary
+
+    def iter_comments(self, video_id):
+        """Yields the harvested comments of `video_id` one at a time, skipping any repeated by a resumed
+        harvest."""
+        path = self._output_path(video_id)
+        if not os.path.exists(path):
+            return
+
+        seen = set()
+        for record in json_codec.iter_lines(path):
+            if record["commentId"] in seen:
+                continue
+            seen.add(record["commentId"])
+            yield record
@@ -7,19 +7,30 @@ Class YouTubeStats:
 
 YouTubeStats methods:
 - `get_channel_statistics(self)`
-- `get_videos_data(self)`
-- `get_video_ids(self, limit=None)`
+- `get_videos_data(self, compact=False, partition=False)`
+- `get_video_ids(self, limit=None, partition=False)`
 - `get_video_ids_per_page(self, url)`
 - `_get_single_video_data(self, video_id, part)`
-- `export_to_json(self)`
+- `_get(self, url, cache=True)`
+- `last_request_attempts(self)`
+- `export_to_json(self, pretty=True)`
 
 """
 
-import requests
 import os
-import json
+import threading
+import time
+from collections import OrderedDict
 # import datetime as dt
-from tqdm import tqdm
+
+import requests
+
+from src.api.api_metrics import REGISTRY, endpoint_from_url
+from src.api.video_record import VideoRecord
+from src.monitoring.instrumentation import instrument, count
+from src.utils import json_codec
+
+ETAG_CACHE_SIZE = 256  # responses kept for conditional requests (see `YouTubeStats._get`)
 
 
 class YouTubeStats:
@@ -32,7 +43,12 @@ class YouTubeStats:
     
     """
 
-    def __init__(self, api_key, channel_id, published_before, published_after):
+    # number of times a request is retried after a 429/5xx response or a connection error, and the delay
+    # before the first retry (doubled for each further retry)
+    max_retries = 3
+    retry_backoff_seconds = 1.0
+
+    def __init__(self, api_key, channel_id, published_before, published_after, metrics=None):
         """Initialises a YT class, passing the relevant api key and channel id.
 
         Parameters
@@ -63,6 +79,10 @@ class YouTubeStats:
             Datetime value in a string format to specify the date range that we'll gather video data from.
                 - Format: "1970-01-01T00:00:00Z"
 
+        metrics: MetricsRegistry
+            Registry that records per-endpoint request metrics. Defaults to the shared
+            `src.api.api_metrics.REGISTRY`.
+
         """
 
         self.api_key = api_key
@@ -72,7 +92,18 @@ class YouTubeStats:
         self.channel_title = None
         self.channel_statistics = None
         self.video_data = None
-
+        # UTC time the video statistics were fetched, saved as 'fetchedAt' so overlapping files can be merged
+        self.fetched_at = None
+        self.metrics = metrics if metrics is not None else REGISTRY
+        # ETag and response body of recent requests, keyed by url, for conditional (If-None-Match) requests;
+        # least recently used first, bounded by `etag_cache_size` (a lock, as workers call `_get` in threads)
+        self.etag_cache_size = ETAG_CACHE_SIZE
+        self._etag_cache = OrderedDict()
+        self._etag_lock = threading.Lock()
+        # number of requests sent by the last `_get` call, per thread (see `last_request_attempts`)
+        self._request_state = threading.local()
+
+    @instrument("api.get_channel_statistics")
     def get_channel_statistics(self):
         """Uses a GET request to the 'channels' resource (list method) of the YouTube API to obtain
         snippet data (channel title, channel description) and statistics data (video count,
@@ -95,22 +126,18 @@ class YouTubeStats:
               f"key={self.api_key}"
         print(url)
         
-        # send get request and store the response
-        json_url = requests.get(url)
-        # print(json_url)
-
-        # convert the JSON response into a python dictionary
-        data = json.loads(json_url.text)
+        # send get request and convert the JSON response into a python dictionary
+        data = self._get(url)
         # print(data)
 
         # store only the channel stats elements of the response
         try:
             channel_stats_data = data["items"][0]["statistics"]
 
-        except Exception as e:  # TODO: this is bad practice - implement better
-            # exception handling and logging
-            print("An unexpected error occurred: {e}")     
-            channel_stats_data = None
+        except (KeyError, IndexError) as e:
+            print(f"Channel statistics not found in response ({type(e).__name__}: {e}): "
+                  f"{data.get('error', {}).get('message', 'no items returned')}")
+            return data
 
         # get name of channel
         channel_title = data["items"][0]["snippet"]["title"].replace(" ", "_").lower()
@@ -126,7 +153,8 @@ class YouTubeStats:
         # return the python dictionary of the JSON response
         return data
 
-    def get_videos_data(self):
+    @instrument("api.get_videos_data")
+    def get_videos_data(self, compact=False, partition=False):
         """Function performs two tasks by calling two other functions: 
             1. It calls the `get_video_ids` helper function which in turn calls the `get_video_ids_per_page`
             function, to obtain all the video ids and store them in a dictionary,
@@ -136,15 +164,31 @@ class YouTubeStats:
             will then store this data in the dictionary, so we are left with a dictionary that has a video id as a key
             and a dictionary of data related to that video as the value.
 
+        Parameters
+        -----------
+        compact: bool
+            If True each video is stored as a `VideoRecord`, which keeps only the fields used in the analysis
+            (the ones `drop_columns` doesn't drop) with the counts as integers; this uses a fraction of the
+            memory of the full responses. If False (default) the full response of every part is kept, as
+            dictionaries (the layout `SnapshotStore.append_video_data` and the raw files use).
+
+        partition: bool
+            If True the date range is split automatically into windows small enough for the search endpoint
+            to return in full (see `get_video_ids`), so it doesn't need to be picked by hand.
+
         Returns
         -------
         channel_videos: dict
-            Dictionary with video id as key and a dictionary of associated data as its value.
+            Dictionary with video id as key and a `VideoRecord` (or, if `compact` is False, a dictionary of
+            associated data) as its value.
         """
 
+        # imported here so scripts that don't fetch video data don't pay for it
+        from tqdm import tqdm
+
         print("Getting video IDs...")
         # 1) get video ids
-        channel_videos = self.get_video_ids(limit=50)
+        channel_videos = self.get_video_ids(limit=50, partition=partition)
         print(f"Video IDs obtained...")
         # print(f"Length of channel videos dictionary: {len(channel_videos)}\n")
         # print(f"Channel videos dictionary (this should be a dictionary with only keys):\n{channel_videos}")
@@ -164,15 +208,26 @@ class YouTubeStats:
         # print("Creating copy of dictionary\nLooping through dictionary...\n")
         channel_videos_copy = channel_videos.copy()
 
+        # with compact=True each video's data goes straight into a record, so the full responses are
+        # discarded as soon as the fields we keep have been copied out
+        if compact:
+            channel_videos = {video_id: VideoRecord(video_id) for video_id in channel_videos_copy}
+
         # loop through every video id we have and the specified 'parts' to obtain the data we want about each video
         for video_id in tqdm(channel_videos_copy):
             for part in parts:
                 # call function to obtain the data and place th data returned into the channel video dictionary
                 data = self._get_single_video_data(video_id, part)
-                channel_videos[video_id].update({part: data})
+                if compact:
+                    channel_videos[video_id].set_part(part, data)
+                else:
+                    channel_videos[video_id].update({part: data})
 
         print(f"{parts} data obtained.")
 
+        # record when the statistics were fetched (ISO 8601 UTC, which sorts correctly as a string)
+        self.fetched_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
         # store the dictionary of video ids (key) and their associated value (dictionary with stats about the video)
         self.video_data = channel_videos
 
@@ -180,10 +235,21 @@ class YouTubeStats:
         # video id).
         return channel_videos
 
-    def get_video_ids(self, limit=None):
+    @instrument("api.get_video_ids")
+    def get_video_ids(self, limit=None, partition=False):
         """Defines the URL that will be used by `get_video_ids_per_page` function and then
         calls this function to return a dictionary with the video ids as keys.
 
+        Parameters
+        -----------
+        limit: int
+            Results per page (maxResults).
+
+        partition: bool
+            If True the search is handed to `SearchPartitioner`, which splits the date range into windows
+            small enough to be returned in full and fetches them concurrently. Otherwise a single search is
+            paged through (at most 12 pages, so a range with more videos than that loses the rest).
+
         Returns
         --------
         video_ids: Dict
@@ -191,6 +257,12 @@ class YouTubeStats:
         
         """
 
+        if partition:
+            from src.api.search_partitioner import SearchPartitioner
+
+            return SearchPartitioner(self, channel_id=self.channel_id).video_ids(self.published_after,
+                                                                                 self.published_before)
+
         # set the url
         url = f"https://www.googleapis.com/youtube/v3/search?key={self.api_key}&channelId={self.channel_id}&" \
               f"part=id&order=date&publishedAfter={self.published_after}&publishedBefore={self.published_before}"
@@ -219,6 +291,7 @@ class YouTubeStats:
         # return video_ids dictionary (should be a dictionary of keys (video id) and values are empty dictionaries
         return video_ids
 
+    @instrument("api.get_video_ids_per_page")
     def get_video_ids_per_page(self, url):
         """Uses a GET request to the YouTube API using the 'search: list' method and obtains the Ids 
         of all of the videos returned in the JSON response.
@@ -255,14 +328,9 @@ class YouTubeStats:
         
         """
 
-        # store the JSON response in a variable; the url parameter is specified in the get_video_ids
-        # helper function
-        json_url = requests.get(url)
-        print(json_url)
-        
-        # use json.loads() to load the JSON string into a python dictionary (essentially convert the JSON response
-        # into a Python dictionary)
-        data = json.loads(json_url.text)  # text gives us the raw text)
+        # send the GET request and convert the JSON response into a Python dictionary; the url parameter is
+        # specified in the get_video_ids helper function
+        data = self._get(url)
         # print(data)
 
         # create an empty dictionary; this dictionary will eventually hold the video data, with the
@@ -272,6 +340,8 @@ class YouTubeStats:
         # we need the 'items' key to exist in the response in order to access the data we want so we check
         # if it exists and return nothing if it doesn't
         if "items" not in data:
+            if "error" in data:
+                print(f"search request failed: {data['error'].get('message')}")
             return channel_videos, None
 
         # store the 'items' in a variable; each item is a dictionary and so the 'item_data' variable will be
@@ -308,6 +378,7 @@ class YouTubeStats:
         # next_page_token, so we can get to the next page of results (if there is a next page)
         return channel_videos, next_page_token
 
+    @instrument("api._get_single_video_data")
     def _get_single_video_data(self, video_id, part):
         """Retrieves data related to a single video id by making a GET request which, within the
         URL, contains the 'part=' parameter which will determine the data returned. (The 'part'
@@ -333,29 +404,122 @@ class YouTubeStats:
 
         url = f"https://www.googleapis.com/youtube/v3/videos?part={part}&id={video_id}&key={self.api_key}"
 
-        json_url = requests.get(url)
-        data = json.loads(json_url.text)
+        data = self._get(url)
 
         try:
             data = data["items"][0][part]
             # print(f"Data obtained for video id: {video_id}, {part}\n")
             # print(f"{data}\n")
 
-        except Exception as e:
-            print("An unexpected error occurred: {e}")
+        except (KeyError, IndexError) as e:
+            print(f"No '{part}' data for video {video_id} ({type(e).__name__}: {e})")
             data = {}
 
         return data
 
-    def export_to_json(self):
+    def _get(self, url, cache=True):
+        """Sends a GET request to the YouTube API and returns the JSON response as a dictionary.
+
+        Every request is recorded in `self.metrics` (latency, bytes, status class, quota units). Responses
+        with status 429 or 5xx, and connection errors, are retried up to `max_retries` times with
+        exponential backoff. If a previous response for the same url had an ETag, the request is made
+        conditional and a 304 (Not Modified) response returns the cached body. The cache keeps the
+        `etag_cache_size` most recently used urls.
+
+        Parameters
+        -----------
+        url: str
+            The full request url (including the api key).
+
+        cache: bool
+            If False the response isn't kept for conditional requests. Use it for urls that are requested
+            once (pages of a paged listing, batches of video IDs), so their bodies don't stay in memory.
+
+        Returns
+        -------
+        data: dict
+            The JSON response; on failure a dictionary with an 'error' key.
+        """
+        endpoint = endpoint_from_url(url)
+        cached = None
+        if cache:
+            with self._etag_lock:
+                cached = self._etag_cache.get(url)
+                if cached:
+                    self._etag_cache.move_to_end(url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+
+        for attempt in range(self.max_retries + 1):
+            self._request_state.attempts = attempt + 1
+            start = time.perf_counter()
+            try:
+                response = requests.get(url, headers=headers, timeout=30)
+
+            except requests.RequestException as e:
+                self.metrics.record_request(endpoint, time.perf_counter() - start, None)
+                count(requests=1)
+                if attempt < self.max_retries:
+                    self.metrics.record_retry(endpoint)
+                    time.sleep(self.retry_backoff_seconds * 2 ** attempt)
+                    continue
+                print(f"{endpoint} request failed: {type(e).__name__}: {e}")
+                return {"error": {"code": None, "message": str(e)}}
+
+            self.metrics.record_request(endpoint, time.perf_counter() - start, response.status_code,
+                                        len(response.content))
+            count(requests=1, bytes_fetched=len(response.content))
+
+            if response.status_code == 304 and cached:
+                return json_codec.loads(cached[1])
+
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < self.max_retries:
+                self.metrics.record_retry(endpoint)
+                time.sleep(self.retry_backoff_seconds * 2 ** attempt)
+                continue
+
+            break
+
+        try:
+            data = json_codec.loads(response.content)
+        except ValueError:
+            print(f"{endpoint} returned a non-JSON response (status {response.status_code})")
+            return {"error": {"code": response.status_code, "message": response.text[:200]}}
+
+        if cache and response.ok and "etag" in response.headers:
+            with self._etag_lock:
+                self._etag_cache[url] = (response.headers["etag"], response.content)
+                self._etag_cache.move_to_end(url)
+                while len(self._etag_cache) > self.etag_cache_size:
+                    self._etag_cache.popitem(last=False)
+
+        return data
+
+    def last_request_attempts(self):
+        """Returns the number of requests the last `_get` call in the current thread sent (1 plus any
+        retries), so callers can charge every attempt to their quota."""
+        return getattr(self._request_state, "attempts", 0)
+
+    @instrument("api.export_to_json")
+    def export_to_json(self, pretty=True):
         """Dumps the data into a .json file and saves it in the data > processed folder.
+
+        Parameters
+        -----------
+        pretty: bool
+            If True (default) the file is indented so the raw response is easy to read; set to False to
+            write compact JSON, which is faster to write and read.
         """
         if self.channel_statistics is None or self.video_data is None:
             print("Data is none.")
             return
         
+        # convert any compact records back to the JSON layout of the raw files
+        video_data = {video_id: data.to_json() if isinstance(data, VideoRecord) else data
+                      for video_id, data in self.video_data.items()}
+
         fused_data = {self.channel_id: {"channel_statistics": self.channel_statistics, 
-                                        "video_data": self.video_data}}
+                                        "video_data": video_data,
+                                        "fetchedAt": self.fetched_at}}
         
         # create a timestamp for file name
         # time = dt.datetime.now().strftime("%Y-%m-%d--%H:%M:%S")
@@ -374,7 +538,6 @@ class YouTubeStats:
         # join cwd, folder name and file name to set the file path
         file_path = os.path.join(current_working_directory, data_processed_folder, file_name)
         
-        with open(file_path, 'w') as f:
-            json.dump(fused_data, f, indent=4)  # indent is optional formatting parameter
+        json_codec.dump(fused_data, file_path, pretty=pretty)
 
         print(f"\n\nFile: {file_name}\nSaved: {file_path}")
@@ -0,0 +1,210 @@
+# playlist_series.py
+"""Contains the class that works out which video series each video belongs to from the channel's playlists,
+instead of from words in the video titles.
+
+Title matching (`split_into_video_series`) misses episodes whose titles were written differently (e.g.
+"Si Ferry Meets..." rather than "Open Goal Meets") and scans every title once per series. The channel keeps
+each series in a playlist, so the playlists give the exact list of episodes:
+
+- `playlists.list` returns 50 playlists per request (1 quota unit), with each playlist's item count and ETag
+- `playlistItems.list` returns 50 video IDs per request (1 quota unit)
+
+The playlists and their video IDs are cached in a JSON file. A refresh lists the playlists again (usually a
+single request) and only fetches the items of playlists whose ETag or item count has changed, so keeping the
+mapping up to date costs a few quota units. The videoID -> series mapping is a dictionary, so it is joined
+onto a dataframe with one hash lookup per video (see `src.processing.chop_dataframe.add_series_column`).
+
+Usage:
+
+    series_map = PlaylistSeriesMap(yt_stats)
+    series_map.refresh()
+    df_meets = split_into_video_series(df, "Open Goal Meets", series_map=series_map)
+
+Class PlaylistSeriesMap:
+- `PlaylistSeriesMap(yt_stats, cache_path="data/playlist_series.json")`
+- `PlaylistSeriesMap.from_cache(cache_path="data/playlist_series.json")`
+
+PlaylistSeriesMap methods:
+- `refresh(self)`
+- `save(self)`
+- `playlist_titles(self)`
+- `video_series(self, series_titles=None)`
+- `series_video_ids(self, series_title)`
+
+Resources
+----------
+playlists: list:
+    https://developers.google.com/youtube/v3/docs/playlists/list
+
+playlistItems: list:
+    https://developers.google.com/youtube/v3/docs/playlistItems/list
+
+"""
+
+import os
+import time
+
+from src.monitoring.instrumentation import span
+from src.utils import json_codec
+
+
+API_URL = "https://www.googleapis.com/youtube/v3"
+BATCH_SIZE = 50  # maximum results per page for both endpoints
+
+
+class PlaylistSeriesMap:
+    """Cached mapping from the channel's playlists (series) to their videos.
+
+    Parameters
+    ----------
+    yt_stats : YouTubeStats
+        Used for its api key, channel id and `_get` (retries and request metrics).
+
+    cache_path : string
+        JSON file holding the playlists and their video IDs between runs.
+
+    """
+
+    def __init__(self, yt_stats, cache_path="data/playlist_series.json"):
+        self.yt_stats = yt_stats
+        self.cache_path = cache_path
+
+        # playlist_id -> {"title": str, "itemCount": int, "etag": str, "videoIds": [str]}
+        self.playlists = {}
+        self.updated = None
+        self.quota_spent = 0
+
+        if os.path.exists(cache_path):
+            cache = json_codec.load(cache_path)
+            if cache.get("channelId") == yt_stats.channel_id:
+                self.playlists = cache["playlists"]
+                self.updated = cache.get("updated")
+
+    @classmethod
+    def from_cache(cls, cache_path="data/playlist_series.json"):
+        """Loads the mapping saved by an earlier `refresh` without an API connection (so it can't be refreshed).
+        A missing file gives an empty mapping."""
+        series_map = cls.__new__(cls)
+        series_map.yt_stats = None
+        series_map.cache_path = cache_path
+        series_map.playlists, series_map.updated, series_map.quota_spent = {}, None, 0
+        if os.path.exists(cache_path):
+            cache = json_codec.load(cache_path)
+            series_map.playlists = cache["playlists"]
+            series_map.updated = cache.get("updated")
+        return series_map
+
+    def save(self):
+        """Writes the playlists and their video IDs to `cache_path`."""
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        cache = {"channelId": self.yt_stats.channel_id, "updated": self.updated, "playlists": self.playlists}
+        json_codec.dump(cache, self.cache_path + ".tmp", pretty=True)
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+
+    def _get_pages(self, url):
+        """Yields every page of a paged list request, stopping early if a request fails."""
+        page_token = None
+        while True:
+            # only the first page is requested again on the next refresh, so later pages aren't cached
+            data = self.yt_stats._get(url + (f"&pageToken={page_token}" if page_token else ""),
+                                      cache=page_token is None)
+            self.quota_spent += 1
+            if "items" not in data:
+                message = data.get("error", {}).get("message")
+                print(f"{url.split('?')[0].rsplit('/', 1)[-1]} request failed: {message}")
+                raise RuntimeError(message)
+
+            yield data
+            page_token = data.get("nextPageToken")
+            if page_token is None:
+                return
+
+    def _playlist_video_ids(self, playlist_id):
+        url = (f"{API_URL}/playlistItems?part=contentDetails&maxResults={BATCH_SIZE}"
+               f"&playlistId={playlist_id}&key={self.yt_stats.api_key}")
+        return [item["contentDetails"]["videoId"] for data in self._get_pages(url) for item in data["items"]]
+
+    def refresh(self):
+        """Brings the cached playlists up to date: lists the channel's playlists and fetches the items of the
+        new or changed ones. Playlists that no longer exist are removed. If a request fails the playlists
+        fetched so far are kept and the rest are tried again on the next refresh.
+
+        Returns
+        -------
+        changed : list
+            IDs of the playlists whose videos were fetched.
+        """
+        self.quota_spent = 0
+        changed = []
+
+        with span("playlists.refresh") as record:
+            url = (f"{API_URL}/playlists?part=snippet,contentDetails&maxResults={BATCH_SIZE}"
+                   f"&channelId={self.yt_stats.channel_id}&key={self.yt_stats.api_key}")
+            try:
+                listed = {item["id"]: item for data in self._get_pages(url) for item in data["items"]}
+            except RuntimeError:
+                return changed
+
+            for playlist_id in [p for p in self.playlists if p not in listed]:
+                del self.playlists[playlist_id]
+
+            for playlist_id, item in listed.items():
+                cached = self.playlists.get(playlist_id)
+                item_count = item["contentDetails"]["itemCount"]
+                if cached and cached["etag"] == item["etag"] and cached["itemCount"] == item_count:
+                    continue
+
+                try:
+                    video_ids = self._playlist_video_ids(playlist_id)
+                except RuntimeError:
+                    break
+
+                self.playlists[playlist_id] = {"title": item["snippet"]["title"], "itemCount": item_count,
+                                               "etag": item["etag"], "videoIds": video_ids}
+                changed.append(playlist_id)
+
+            self.updated = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            self.save()
+            if record is not None:
+                record["rows_out"] = len(self.playlists)
+
+        print(f"{len(self.playlists)} playlists, {len(changed)} fetched ({self.quota_spent} quota units)")
+        return changed
+
+    def playlist_titles(self):
+        """Returns {playlist_id: title}."""
+        return {playlist_id: playlist["title"] for playlist_id, playlist in self.playlists.items()}
+
+    def _matching_playlists(self, series_title):
+        # a series is every playlist whose title contains the series title (case insensitive), so
+        # "Open Goal Meets" also picks up e.g. "Open Goal Meets... (2023)"
+        series_title = series_title.lower()
+        return [p for p in self.playlists.values() if series_title in p["title"].lower()]
+
+    def series_video_ids(self, series_title):
+        """Returns the set of video IDs in the playlists of `series_title`."""
+        return {video_id for playlist in self._matching_playlists(series_title) for video_id in playlist["videoIds"]}
+
+    def video_series(self, series_titles=None):
+        """Returns {videoID: series}.
+
+        Parameters
+        ----------
+        series_titles : list
+            Series to label, e.g. ["Keeping the Ball on the Ground", "Open Goal Meets"]; each is matched to
+            playlists by title. A video in more than one series gets the first series in the list. If None,
+            every playlist is a series named after its title.
+        """
+        mapping = {}
+        if series_titles is None:
+            for playlist in self.playlists.values():
+                for video_id in playlist["videoIds"]:
+                    mapping.setdefault(video_id, playlist["title"])
+            return mapping
+
+        if isinstance(series_titles, str):
+            series_titles = [series_titles]
+        for series_title in series_titles:
+            for video_id in self.series_video_ids(series_title):
+                mapping.setdefault(video_id, series_title)
+        return mapping
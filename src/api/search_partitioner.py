@@ -0,0 +1,204 @@
+# search_partitioner.py
+"""Contains the class that harvests every video a search.list query matches over a date range, by splitting
+the range into windows small enough for the search endpoint to return in full.
+
+search.list stops returning results after about 500 per query (10 pages of 50), and `get_video_ids` stops
+after 12 pages, so a date window with more matching videos than that silently loses the rest. Until now the
+windows were picked by hand (a year at a time, half-years for 2022). The partitioner picks them instead:
+
+1. The first page of a window is requested. Its `pageInfo.totalResults` says how many videos match.
+2. If that is more than `max_results`, the window is split into ceil(totalResults / max_results) equal parts
+   (at least two) and each part is handled the same way (recursively, and concurrently). Splitting into as
+   many parts as the estimate needs, rather than always in half, saves the calls that would size the
+   intermediate windows.
+3. Otherwise the window is a leaf: the rest of its pages are fetched, carrying on from the first page, so
+   the request used to size the window is never wasted. totalResults is an estimate, so if the pages run
+   past `max_results` after all, the window is split in half and the halves are searched as well.
+
+Every search call costs 100 quota units. Each leaf costs exactly the pages its results need; the only extra
+calls are one per window that had to be split. Leaf windows share their boundaries (publishedBefore of one
+is publishedAfter of the next), so the range is covered completely.
+
+Usage:
+
+    partitioner = SearchPartitioner(yt_stats, channel_id="UCArk93C2pbOvkv6jWz-3kAg")
+    video_ids = partitioner.video_ids("2017-01-01T00:00:00Z", "2024-01-01T00:00:00Z")
+
+or `YouTubeStats.get_videos_data(partition=True)` / `python -m src fetch ... --partition`.
+
+Class SearchPartitioner:
+- `SearchPartitioner(yt_stats, query=None, channel_id=None, max_results=500, max_concurrency=4, params=None)`
+
+SearchPartitioner methods:
+- `video_ids(self, published_after, published_before)`
+- `video_ids_async(self, published_after, published_before)`
+
+Resources
+----------
+search: list:
+    https://developers.google.com/youtube/v3/docs/search/list
+
+"""
+
+import asyncio
+import calendar
+import time
+import urllib.parse
+
+from src.monitoring.instrumentation import span
+
+
+API_URL = "https://www.googleapis.com/youtube/v3"
+RESULTS_PER_PAGE = 50
+MAX_SEARCH_RESULTS = 500  # search.list returns at most about this many results for a query
+
+
+def _to_epoch_seconds(timestamp):
+    """Converts an API timestamp ("2023-11-01T12:00:00Z") to seconds since the epoch."""
+    return calendar.timegm(time.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S"))
+
+
+def _to_timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+class SearchPartitioner:
+    """Harvests search.list results over a date range, splitting the range as needed.
+
+    Parameters
+    ----------
+    yt_stats : YouTubeStats
+        Used for its api key and `_get` (retries and request metrics).
+
+    query : string
+        Search terms (the `q` parameter), for keyword or topic harvests.
+
+    channel_id : string
+        Restrict the search to a channel.
+
+    max_results : int
+        Largest number of matching videos a window can have before it is split. Defaults to the 500 the
+        search endpoint will return for a query.
+
+    max_concurrency : int
+        Number of search requests sent at the same time.
+
+    params : dict
+        Any other search.list parameters (e.g. {"regionCode": "GB", "videoDuration": "long"}).
+
+    """
+
+    def __init__(self, yt_stats, query=None, channel_id=None, max_results=MAX_SEARCH_RESULTS, max_concurrency=4,
+                 params=None):
+        self.yt_stats = yt_stats
+        self.query = query
+        self.channel_id = channel_id
+        self.max_results = max_results
+        self.max_concurrency = max_concurrency
+        self.params = params or {}
+
+        self.search_calls = 0
+        # leaf windows: {"publishedAfter", "publishedBefore", "totalResults", "pages", "videos"}
+        self.windows = []
+
+    def _url(self, start, end, page_token=None):
+        params = {"part": "id", "type": "video", "order": "date", "maxResults": RESULTS_PER_PAGE,
+                  "publishedAfter": _to_timestamp(start), "publishedBefore": _to_timestamp(end)}
+        if self.query:
+            params["q"] = self.query
+        if self.channel_id:
+            params["channelId"] = self.channel_id
+        params.update(self.params)
+        if page_token:
+            params["pageToken"] = page_token
+        return f"{API_URL}/search?{urllib.parse.urlencode(params)}&key={self.yt_stats.api_key}"
+
+    async def _search(self, semaphore, start, end, page_token=None):
+        async with semaphore:
+            self.search_calls += 1
+            data = await asyncio.to_thread(self.yt_stats._get, self._url(start, end, page_token), cache=False)
+        if "items" not in data:
+            print(f"search request failed for {_to_timestamp(start)} - {_to_timestamp(end)}: "
+                  f"{data.get('error', {}).get('message')}")
+        return data
+
+    @staticmethod
+    def _add_ids(data, video_ids):
+        for item in data.get("items", []):
+            if item.get("id", {}).get("kind") == "youtube#video":
+                video_ids[item["id"]["videoId"]] = {}
+
+    async def _harvest_window(self, semaphore, start, end, video_ids):
+        data = await self._search(semaphore, start, end)
+        if "items" not in data:
+            return
+
+        total = data.get("pageInfo", {}).get("totalResults", 0)
+        if total > self.max_results and end - start > 1:
+            # too many results to page through: split the window into as many equal parts as the estimate
+            # needs and handle each part the same way
+            n_parts = min(max(2, -(-total // self.max_results)), end - start)
+            bounds = [start + (end - start) * i // n_parts for i in range(n_parts + 1)]
+            await asyncio.gather(*(self._harvest_window(semaphore, a, b, video_ids)
+                                   for a, b in zip(bounds[:-1], bounds[1:])))
+            return
+
+        if total > self.max_results:
+            print(f"{total} results published in one second ({_to_timestamp(start)}); some will be missed")
+
+        # a leaf window: the first page is already here, fetch the rest
+        window_ids = {}
+        self._add_ids(data, window_ids)
+        pages = 1
+        while data.get("nextPageToken") and pages * RESULTS_PER_PAGE < self.max_results:
+            data = await self._search(semaphore, start, end, data["nextPageToken"])
+            if "items" not in data:
+                break
+            self._add_ids(data, window_ids)
+            pages += 1
+
+        video_ids.update(window_ids)
+
+        if data.get("nextPageToken") and end - start > 1:
+            # totalResults is only an estimate: the window had more results than it said, so split it after all
+            middle = (start + end) // 2
+            await asyncio.gather(self._harvest_window(semaphore, start, middle, video_ids),
+                                 self._harvest_window(semaphore, middle, end, video_ids))
+            return
+
+        self.windows.append({"publishedAfter": _to_timestamp(start), "publishedBefore": _to_timestamp(end),
+                             "totalResults": total, "pages": pages, "videos": len(window_ids)})
+
+    async def video_ids_async(self, published_after, published_before):
+        """Coroutine version of `video_ids`."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        video_ids = {}
+        await self._harvest_window(semaphore, _to_epoch_seconds(published_after),
+                                   _to_epoch_seconds(published_before), video_ids)
+        self.windows.sort(key=lambda window: window["publishedAfter"])
+        return video_ids
+
+    def video_ids(self, published_after, published_before):
+        """Returns every video the search matches that was published in [published_after, published_before).
+
+        Parameters
+        ----------
+        published_after, published_before : string
+            Format: 1970-01-01T00:00:00Z
+
+        Returns
+        -------
+        video_ids : dict
+            The video IDs as keys and empty dictionaries as values (the layout `get_video_ids` returns).
+        """
+        self.search_calls = 0
+        self.windows = []
+
+        with span("api.search_partitioned") as record:
+            video_ids = asyncio.run(self.video_ids_async(published_after, published_before))
+            if record is not None:
+                record["rows_out"] = len(video_ids)
+
+        print(f"{len(video_ids)} videos from {len(self.windows)} windows "
+              f"({self.search_calls} search calls, {self.search_calls * 100} quota units)")
+        return video_ids
@@ -0,0 +1,139 @@
+# video_record.py
+"""Contains the compact record used to hold a video's data in memory while it is fetched.
+
+The API's 'videos' responses hold far more than the analysis uses (five thumbnail sizes, a localized copy of
+the title and description, rating and caption details, ...), all of which `drop_columns` throws away later.
+A `VideoRecord` keeps only the fields that survive `drop_columns`, parses the counts into integers and uses
+`__slots__` (no per-object dictionary) and stores repeated strings (tags, channel id and title) once, so a
+large harvest takes a fraction of the memory of the nested response dictionaries (about a fifth on the
+repository's data, where the unique descriptions make up most of what is left).
+
+Records convert to and from the JSON layout of the raw response files ({"snippet": ..., "statistics": ...,
+"contentDetails": ...}), so files written from records are read by the rest of the project unchanged.
+
+Class VideoRecord:
+- `VideoRecord(video_id)`
+
+VideoRecord methods:
+- `set_part(self, part, data)`
+- `to_json(self)`
+- `VideoRecord.from_json(video_id, video_data)`
+
+Functions include:
+
+    `records_to_json(records)`:
+        Converts a dictionary of records into the 'video_data' layout of the raw JSON files.
+
+    `records_from_json(video_data)`:
+        Converts the 'video_data' of a raw JSON file into a dictionary of records.
+
+"""
+
+import sys
+
+
+# fields kept from each part of the response: (attribute, key in the response)
+SNIPPET_FIELDS = [("published_at", "publishedAt"), ("channel_id", "channelId"), ("title", "title"),
+                  ("description", "description"), ("channel_title", "channelTitle"), ("tags", "tags")]
+STATISTICS_FIELDS = [("view_count", "viewCount"), ("like_count", "likeCount"),
+                     ("favorite_count", "favoriteCount"), ("comment_count", "commentCount")]
+CONTENT_DETAILS_FIELDS = [("duration", "duration")]
+
+# string fields shared by many videos; one copy of each value is kept (`sys.intern`)
+INTERNED_KEYS = {"channelId", "channelTitle"}
+
+PART_FIELDS = {"snippet": SNIPPET_FIELDS, "statistics": STATISTICS_FIELDS, "contentDetails": CONTENT_DETAILS_FIELDS}
+
+
+def _to_int(value):
+    # counts hidden by the channel owner are missing from the response; keep them as None
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class VideoRecord:
+    """The fields of a video that are used in the analysis.
+
+    Parameters
+    ----------
+    video_id : string
+
+    Attributes
+    ----------
+    published_at, channel_id, title, description, channel_title, duration : string or None
+    tags : tuple or None
+    view_count, like_count, favorite_count, comment_count : int or None
+
+    """
+
+    __slots__ = ["video_id"] + [attribute for fields in PART_FIELDS.values() for attribute, _ in fields]
+
+    def __init__(self, video_id):
+        self.video_id = video_id
+        for attribute in self.__slots__[1:]:
+            setattr(self, attribute, None)
+
+    def __repr__(self):
+        return f"VideoRecord({self.video_id!r}, title={self.title!r}, view_count={self.view_count})"
+
+    def __eq__(self, other):
+        if not isinstance(other, VideoRecord):
+            return NotImplemented
+        return all(getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def set_part(self, part, data):
+        """Fills the record from one part of a 'videos' response ('snippet', 'statistics' or
+        'contentDetails'), keeping only the fields in PART_FIELDS. Other parts are ignored."""
+        for attribute, key in PART_FIELDS.get(part, []):
+            value = data.get(key)
+            if part == "statistics":
+                value = _to_int(value)
+            elif value is None:
+                pass
+            elif key == "tags":
+                # the same tags appear on most videos, so store one copy of each
+                value = tuple(sys.intern(tag) for tag in value)
+            elif key in INTERNED_KEYS:
+                value = sys.intern(value)
+            setattr(self, attribute, value)
+        return self
+
+    def to_json(self):
+        """Returns the record in the layout of a video in the raw JSON files. Counts are written as strings,
+        as the API returns them, and missing values are left out."""
+        video_data = {}
+        for part, fields in PART_FIELDS.items():
+            part_data = {}
+            for attribute, key in fields:
+                value = getattr(self, attribute)
+                if value is None:
+                    continue
+                if part == "statistics":
+                    value = str(value)
+                elif key == "tags":
+                    value = list(value)
+                part_data[key] = value
+            video_data[part] = part_data
+        return video_data
+
+    @classmethod
+    def from_json(cls, video_id, video_data):
+        """Creates a record from a video in the raw JSON layout ({"snippet": ..., "statistics": ...})."""
+        record = cls(video_id)
+        for part in PART_FIELDS:
+            record.set_part(part, video_data.get(part, {}))
+        return record
+
+
+def records_to_json(records):
+    """Converts {video_id: VideoRecord} into the 'video_data' layout of the raw JSON files."""
+    return {video_id: record.to_json() for video_id, record in records.items()}
+
+
+def records_from_json(video_data):
+    """Converts the 'video_data' of a raw JSON file into {video_id: VideoRecord}."""
+    return {video_id: VideoRecord.from_json(video_id, data) for video_id, data in video_data.items()}
@@ -0,0 +1,319 @@
+# cli.py
+"""Command line interface for the project. Each subcommand imports only the modules it needs, so a scheduled
+fetch doesn't load pandas or plotly.
+
+Usage (from the repository root):
+
+    python -m src fetch --channel-id UCArk93C2pbOvkv6jWz-3kAg \\
+        --published-after 2023-11-01T00:00:00Z --published-before 2024-01-01T00:00:00Z
+    python -m src process --output data/processed/json_data_features.csv
+    python -m src process --chunked --output data/processed/json_data_features.csv
+    python -m src render --series "Keeping the Ball on the Ground" --metric viewCount
+    python -m src render --report reports/opengoal.html
+    python -m src collect --seed-folder data/raw/JSON_response
+    python -m src comments --top 10
+    python -m src playlists
+    python -m src archive --output data/raw/archive.oga
+    python -m src render --playlist-series data/playlist_series.json
+
+The API key is read from `--api-key` or the YOUTUBE_API_KEY environment variable.
+
+Functions include:
+
+    `fetch(args)`:
+        Gets channel statistics and video data from the YouTube API and saves the raw JSON file.
+
+    `collect(args)`:
+        Runs the collector that keeps video statistics up to date in the snapshot store.
+
+    `comments(args)`:
+        Downloads the comments of the given videos to line-delimited JSON files.
+
+    `archive(args)`:
+        Packs raw JSON response files into the compressed archive (see `src.storage.raw_archive`).
+
+    `playlists(args)`:
+        Updates the cached playlist membership used to split the video series.
+
+    `process(args)`:
+        Runs the pipeline up to the feature-engineered dataframe and optionally saves it as a CSV.
+
+    `render(args)`:
+        Runs the pipeline through to the charts (PNG images, or one HTML report with `--report`).
+
+    `main(argv=None)`:
+        Parses the command line and runs the subcommand.
+
+"""
+
+import argparse
+import os
+import sys
+
+
+DEFAULT_CHANNEL_ID = "UCArk93C2pbOvkv6jWz-3kAg"
+DEFAULT_SERIES = ["Keeping the Ball on the Ground", "Open Goal Meets"]
+DEFAULT_METRICS = ["viewCount", "likeCount", "commentCount"]
+
+
+def fetch(args):
+    """Gets channel statistics and video data from the YouTube API and saves the raw JSON file."""
+    from src.api.get_youtube_data import YouTubeStats
+
+    api_key = args.api_key or os.environ.get("YOUTUBE_API_KEY")
+    if not api_key:
+        print("No API key: pass --api-key or set the YOUTUBE_API_KEY environment variable.")
+        return 1
+
+    yt_stats = YouTubeStats(api_key=api_key, channel_id=args.channel_id,
+                            published_after=args.published_after, published_before=args.published_before)
+    yt_stats.get_channel_statistics()
+    # only written out to JSON, so the compact records are enough (and use much less memory)
+    yt_stats.get_videos_data(compact=True, partition=args.partition)
+    yt_stats.export_to_json()
+    yt_stats.metrics.print_summary()
+
+    return 0
+
+
+def collect(args):
+    """Runs the collector: polls for new uploads and keeps video statistics up to date in the snapshot
+    store until interrupted."""
+    from src.api.collector import Collector
+    from src.api.get_youtube_data import YouTubeStats
+    from src.storage.snapshot_store import SnapshotStore
+
+    api_key = args.api_key or os.environ.get("YOUTUBE_API_KEY")
+    if not api_key:
+        print("No API key: pass --api-key or set the YOUTUBE_API_KEY environment variable.")
+        return 1
+
+    yt_stats = YouTubeStats(api_key=api_key, channel_id=args.channel_id,
+                            published_after=None, published_before=None)
+    collector = Collector(yt_stats, store=SnapshotStore(args.snapshot_folder), state_path=args.state_path,
+                          tick_seconds=args.tick_seconds, daily_quota_budget=args.quota_budget)
+    if args.seed_folder:
+        collector.seed_from_json(args.seed_folder)
+
+    collector.run_forever(max_ticks=args.max_ticks)
+    yt_stats.metrics.print_summary()
+
+    return 0
+
+
+def comments(args):
+    """Harvests the comments of the given videos (or the `--top` most viewed videos) to line-delimited JSON
+    files."""
+    from src.api.comment_harvester import CommentHarvester
+    from src.api.get_youtube_data import YouTubeStats
+
+    api_key = args.api_key or os.environ.get("YOUTUBE_API_KEY")
+    if not api_key:
+        print("No API key: pass --api-key or set the YOUTUBE_API_KEY environment variable.")
+        return 1
+
+    video_ids = list(args.video_id or [])
+    if args.top:
+        from src.processing.process_json_data import clean_dataframe, json_files_to_dataframe
+
+        df = clean_dataframe(json_files_to_dataframe(args.raw_folder))
+        video_ids += df.nlargest(args.top, "viewCount")["videoID"].tolist()
+
+    if not video_ids:
+        print("No videos: pass --video-id and/or --top.")
+        return 1
+
+    yt_stats = YouTubeStats(api_key=api_key, channel_id=None, published_after=None, published_before=None)
+    harvester = CommentHarvester(yt_stats, output_folder=args.output_folder, workers=args.workers,
+                                 quota_budget=args.quota_budget)
+    harvester.harvest(video_ids)
+    yt_stats.metrics.print_summary()
+
+    return 0
+
+
+def playlists(args):
+    """Lists the channel's playlists and fetches the videos of any that are new or have changed."""
+    from src.api.get_youtube_data import YouTubeStats
+    from src.api.playlist_series import PlaylistSeriesMap
+
+    api_key = args.api_key or os.environ.get("YOUTUBE_API_KEY")
+    if not api_key:
+        print("No API key: pass --api-key or set the YOUTUBE_API_KEY environment variable.")
+        return 1
+
+    yt_stats = YouTubeStats(api_key=api_key, channel_id=args.channel_id,
+                            published_after=None, published_before=None)
+    series_map = PlaylistSeriesMap(yt_stats, cache_path=args.cache_path)
+    series_map.refresh()
+    for title in DEFAULT_SERIES:
+        print(f"{title}: {len(series_map.series_video_ids(title))} videos")
+    yt_stats.metrics.print_summary()
+
+    return 0
+
+
+def archive(args):
+    """Packs raw JSON response files into the compressed archive, or prints the history of a video from it."""
+    from src.storage.raw_archive import RawArchive
+
+    raw_archive = RawArchive(args.output)
+
+    if args.video_id:
+        for record in raw_archive.video_history(args.video_id):
+            statistics = record["video_data"].get("statistics", {})
+            views, likes, comments = (statistics.get(key, "-") for key in ("viewCount", "likeCount", "commentCount"))
+            print(f"{record['fetchedAt'] or '(no fetchedAt)':<22}views {views:>10}  likes {likes:>8}  "
+                  f"comments {comments:>6}")
+        return 0
+
+    added = raw_archive.append_files(args.raw_folder)
+    stats = raw_archive.stats()
+    print(f"Added {added} responses: {stats['responses']} responses, {stats['videos']} videos, "
+          f"{stats['blocks']} blocks, {stats['bytes'] / 1e6:.2f} MB ({args.output})")
+
+    return 0
+
+
+def _pipeline(args):
+    from src.pipeline.run_pipeline import Pipeline, default_stages
+
+    if args.playlist_series and not os.path.exists(args.playlist_series):
+        print(f"Playlist cache {args.playlist_series} not found; create it with `python -m src playlists`.")
+        return None
+
+    stages = default_stages(raw_folder=args.raw_folder,
+                            video_series=args.series or DEFAULT_SERIES,
+                            metrics=getattr(args, "metric", None) or DEFAULT_METRICS,
+                            text_store=os.path.join(args.cache_folder, "text_store"),
+                            playlist_series=args.playlist_series,
+                            dedupe=args.dedupe)
+    return Pipeline(stages, cache_folder=args.cache_folder)
+
+
+def process(args):
+    """Runs the pipeline up to the feature-engineered dataframe (year/month and video count columns)."""
+    if args.chunked:
+        # one file and one year at a time, for datasets too big to process in memory
+        from src.processing.chunked_features import process_folder_chunked
+
+        if not args.output:
+            print("--chunked needs --output (the result is written to the CSV file one year at a time).")
+            return 1
+        process_folder_chunked(args.raw_folder, args.output)
+        return 0
+
+    pipeline = _pipeline(args)
+    if pipeline is None:
+        return 1
+    target = "near_duplicates" if args.dedupe else "video_counts"
+    df = pipeline.run(targets=[target], force=args.force)[target]
+
+    if args.output:
+        from src.storage.text_store import materialise_text
+
+        # the pipeline keeps the descriptions in its text store; put them back for the CSV file
+        df = materialise_text(df, os.path.join(args.cache_folder, "text_store"))
+        df.to_csv(args.output, index=False)
+        print(f"Saved: {args.output}")
+
+    return 0
+
+
+def render(args):
+    """Runs the pipeline through to the charts for every series and metric. With `--report`, the charts are
+    written to one HTML file instead of one PNG each."""
+    pipeline = _pipeline(args)
+    if pipeline is None:
+        return 1
+
+    if args.report:
+        from src.pipeline.run_pipeline import _slug
+        from src.visualisation.html_report import series_report
+
+        series = args.series or DEFAULT_SERIES
+        outputs = pipeline.run(targets=[f"prep_{_slug(s)}" for s in series], force=args.force)
+        groups = {s: outputs[f"prep_{_slug(s)}"] for s in series}
+        series_report(groups, args.metric or DEFAULT_METRICS).write(args.report)
+        return 0
+
+    targets = [name for name in pipeline.stages if name.startswith("render_")]
+    pipeline.run(targets=targets, force=args.force)
+
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src",
+                                     description="Fetch, process and visualise Open Goal YouTube data.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = subparsers.add_parser("fetch", help="Get video data from the YouTube API.")
+    fetch_parser.add_argument("--api-key")
+    fetch_parser.add_argument("--channel-id", default=DEFAULT_CHANNEL_ID)
+    fetch_parser.add_argument("--published-after", required=True, help="Format: 1970-01-01T00:00:00Z")
+    fetch_parser.add_argument("--published-before", required=True, help="Format: 1970-01-01T00:00:00Z")
+    fetch_parser.add_argument("--partition", action="store_true",
+                              help="Split the date range automatically so no videos are lost to the search cap.")
+    fetch_parser.set_defaults(func=fetch)
+
+    collect_parser = subparsers.add_parser("collect", help="Keep video statistics up to date (runs until stopped).")
+    collect_parser.add_argument("--api-key")
+    collect_parser.add_argument("--channel-id", default=DEFAULT_CHANNEL_ID)
+    collect_parser.add_argument("--snapshot-folder", default="data/snapshots")
+    collect_parser.add_argument("--state-path", default="data/collector_state.json")
+    collect_parser.add_argument("--seed-folder", help="Raw JSON folder to take the known videos from.")
+    collect_parser.add_argument("--tick-seconds", type=int, default=60)
+    collect_parser.add_argument("--quota-budget", type=int, default=2000, help="Quota units per day.")
+    collect_parser.add_argument("--max-ticks", type=int, help="Stop after this many ticks.")
+    collect_parser.set_defaults(func=collect)
+
+    comments_parser = subparsers.add_parser("comments", help="Download the comments of videos.")
+    comments_parser.add_argument("--api-key")
+    comments_parser.add_argument("--video-id", action="append", help="Video to harvest (can be repeated).")
+    comments_parser.add_argument("--top", type=int, help="Also harvest the N most viewed videos.")
+    comments_parser.add_argument("--raw-folder", default="data/raw/JSON_response")
+    comments_parser.add_argument("--output-folder", default="data/raw/comments")
+    comments_parser.add_argument("--workers", type=int, default=8)
+    comments_parser.add_argument("--quota-budget", type=int, default=2000, help="Quota units for this run.")
+    comments_parser.set_defaults(func=comments)
+
+    playlists_parser = subparsers.add_parser("playlists", help="Update the cached playlist (series) membership.")
+    playlists_parser.add_argument("--api-key")
+    playlists_parser.add_argument("--channel-id", default=DEFAULT_CHANNEL_ID)
+    playlists_parser.add_argument("--cache-path", default="data/playlist_series.json")
+    playlists_parser.set_defaults(func=playlists)
+
+    archive_parser = subparsers.add_parser("archive", help="Pack raw JSON responses into a compressed archive.")
+    archive_parser.add_argument("--raw-folder", default="data/raw/JSON_response")
+    archive_parser.add_argument("--output", default="data/raw/archive.oga", help="Archive file (appended to).")
+    archive_parser.add_argument("--video-id", help="Print this video's statistics history instead.")
+    archive_parser.set_defaults(func=archive)
+
+    for name, func, help_text in [("process", process, "Build the feature-engineered dataframe."),
+                                  ("render", render, "Build the charts.")]:
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("--raw-folder", default="data/raw/JSON_response")
+        sub.add_argument("--cache-folder", default="data/pipeline_cache")
+        sub.add_argument("--series", action="append", help="Video series title (can be repeated).")
+        sub.add_argument("--force", action="store_true", help="Rerun every stage.")
+        sub.add_argument("--playlist-series", help="Split the series by the playlist cache saved by `playlists` "
+                                                   "(e.g. data/playlist_series.json) instead of by title.")
+        sub.add_argument("--dedupe", action="store_true",
+                         help="Find near-duplicate videos (re-uploads) and count each of them once in the totals.")
+        sub.set_defaults(func=func)
+
+        if name == "process":
+            sub.add_argument("--output", help="Save the dataframe to this CSV file.")
+            sub.add_argument("--chunked", action="store_true",
+                             help="Process one file and one year at a time to bound memory use (needs --output).")
+        else:
+            sub.add_argument("--metric", action="append", help="Metric to chart (can be repeated).")
+            sub.add_argument("--report", help="Write all the charts to this HTML file instead of PNG images.")
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# instrumentation.py
+"""Contains a lightweight instrumentation layer that records how long each stage of the program (API calls,
+parsing, transforms, charts) takes and how much it processes, and exports the records as JSON or
+Prometheus text-format files.
+
+Instrumentation is off by default. While it is off, `instrument` wrappers and `count` calls return after a
+single flag check, so leaving them in place costs next to nothing.
+
+Each record holds: stage, start (epoch seconds), seconds (wall time), rows_in, rows_out, requests,
+bytes_fetched, peak_rss_mb (the process's peak resident memory when the stage finished) and error (the
+exception type if the stage raised).
+
+Example Use
+-----------
+    from src.monitoring import instrumentation
+
+    instrumentation.enable(instrumentation.JSONSink("data/metrics/run.json"),
+                           instrumentation.PrometheusSink("data/metrics/run.prom"))
+    ...  # run the program as normal
+    instrumentation.flush()
+
+Functions include:
+
+    `enable(*sinks)`, `disable()`, `is_enabled()`:
+        Switch instrumentation on (sending records to the given sinks) or off.
+
+    `instrument(stage=None)`:
+        Decorator that records a stage every time the decorated function is called.
+
+    `span(stage, rows_in=None)`:
+        Context manager that records a stage around a block of code.
+
+    `count(**counters)`:
+        Adds to counters (e.g. requests=1, bytes_fetched=1024) of every stage the caller is running in.
+
+    `flush()`:
+        Sends the records collected so far to the sinks and clears them.
+
+Classes:
+
+    `MemorySink()`, `JSONSink(path)`, `PrometheusSink(path, prefix="opengoal")`
+
+"""
+
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class _State:
+    enabled = False
+    sinks = []
+    records = []
+    # guards `records` and the counters of running records, which worker threads update concurrently
+    lock = threading.Lock()
+
+
+_state = _State()
+
+# the records of the stages the current thread (or asyncio task) is running in, innermost last. A context
+# variable keeps one thread's requests out of another thread's stages; threads started with
+# `asyncio.to_thread` copy the context, so their requests still count towards the stage that started them.
+_active = contextvars.ContextVar("active_stages", default=())
+
+
+def enable(*sinks):
+    """Turns instrumentation on. Records are kept in memory until `flush` is called, which passes them to
+    each of `sinks` (a `MemorySink` is used if none are given)."""
+    _state.sinks = list(sinks) or [MemorySink()]
+    _state.records = []
+    _active.set(())
+    _state.enabled = True
+    return _state.sinks
+
+
+def disable():
+    """Turns instrumentation off (records not yet flushed are discarded)."""
+    _state.enabled = False
+    _state.records = []
+    _active.set(())
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def peak_rss_mb():
+    """Returns the peak resident memory of the process in MB, or None where it isn't available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024, 3)
+
+
+def _rows(obj):
+    """Returns the number of rows of a dataframe/series (or items of a list/dict); None for anything else."""
+    if obj is None or isinstance(obj, (str, bytes)):
+        return None
+    if hasattr(obj, "shape") and len(getattr(obj, "shape", ())) > 0:
+        return int(obj.shape[0])
+    if isinstance(obj, (list, dict)):
+        return len(obj)
+    return None
+
+
+@contextmanager
+def span(stage, rows_in=None):
+    """Records the wall time and counters of a block of code as `stage`. Yields the record (a dictionary)
+    so the block can set fields such as 'rows_out', or None if instrumentation is off.
+    """
+    if not _state.enabled:
+        yield None
+        return
+
+    record = {"stage": stage, "start": time.time(), "seconds": None, "rows_in": rows_in, "rows_out": None,
+              "requests": 0, "bytes_fetched": 0, "peak_rss_mb": None, "error": None}
+    token = _active.set(_active.get() + (record,))
+    start = time.perf_counter()
+
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 6)
+        record["peak_rss_mb"] = peak_rss_mb()
+        _active.reset(token)
+        with _state.lock:
+            _state.records.append(record)
+
+
+def instrument(stage=None):
+    """Decorator that records every call of the decorated function as a stage (named `stage`, or the
+    function's module and name). The number of rows in the first argument and in the return value are
+    recorded when they are dataframes, lists or dictionaries.
+    """
+    def decorator(func):
+        name = stage or f"{func.__module__.split('.')[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return func(*args, **kwargs)
+
+            # for methods the first argument is `self`, so use the first argument that has rows
+            rows_in = next((r for r in map(_rows, args) if r is not None), None)
+
+            with span(name, rows_in=rows_in) as record:
+                result = func(*args, **kwargs)
+                record["rows_out"] = _rows(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def count(**counters):
+    """Adds to the counters of every stage the caller is running in, e.g.
+    `count(requests=1, bytes_fetched=512)`. Does nothing if instrumentation is off or no stage is running."""
+    if not _state.enabled:
+        return
+    active = _active.get()
+    if not active:
+        return
+    with _state.lock:
+        for record in active:
+            for key, value in counters.items():
+                record[key] = (record.get(key) or 0) + value
+
+
+def records():
+    """Returns the records collected since the last flush."""
+    with _state.lock:
+        return list(_state.records)
+
+
+def flush():
+    """Passes the records collected so far to every sink and clears them."""
+    with _state.lock:
+        records_, _state.records = _state.records, []
+    if not records_:
+        return
+    for sink in _state.sinks:
+        sink.write(records_)
+
+
+def summarise(records_):
+    """Aggregates records by stage: calls, total seconds, total rows out, requests, bytes fetched and the
+    highest peak RSS."""
+    summary = {}
+    for record in records_:
+        s = summary.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "rows_out": 0, "requests": 0,
+                                                 "bytes_fetched": 0, "errors": 0, "peak_rss_mb": 0.0})
+        s["calls"] += 1
+        s["seconds"] += record["seconds"] or 0
+        s["rows_out"] += record["rows_out"] or 0
+        s["requests"] += record["requests"] or 0
+        s["bytes_fetched"] += record["bytes_fetched"] or 0
+        s["errors"] += 1 if record["error"] else 0
+        s["peak_rss_mb"] = max(s["peak_rss_mb"], record["peak_rss_mb"] or 0)
+    return summary
+
+
+##### Sinks #####
+
+class MemorySink:
+    """Keeps every flushed record in the `records` list (useful in notebooks)."""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, records_):
+        self.records.extend(records_)
+
+
+class JSONSink:
+    """Writes the records (and a per-stage summary) to a JSON file. Records from earlier flushes in the same
+    run are kept, so the file always holds the whole run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+
+    def write(self, records_):
+        self.records.extend(records_)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"records": self.records, "summary": summarise(self.records)}, f, indent=4)
+
+
+class PrometheusSink:
+    """Writes per-stage totals to a file in the Prometheus text exposition format (e.g. for the node
+    exporter's textfile collector)."""
+
+    METRICS = [("calls", "counter", "Number of times the stage ran."),
+               ("seconds", "counter", "Total wall time spent in the stage."),
+               ("rows_out", "counter", "Total rows returned by the stage."),
+               ("requests", "counter", "Total HTTP requests made by the stage."),
+               ("bytes_fetched", "counter", "Total response bytes fetched by the stage."),
+               ("errors", "counter", "Number of times the stage raised an exception."),
+               ("peak_rss_mb", "gauge", "Peak resident memory (MB) of the process after the stage.")]
+
+    def __init__(self, path, prefix="opengoal"):
+        self.path = path
+        self.prefix = prefix
+        self.records = []
+
+    def write(self, records_):
+        self.records.extend(records_)
+        summary = summarise(self.records)
+
+        lines = []
+        for metric, metric_type, help_text in self.METRICS:
+            name = f"{self.prefix}_stage_{metric}" + ("_total" if metric_type == "counter" else "")
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for stage, values in sorted(summary.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {values[metric]}')
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,578 @@
+# run_pipeline.py
+"""Contains the classes and functions that run the end-to-end processing flow (raw JSON files through to
+the charts) as a series of cached stages.
+
+Each stage declares the files and upstream stages it reads from. Before a stage runs, a fingerprint is
+built from the contents of its input files, the output hashes of its upstream stages, the stage's
+parameters, the source code of its function and the source files of the `src` modules that function
+imports (and the modules they import, in turn). If the fingerprint matches the one recorded the last time
+the stage ran, the stored output is reused; otherwise the stage (and, through the changed output hash,
+everything downstream of it) is rerun. A stage whose output comes out identical to last time does not
+invalidate the stages after it.
+
+Class Stage:
+- `Stage(name, func, inputs=None, files=None, outputs=None, params=None)`
+    - A single step of the pipeline.
+
+Class Pipeline:
+- `Pipeline(stages, cache_folder="data/pipeline_cache")`
+    - Runs stages in dependency order and stores their outputs.
+
+Pipeline methods:
+- `run(self, targets=None, force=False)`
+- `status(self)`
+- `clear_cache(self)`
+
+Functions include:
+
+    `default_stages(raw_folder, video_series, metrics)`:
+        Returns the stages that reproduce notebooks 2.0 - 5.0.
+
+    `main(argv=None)`:
+        Command line entry point, e.g. `python -m src.pipeline.run_pipeline --series "Keeping the Ball on
+        the Ground"`.
+
+"""
+
+import argparse
+import glob
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import re
+import time
+
+from src.monitoring import instrumentation
+
+
+class Stage:
+    """A single step of the pipeline.
+
+    Parameters
+    ----------
+    name : string
+        Unique name of the stage; other stages use it in their `inputs`.
+
+    func : callable
+        Function called as `func(*upstream_outputs, *file_inputs, **params)`. Upstream outputs are passed in
+        the order given in `inputs`; if the stage declares `files`, a sorted list of the matching paths is
+        passed after them.
+
+    inputs : list
+        Names of the stages whose outputs this stage needs.
+
+    files : list
+        File paths or glob patterns whose contents this stage depends on.
+
+    outputs : list
+        Files the stage writes (e.g. images). If any are missing the stage is rerun.
+
+    params : dict
+        Keyword arguments passed to `func`; they are part of the fingerprint.
+
+    """
+
+    def __init__(self, name, func, inputs=None, files=None, outputs=None, params=None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or []
+        self.files = files or []
+        self.outputs = outputs or []
+        self.params = params or {}
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs})"
+
+    def resolve_files(self):
+        """Expands the glob patterns in `files` into a sorted list of paths."""
+        paths = []
+        for pattern in self.files:
+            paths.extend(glob.glob(pattern))
+        return sorted(set(paths))
+
+
+def _hash_file(path, block_size=1 << 20):
+    """Returns the sha256 hex digest of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _func_source(func):
+    """Returns the source code of a function, or its qualified name if the source isn't available
+    (e.g. builtins)."""
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', repr(func))}"
+
+
+# `from src.x import y` / `import src.x` statements, to find the project modules a stage calls into
+IMPORT_PATTERN = re.compile(r"^[ \t]*(?:from\s+(src(?:\.\w+)*)\s+import\s+(\([^)]*\)|[\w \t,]+)"
+                            r"|import\s+(src(?:\.\w+)+))", re.MULTILINE)
+
+
+def _module_file(module_name):
+    """Returns the source file of a module without importing it (None if it isn't found)."""
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.origin or not spec.origin.endswith(".py"):
+        return None
+    return spec.origin
+
+
+def _imported_modules(source):
+    """Returns the names of the `src` modules imported in `source` (for `from src.a import b`, src.a.b is
+    included too in case b is a module)."""
+    names = set()
+    for from_module, imported, module in IMPORT_PATTERN.findall(source):
+        if module:
+            names.add(module)
+            continue
+        names.add(from_module)
+        for name in re.findall(r"\w+", imported):
+            names.add(f"{from_module}.{name}")
+    return names
+
+
+def _dependency_hashes(func):
+    """Returns {source file: sha256} for every `src` module `func` imports, directly or through the modules
+    it imports, so editing e.g. feature_engineering.py invalidates the stages that call into it."""
+    hashes = {}
+    pending = list(_imported_modules(_func_source(func)))
+    seen = set()
+    while pending:
+        module_name = pending.pop()
+        if module_name in seen:
+            continue
+        seen.add(module_name)
+        path = _module_file(module_name)
+        if path is None or path in hashes:
+            continue
+        hashes[path] = _hash_file(path)
+        with open(path, encoding="utf-8") as f:
+            pending.extend(_imported_modules(f.read()))
+    return hashes
+
+
+class Pipeline:
+    """Runs a list of stages in dependency order, reusing stored outputs when nothing a stage depends on
+    has changed.
+
+    Parameters
+    ----------
+    stages : list
+        List of `Stage` objects.
+
+    cache_folder : string
+        Folder where each stage's output (a pickle) and the manifest of fingerprints are stored.
+
+    """
+
+    def __init__(self, stages, cache_folder="data/pipeline_cache"):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage name: {stage.name}")
+            self.stages[stage.name] = stage
+
+        # check every input refers to a known stage
+        for stage in self.stages.values():
+            for name in stage.inputs:
+                if name not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{name}'")
+
+        self.cache_folder = cache_folder
+        self.manifest_path = os.path.join(cache_folder, "manifest.json")
+        self.manifest = self._load_manifest()
+
+        # outputs loaded (or computed) during this run
+        self._values = {}
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        return {}
+
+    def _save_manifest(self):
+        os.makedirs(self.cache_folder, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _output_path(self, name):
+        return os.path.join(self.cache_folder, f"{name}.pkl")
+
+    def _topological_order(self, targets=None):
+        """Returns the names of the stages needed for `targets` (all stages if None), upstream first."""
+        order = []
+        state = {}  # name -> "visiting" / "done"
+
+        def visit(name):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cycle in pipeline involving stage '{name}'")
+            state[name] = "visiting"
+            for upstream in self.stages[name].inputs:
+                visit(upstream)
+            state[name] = "done"
+            order.append(name)
+
+        for name in (targets or list(self.stages)):
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage: {name}")
+            visit(name)
+
+        return order
+
+    def _fingerprint(self, stage, file_paths):
+        """Builds the fingerprint of a stage from everything that can change its output."""
+        h = hashlib.sha256()
+        h.update(stage.name.encode())
+        h.update(_func_source(stage.func).encode())
+        for path, file_hash in sorted(_dependency_hashes(stage.func).items()):
+            h.update(os.path.relpath(path).encode())
+            h.update(file_hash.encode())
+        h.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+
+        for path in file_paths:
+            h.update(path.encode())
+            h.update(_hash_file(path).encode())
+
+        # upstream stages contribute the hash of their output, so an upstream stage that reruns but produces
+        # the same output doesn't invalidate this stage
+        for upstream in stage.inputs:
+            h.update(self.manifest[upstream]["output_hash"].encode())
+
+        return h.hexdigest()
+
+    def _is_fresh(self, stage, fingerprint):
+        entry = self.manifest.get(stage.name)
+        if entry is None or entry.get("fingerprint") != fingerprint:
+            return False
+        if not os.path.exists(self._output_path(stage.name)):
+            return False
+        return all(os.path.exists(path) for path in stage.outputs)
+
+    def _load_output(self, name):
+        if name not in self._values:
+            with open(self._output_path(name), "rb") as f:
+                self._values[name] = pickle.load(f)
+        return self._values[name]
+
+    def run(self, targets=None, force=False):
+        """Runs the stages needed for `targets`, skipping any stage whose fingerprint hasn't changed.
+
+        Parameters
+        ----------
+        targets : list
+            Names of the stages to bring up to date (and everything they depend on). Defaults to all stages.
+
+        force : bool
+            If True, every stage is rerun regardless of its fingerprint.
+
+        Returns
+        -------
+        results : dict
+            Dictionary with the stage name as key and its output as value, for the requested targets.
+
+        """
+        order = self._topological_order(targets)
+        self._values = {}
+        run_start = time.perf_counter()
+
+        for name in order:
+            stage = self.stages[name]
+            file_paths = stage.resolve_files()
+            fingerprint = self._fingerprint(stage, file_paths)
+
+            if not force and self._is_fresh(stage, fingerprint):
+                print(f"[cached]  {name}")
+                continue
+
+            # load upstream outputs only when a stage actually needs to run
+            args = [self._load_output(upstream) for upstream in stage.inputs]
+            if stage.files:
+                args.append(file_paths)
+
+            start = time.perf_counter()
+            value = stage.func(*args, **stage.params)
+            elapsed = time.perf_counter() - start
+
+            # store the output and record its hash
+            os.makedirs(self.cache_folder, exist_ok=True)
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(self._output_path(name), "wb") as f:
+                f.write(payload)
+
+            previous_hash = self.manifest.get(name, {}).get("output_hash")
+            output_hash = hashlib.sha256(payload).hexdigest()
+
+            self.manifest[name] = {"fingerprint": fingerprint,
+                                   "output_hash": output_hash,
+                                   "seconds": round(elapsed, 4),
+                                   "updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+            self._values[name] = value
+
+            # save after every stage so an interrupted run keeps the work already done
+            self._save_manifest()
+
+            unchanged = " (output unchanged)" if previous_hash == output_hash else ""
+            print(f"[ran]     {name} in {elapsed:.2f}s{unchanged}")
+
+        print(f"Pipeline finished in {time.perf_counter() - run_start:.2f}s")
+
+        return {name: self._load_output(name) for name in (targets or order)}
+
+    def status(self):
+        """Returns a dictionary with each stage name as key and True if its stored output is up to date."""
+        status = {}
+        for name in self._topological_order():
+            stage = self.stages[name]
+            # an upstream stage that has never run makes everything below it stale
+            if any(upstream not in self.manifest or not status[upstream] for upstream in stage.inputs):
+                status[name] = False
+                continue
+            status[name] = self._is_fresh(stage, self._fingerprint(stage, stage.resolve_files()))
+        return status
+
+    def clear_cache(self):
+        """Deletes every stored stage output and the manifest."""
+        for name in self.stages:
+            path = self._output_path(name)
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        self.manifest = {}
+
+
+##### Stage functions #####
+# Thin wrappers so each stage is a function of its inputs. Imports happen inside the functions so that
+# building the pipeline (e.g. to print its status) doesn't load pandas or plotly.
+
+def _combine_stage(file_paths, raw_folder):
+    if os.path.isfile(raw_folder):
+        # a compacted archive (see `src.storage.raw_archive`) holds all the responses in one file
+        from src.storage.raw_archive import RawArchive
+
+        return RawArchive(raw_folder).responses()
+
+    from src.utils import json_codec
+
+    # read the raw files directly: the stage's output is cached, so nothing needs writing into the repo
+    return [json_codec.load(path) for path in file_paths]
+
+
+def _dataframe_stage(json_response_data):
+    from src.processing.process_json_data import json_response_to_dataframe
+
+    return json_response_to_dataframe(json_response_data)
+
+
+def _clean_stage(df, text_store=None):
+    from src.processing.process_json_data import clean_dataframe
+
+    df = clean_dataframe(df)
+    if text_store:
+        # the descriptions are only needed at the end, so keep them out of every later copy and merge
+        from src.storage.text_store import externalise_text
+
+        df = externalise_text(df, text_store)
+    return df
+
+
+def _duration_stage(df):
+    from src.processing.feature_engineering import create_duration_columns
+
+    return create_duration_columns(df)
+
+
+def _year_month_stage(df):
+    from src.processing.feature_engineering import create_year_month_columns
+
+    return create_year_month_columns(df)
+
+
+def _video_counts_stage(df):
+    from src.processing.feature_engineering import create_video_counts_columns
+
+    return create_video_counts_columns(df)
+
+
+def _series_stage(df, playlist_files=None, video_series_title=None):
+    from src.processing.chop_dataframe import split_into_video_series
+
+    series_map = None
+    if playlist_files:
+        # the playlist cache is a file input, so refreshing it reruns the series stages
+        from src.api.playlist_series import PlaylistSeriesMap
+
+        series_map = PlaylistSeriesMap.from_cache(playlist_files[0])
+
+    return split_into_video_series(df, video_series_title, series_map=series_map)
+
+
+def _near_duplicates_stage(df):
+    from src.processing.near_duplicates import add_cluster_column
+
+    return add_cluster_column(df)
+
+
+def _prep_stage(df, dedupe=False):
+    from src.visualisation.visualisations import prep_df_for_visualisation
+
+    return prep_df_for_visualisation(df, dedupe=dedupe)
+
+
+def _render_stage(df_group, metric, chart_title):
+    from src.visualisation.visualisations import viz_line_chart
+
+    viz_line_chart(df_group, metric, chart_title, show=False)
+    return _image_path(chart_title)
+
+
+def _image_path(chart_title):
+    # same naming rule as the visualisation functions
+    image_name = re.sub(r"[\W]+", "_", chart_title)
+    return f"images/{image_name}.png"
+
+
+def _slug(text):
+    return re.sub(r"\W+", "_", text).strip("_").lower()
+
+
+def default_stages(raw_folder="data/raw/JSON_response",
+                   video_series=("Keeping the Ball on the Ground", "Open Goal Meets"),
+                   metrics=("viewCount", "likeCount", "commentCount"), text_store=None, playlist_series=None,
+                   dedupe=False):
+    """Returns the stages that reproduce the flow of notebooks 2.0 - 5.0:
+
+    combine -> dataframe -> clean -> duration -> year_month -> video_counts -> [near_duplicates ->]
+    series_<name> -> prep_<name> -> render_<name>_<metric>
+
+    Parameters
+    ----------
+    raw_folder : string
+        Folder that holds the raw JSON responses, or an archive created by `src.storage.raw_archive`.
+
+    video_series : list
+        Titles (or parts of titles) of the video series to chart.
+
+    metrics : list
+        Metrics to chart for each video series.
+
+    text_store : string
+        Folder of a `TextStore`. If given, the 'clean' stage moves the descriptions into the store and the
+        later stages carry integer text ids instead (see `src.storage.text_store.materialise_text`).
+
+    playlist_series : string
+        Path of a playlist cache saved by `PlaylistSeriesMap.refresh`. If given, the series are split by
+        playlist membership instead of by title. Raises FileNotFoundError if the file doesn't exist.
+
+    dedupe : bool
+        If True, a 'near_duplicates' stage adds a 'cluster_id' column (see
+        `src.processing.near_duplicates`) and the monthly totals count each cluster of re-uploads once.
+
+    Returns
+    -------
+    stages : list
+        List of `Stage` objects.
+
+    """
+    if playlist_series and not os.path.exists(playlist_series):
+        # without the file the series stages would quietly fall back to matching titles
+        raise FileNotFoundError(f"Playlist cache {playlist_series} not found; "
+                                f"create it with `python -m src playlists`.")
+
+    stages = [
+        Stage("combine", _combine_stage,
+              files=[raw_folder if os.path.isfile(raw_folder) else os.path.join(raw_folder, "*.json")],
+              params={"raw_folder": raw_folder}),
+        Stage("dataframe", _dataframe_stage, inputs=["combine"]),
+        Stage("clean", _clean_stage, inputs=["dataframe"], params={"text_store": text_store}),
+        Stage("duration", _duration_stage, inputs=["clean"]),
+        Stage("year_month", _year_month_stage, inputs=["duration"]),
+        Stage("video_counts", _video_counts_stage, inputs=["year_month"]),
+    ]
+
+    features = "video_counts"
+    if dedupe:
+        # clusters are found over every video, before the series are split
+        stages.append(Stage("near_duplicates", _near_duplicates_stage, inputs=["video_counts"]))
+        features = "near_duplicates"
+
+    for series in video_series:
+        slug = _slug(series)
+        stages.append(Stage(f"series_{slug}", _series_stage, inputs=[features],
+                            files=[playlist_series] if playlist_series else None,
+                            params={"video_series_title": series}))
+        stages.append(Stage(f"prep_{slug}", _prep_stage, inputs=[f"series_{slug}"],
+                            params={"dedupe": True} if dedupe else None))
+
+        for metric in metrics:
+            chart_title = f"OpenGoal {series} {metric} per month"
+            stages.append(Stage(f"render_{slug}_{metric}", _render_stage, inputs=[f"prep_{slug}"],
+                                outputs=[_image_path(chart_title)],
+                                params={"metric": metric, "chart_title": chart_title}))
+
+    return stages
+
+
+def main(argv=None):
+    """Command line entry point for the pipeline."""
+    parser = argparse.ArgumentParser(description="Run the OpenGoal processing pipeline with cached stages.")
+    parser.add_argument("targets", nargs="*", help="Stages to bring up to date (default: all).")
+    parser.add_argument("--raw-folder", default="data/raw/JSON_response")
+    parser.add_argument("--series", action="append",
+                        help="Video series title to chart (can be repeated).")
+    parser.add_argument("--metric", action="append", help="Metric to chart (can be repeated).")
+    parser.add_argument("--cache-folder", default="data/pipeline_cache")
+    parser.add_argument("--force", action="store_true", help="Rerun every stage.")
+    parser.add_argument("--status", action="store_true", help="Show which stages are up to date and exit.")
+    parser.add_argument("--clear-cache", action="store_true", help="Delete stored stage outputs and exit.")
+    parser.add_argument("--metrics-json", help="Write per-stage timing and memory records to this JSON file.")
+    parser.add_argument("--metrics-prom", help="Write per-stage totals to this Prometheus text-format file.")
+    args = parser.parse_args(argv)
+
+    stages = default_stages(raw_folder=args.raw_folder,
+                            video_series=args.series or ("Keeping the Ball on the Ground", "Open Goal Meets"),
+                            metrics=args.metric or ("viewCount", "likeCount", "commentCount"))
+    pipeline = Pipeline(stages, cache_folder=args.cache_folder)
+
+    if args.clear_cache:
+        pipeline.clear_cache()
+        print("Cache cleared.")
+        return
+
+    if args.status:
+        for name, fresh in pipeline.status().items():
+            print(f"{'up to date' if fresh else 'stale':<12}{name}")
+        return
+
+    sinks = []
+    if args.metrics_json:
+        sinks.append(instrumentation.JSONSink(args.metrics_json))
+    if args.metrics_prom:
+        sinks.append(instrumentation.PrometheusSink(args.metrics_prom))
+    if sinks:
+        instrumentation.enable(*sinks)
+
+    pipeline.run(targets=args.targets or None, force=args.force)
+
+    if sinks:
+        instrumentation.flush()
+
+
+if __name__ == "__main__":
+    main()
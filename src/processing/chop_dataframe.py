@@ -8,16 +8,22 @@ Functions include:
         Takes a list of metrics and creates individual dataframes sorted by the given
         metric in descnding order
     
-    `split_into_video_series(df, video_series_title=[])`:
+    `split_into_video_series(df, video_series_title=[], series_map=None)`:
         Takes a string, or list of strings, and returns a dataframe with only those strings
-        in the video title.
+        in the video title (or, with `series_map`, only the videos in those series' playlists).
+
+    `add_series_column(df, series_map, video_series_title=None)`:
+        Adds a 'series' column from a videoID -> series mapping (e.g. the channel's playlists).
 
     
 
 """
 
 
-import pandas as pd
+from src.storage.sql_store import is_connection, query_single_metric, query_video_series
+from src.utils.lazy_import import lazy_import
+
+pd = lazy_import("pandas")
 
 
 def single_metric_dataframes(df, metrics=[]):
@@ -27,8 +33,9 @@ def single_metric_dataframes(df, metrics=[]):
     
     Parameters
     -----------
-    df : pandas dataframe
-        Dataframe that, ideally, contains the column names provided in the metrics list.
+    df : pandas dataframe or database connection
+        Dataframe that, ideally, contains the column names provided in the metrics list. If a connection
+        from `src.storage.sql_store.connect` is passed, the sorting is done by the database instead.
         
     metrics : list
         A list of column names.
@@ -39,7 +46,7 @@ def single_metric_dataframes(df, metrics=[]):
     df : pandas dataframe(s)
         Returns a dataframe for each metric provided (assuming the metric is a column in
         the dataframe). The dataframe will be sorted from highest to lowest for the given
-        metric.
+        metric; videos with the same value keep their order in `df` (a stable sort).
         
     Notes
     ------
@@ -51,8 +58,12 @@ def single_metric_dataframes(df, metrics=[]):
         df_sorted = pd.DataFrame(df_list[0])
         
         and  then returning the dataframe resolved this error.
-    
+
     """
+
+    # push the work down to the database if a connection was passed instead of a dataframe
+    if is_connection(df):
+        return query_single_metric(df, metrics)
         
     # check if input is a single string, if it is then store it as a single item list
     if isinstance(metrics, str):
@@ -72,7 +83,7 @@ def single_metric_dataframes(df, metrics=[]):
         try: 
             df_ = (df[['videoID', 'title', 
                        'publishedAt', 'publishedAtYear', v]]
-                .sort_values(by=[v], ascending=False, axis=0)
+                .sort_values(by=[v], ascending=False, axis=0, kind="stable")
                 .reset_index(drop=True))
 
             df_list.append(df_)
@@ -104,17 +115,69 @@ def single_metric_dataframes(df, metrics=[]):
 
 
 
-def split_into_video_series(df, video_series_title=[]):
+def _video_series_mapping(series_map, video_series_title=None):
+    """Returns {videoID: series} from a `PlaylistSeriesMap` or a dictionary."""
+    if isinstance(series_map, dict):
+        return series_map
+    return series_map.video_series(video_series_title)
+
+
+def add_series_column(df, series_map, video_series_title=None):
+    """Adds a 'series' column with the series each video belongs to, looked up by videoID.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        Dataframe with a 'videoID' column.
+
+    series_map : PlaylistSeriesMap or dict
+        The channel's playlists (see `src.api.playlist_series`) or a {videoID: series} dictionary.
+
+    video_series_title : list
+        Series to label (matched to playlist titles); videos in none of them get an empty string. If None,
+        every playlist is a series.
+
+    Returns
+    -------
+    df_ : pandas dataframe
+        Copy of the input with a 'series' column.
+    """
+    mapping = _video_series_mapping(series_map, video_series_title)
+
+    df_ = df.copy()
+    # one dictionary lookup per video
+    df_["series"] = df_["videoID"].map(mapping).fillna("")
+    return df_
+
+
+def _series_video_ids(series_map, video_series_title):
+    """Returns the IDs of the videos in the given series of a `PlaylistSeriesMap` or {videoID: series}
+    dictionary."""
+    if isinstance(series_map, dict):
+        wanted = {x.lower() for x in video_series_title}
+        return {video_id for video_id, series in series_map.items() if series.lower() in wanted}
+
+    # a video can be in more than one series' playlists, so take each series' videos in full
+    return set().union(*(series_map.series_video_ids(x) for x in video_series_title))
+
+
+def split_into_video_series(df, video_series_title=[], series_map=None):
     """Takes in a dataframe and the name of a YouTube video series and returns the input dataframe 
     with only the videos whose titles include the 'video_series_title' string in their title.
     
     Parameters
     ----------
-    df : pandas dataframe
-        Dataframe with YouTube video data.
-        
+    df : pandas dataframe or database connection
+        Dataframe with YouTube video data. If a connection from `src.storage.sql_store.connect` is passed,
+        the filtering and sorting are done by the database instead, using the series labels set by
+        `label_video_series` where they exist (or, with `series_map`, the series' video IDs).
+
     video_series_title : list
         List of strings of the title, or part of the title, of the video series we want to return a dataframe for.
+
+    series_map : PlaylistSeriesMap or dict
+        Optional. If given, a video belongs to a series if it is in one of the series' playlists (or is mapped
+        to the series in a {videoID: series} dictionary) rather than if its title contains the series title.
         
     Returns
     -------
@@ -135,6 +198,23 @@ def split_into_video_series(df, video_series_title=[]):
     # if input is a list then transform to lower case 
     elif isinstance(video_series_title, list):
         video_series_title = [x.lower() for x in video_series_title]
+
+    # push the work down to the database if a connection was passed instead of a dataframe
+    if is_connection(df):
+        if series_map is not None and len(video_series_title) > 0:
+            # the series' playlist videos, looked up by videoID
+            return query_video_series(df, video_series_title,
+                                      video_ids=_series_video_ids(series_map, video_series_title))
+        return query_video_series(df, video_series_title)
+
+    # look each video up in the playlist mapping instead of searching the titles
+    if series_map is not None and len(video_series_title) > 0:
+        series_ids = _series_video_ids(series_map, video_series_title)
+
+        return (df.loc[df['videoID'].isin(series_ids)]
+                .drop_duplicates(subset=["videoID"])
+                .sort_values(by=['publishedAt'])
+                .reset_index(drop=True))
     
     
     # create empty list that will store dataframes which will be concatenated later
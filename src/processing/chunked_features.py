@@ -0,0 +1,167 @@
+# chunked_features.py
+"""Module contains functions that run the feature engineering (duration, year/month and video count columns)
+one chunk of records at a time, so datasets with many channels and years can be processed without holding
+the whole dataset (and the copies made by each step) in memory.
+
+The work is done in two passes:
+    1. Each input chunk (e.g. one raw JSON file) is cleaned, given its duration and year/month columns and
+       written to a spill folder, split by publish year. Only the freshness of each video (one small tuple
+       per video, used to drop duplicates across chunks) is kept between chunks.
+    2. Each year is read back on its own, duplicates are dropped and the video count columns are added.
+       Every video published in a year is in that year's partition, so the monthly and yearly counts only
+       need that partition.
+
+Peak memory is set by the largest chunk or year rather than by the whole dataset. Concatenating the yearly
+dataframes gives the same rows as the in-memory pipeline (`create_duration_columns`,
+`create_year_month_columns` and `create_video_counts_columns`); only videos published at the same second
+can come out in a different order.
+
+Functions include:
+
+    `iter_raw_chunks(folder_path)`:
+        Yields one cleaned dataframe per raw JSON file.
+
+    `create_features_chunked(chunks, spill_folder=None)`:
+        Yields one feature-engineered dataframe per year.
+
+    `process_folder_chunked(folder_path, output_path=None, spill_folder=None)`:
+        Runs both for a folder of raw JSON files and writes the result to a CSV file one year at a time.
+
+"""
+
+import glob
+import os
+import shutil
+import tempfile
+
+from src.monitoring.instrumentation import span
+from src.processing.feature_engineering import (create_duration_columns, create_year_month_columns,
+                                                create_video_counts_columns)
+from src.processing.process_json_data import _flatten_json_file, clean_dataframe
+from src.utils.lazy_import import lazy_import
+
+pd = lazy_import("pandas")
+
+
+def iter_raw_chunks(folder_path):
+    """Yields one cleaned dataframe per raw JSON file in `folder_path` (in sorted file name order). Each
+    dataframe has a '_freshness' column used by `create_features_chunked` to resolve videos that appear in
+    more than one file (see `src.processing.merge_responses`)."""
+    for file_path in sorted(glob.glob(os.path.join(folder_path, "*.json"))):
+        yield clean_dataframe(_flatten_json_file(file_path))
+
+
+def create_features_chunked(chunks, spill_folder=None):
+    """Runs the feature engineering on an iterable of dataframes one chunk at a time.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Cleaned dataframes (the output of `clean_dataframe`), e.g. from `iter_raw_chunks`. Can be a
+        generator. If a video appears in more than one chunk, the row with the highest '_freshness' value is
+        kept; chunks without a '_freshness' column are ranked by their position (later chunks win).
+
+    spill_folder : string
+        Folder for the intermediate files. Defaults to a temporary folder that is deleted afterwards.
+
+    Yields
+    ------
+    df_year : pandas dataframe
+        The feature-engineered rows of one publish year (same columns as `create_video_counts_columns`),
+        sorted by 'publishedAt'. Years are yielded in order.
+
+    """
+    temporary = spill_folder is None
+    spill_folder = spill_folder or tempfile.mkdtemp(prefix="opengoal_spill_")
+
+    # the only state carried between chunks: video ID -> (freshness, chunk number) of the freshest row
+    freshest = {}
+
+    try:
+        ##### Pass 1: features per chunk, spilled by year #####
+        for chunk_number, chunk in enumerate(chunks):
+            if len(chunk) == 0:
+                continue
+
+            with span("features.chunked_pass1", rows_in=len(chunk)):
+                if "_freshness" in chunk.columns:
+                    keys = chunk["_freshness"]
+                else:
+                    keys = [(chunk_number,)] * len(chunk)
+
+                for video_id, key in zip(chunk["videoID"], keys):
+                    if video_id not in freshest or key > freshest[video_id][0]:
+                        freshest[video_id] = (key, chunk_number)
+
+                df_ = create_year_month_columns(create_duration_columns(chunk))
+                df_["_chunk"] = chunk_number
+
+                for year, df_part in df_.groupby("publishedAtYear"):
+                    year_folder = os.path.join(spill_folder, str(year))
+                    os.makedirs(year_folder, exist_ok=True)
+                    df_part.to_pickle(os.path.join(year_folder, f"chunk-{chunk_number:06d}.pkl"))
+
+                del df_
+
+        ##### Pass 2: deduplicate and count videos one year at a time #####
+        for year in sorted(os.listdir(spill_folder)):
+            year_folder = os.path.join(spill_folder, year)
+            parts = [pd.read_pickle(os.path.join(year_folder, name)) for name in sorted(os.listdir(year_folder))]
+
+            with span("features.chunked_pass2", rows_in=sum(len(part) for part in parts)) as record:
+                df_year = pd.concat(parts, ignore_index=True)
+                del parts
+
+                # keep only the freshest row of each video
+                is_freshest = [freshest[video_id][1] == chunk_number
+                               for video_id, chunk_number in zip(df_year["videoID"], df_year["_chunk"])]
+                df_year = create_video_counts_columns(df_year[is_freshest].drop(columns="_chunk"))
+
+                if record is not None:
+                    record["rows_out"] = len(df_year)
+
+            shutil.rmtree(year_folder)
+            yield df_year
+
+    finally:
+        if temporary:
+            shutil.rmtree(spill_folder, ignore_errors=True)
+
+
+def process_folder_chunked(folder_path, output_path=None, spill_folder=None):
+    """Runs the chunked feature engineering for a folder of raw JSON files.
+
+    Parameters
+    ----------
+    folder_path : string
+        Folder that holds the raw JSON files.
+
+    output_path : string
+        CSV file to write. Each year is appended as it is finished, so the full dataset is never held in
+        memory. If None, the years are concatenated and returned as a dataframe instead.
+
+    spill_folder : string
+        Folder for the intermediate files (see `create_features_chunked`).
+
+    Returns
+    -------
+    rows or df : int or pandas dataframe
+        Number of rows written if `output_path` is given, otherwise the dataframe.
+
+    Example Use
+    -----------
+    process_folder_chunked("data/raw/JSON_response", "data/processed/json_data_features.csv")
+
+    """
+    years = create_features_chunked(iter_raw_chunks(folder_path), spill_folder=spill_folder)
+
+    if output_path is None:
+        return pd.concat(list(years), ignore_index=True)
+
+    rows = 0
+    for i, df_year in enumerate(years):
+        df_year.to_csv(output_path, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+        rows += len(df_year)
+
+    print(f"Saved: {output_path} ({rows} rows)")
+    return rows
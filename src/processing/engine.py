@@ -0,0 +1,338 @@
+# engine.py
+"""Contains the dataframe engines that run the processing chain (raw JSON -> cleaned, feature engineered
+dataframe -> video series -> per-metric rankings), so a faster backend can be used when one is installed.
+
+Engines:
+- 'pandas' (the default): calls the functions in `src.processing` one after another, exactly as the
+  notebooks and the pipeline do. Each step copies the dataframe.
+- 'polars': builds the whole chain as one lazy query (a `polars.LazyFrame`), which polars optimises as a
+  single plan (e.g. only the columns that are used are carried through, the filters run as early as
+  possible) and runs on all CPU cores. Only the final result is materialised, and it is converted to a
+  pandas dataframe with the same columns, dtypes and row order as the 'pandas' engine gives.
+
+The engine is chosen with `set_engine(name)` or the OPENGOAL_DF_ENGINE environment variable ('pandas',
+'polars', or 'auto' for polars when it is installed and pandas otherwise).
+
+Functions include:
+
+    `set_engine(name="pandas")`, `engine_name()`, `available_engines()`:
+        Choose / report the engine.
+
+    `video_features(json_response_data, video_series_title=None, engine=None)`:
+        Returns the feature engineered dataframe (the output of `create_video_counts_columns`), optionally
+        only for the given video series.
+
+    `metric_rankings(json_response_data, metrics, video_series_title=None, engine=None)`:
+        Returns the videos ranked by each metric (the output of `single_metric_dataframes`).
+
+    `check_parity(json_response_data, metrics, video_series_title=None, engines=None)`:
+        Runs the chain with each engine and raises AssertionError if the results differ.
+
+"""
+
+import os
+
+from src.monitoring.instrumentation import instrument
+from src.processing.merge_responses import merge_json_responses
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+# columns of the feature engineered dataframe, in order (see `create_video_counts_columns`)
+FEATURE_COLUMNS = ['videoID', 'publishedAt', 'publishedAtYear', 'publishedAtMonth', 'publishedAtYearMonth',
+                   'channelTitle', 'channelId', 'title', 'description', 'duration_timedelta', 'duration_hhmmss',
+                   'tags', 'viewCount', 'likeCount', 'favoriteCount', 'commentCount',
+                   'videoCountMonth', 'videoCountYear']
+
+COUNT_COLUMNS = ["viewCount", "likeCount", "favoriteCount", "commentCount"]
+
+# raw response fields used by the chain: (part, key)
+SOURCE_FIELDS = [("snippet", "publishedAt"), ("snippet", "channelId"), ("snippet", "title"),
+                 ("snippet", "description"), ("snippet", "channelTitle"), ("snippet", "tags"),
+                 ("statistics", "viewCount"), ("statistics", "likeCount"), ("statistics", "favoriteCount"),
+                 ("statistics", "commentCount"), ("contentDetails", "duration")]
+
+# the pattern `duration_to_hhmmss` matches, e.g. "PT1H21M36S"
+DURATION_PATTERN = r"^[A-Za-z]+(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?"
+
+RANKING_COLUMNS = ['videoID', 'title', 'publishedAt', 'publishedAtYear']
+
+
+def _series_list(video_series_title):
+    if video_series_title is None:
+        return []
+    if isinstance(video_series_title, str):
+        return [video_series_title]
+    return list(video_series_title)
+
+
+class _PandasEngine:
+    name = "pandas"
+
+    def video_features(self, json_response_data, video_series_title=None):
+        from src.processing.chop_dataframe import split_into_video_series
+        from src.processing.feature_engineering import (create_duration_columns, create_video_counts_columns,
+                                                        create_year_month_columns)
+        from src.processing.process_json_data import clean_dataframe, json_response_to_dataframe
+
+        df = json_response_to_dataframe(json_response_data)
+        df = clean_dataframe(df)
+        df = create_duration_columns(df)
+        df = create_year_month_columns(df)
+        df = create_video_counts_columns(df)
+
+        if _series_list(video_series_title):
+            df = split_into_video_series(df, _series_list(video_series_title))
+        return df
+
+    def metric_rankings(self, json_response_data, metrics, video_series_title=None):
+        from src.processing.chop_dataframe import single_metric_dataframes
+
+        df = self.video_features(json_response_data, video_series_title)
+        return {metric: single_metric_dataframes(df, [metric]) for metric in metrics}
+
+
+class _PolarsEngine:
+    name = "polars"
+
+    def __init__(self):
+        import polars
+        self._pl = polars
+
+    def _source_frame(self, json_response_data):
+        """Returns a LazyFrame with one row per video (the freshest record, ordered by video ID) and only the
+        raw fields the chain uses."""
+        pl = self._pl
+        merged = merge_json_responses(json_response_data)
+
+        columns = {"videoID": []}
+        columns.update({key: [] for _, key in SOURCE_FIELDS})
+        for channel_data in merged.values():
+            for video_id, video_data in channel_data["video_data"].items():
+                columns["videoID"].append(video_id)
+                for part, key in SOURCE_FIELDS:
+                    columns[key].append(video_data.get(part, {}).get(key))
+
+        schema = {name: pl.Utf8 for name in columns}
+        schema["tags"] = pl.List(pl.Utf8)
+        return pl.LazyFrame(columns, schema=schema)
+
+    def _features_plan(self, json_response_data, video_series_title=None):
+        pl = self._pl
+        lf = self._source_frame(json_response_data)
+
+        published_at = pl.col("publishedAt").str.to_datetime("%Y-%m-%dT%H:%M:%SZ", time_zone="UTC")
+        # hours, minutes and seconds of the duration, zero padded to two digits as `duration_to_hhmmss` does
+        hms = [pl.col("duration").str.extract(DURATION_PATTERN, i).fill_null("0") for i in (1, 2, 3)]
+
+        lf = lf.with_columns(
+            [pl.col(column).cast(pl.Int64, strict=False) for column in COUNT_COLUMNS]
+            + [published_at.alias("publishedAt"),
+               pl.duration(hours=hms[0].cast(pl.Int64), minutes=hms[1].cast(pl.Int64),
+                           seconds=hms[2].cast(pl.Int64)).alias("duration_timedelta"),
+               pl.concat_str([part.str.zfill(2) for part in hms], separator=":").alias("duration_hhmmss")]
+        ).with_columns(
+            pl.col("publishedAt").dt.strftime("%Y").alias("publishedAtYear"),
+            pl.col("publishedAt").dt.strftime("%m").alias("publishedAtMonth"),
+            pl.col("publishedAt").dt.strftime("%Y-%m").alias("publishedAtYearMonth"),
+        ).with_columns(
+            # the number of videos in the month and year are counted over every video, before the series split
+            pl.len().over("publishedAtYearMonth").cast(pl.Int64).alias("videoCountMonth"),
+            pl.len().over("publishedAtYear").cast(pl.Int64).alias("videoCountYear"),
+        )
+
+        series = _series_list(video_series_title)
+        if series:
+            # same case insensitive (regex) match as `split_into_video_series`
+            lf = lf.filter(pl.any_horizontal([pl.col("title").str.contains(f"(?i){s}") for s in series]))
+
+        return lf.sort("publishedAt", maintain_order=True).select(FEATURE_COLUMNS)
+
+    def _to_pandas(self, df):
+        """Converts a collected polars DataFrame to pandas with the dtypes of the 'pandas' engine (without
+        needing pyarrow)."""
+        data = {}
+        for name in df.columns:
+            column = df.get_column(name)
+            if name == "publishedAt":
+                data[name] = pd.to_datetime(column.dt.epoch("us").to_numpy(), unit="us", utc=True)
+            elif name in COUNT_COLUMNS or name.startswith("videoCount"):
+                # int64, or float64 with NaN when a count is missing (as `pd.to_numeric` gives)
+                data[name] = column.to_numpy()
+            else:
+                # strings, tags (lists) and durations (timedelta objects); missing values are NaN, as
+                # `pd.json_normalize` gives
+                data[name] = pd.Series(column.to_list(), dtype=object).where(column.is_not_null().to_numpy(), np.nan)
+        return pd.DataFrame(data)
+
+    def video_features(self, json_response_data, video_series_title=None):
+        return self._to_pandas(self._features_plan(json_response_data, video_series_title).collect())
+
+    def metric_rankings(self, json_response_data, metrics, video_series_title=None):
+        pl = self._pl
+        features = self._features_plan(json_response_data, video_series_title).cache()
+        plans = [features.select(RANKING_COLUMNS + [metric])
+                 .sort(metric, descending=True, nulls_last=True, maintain_order=True)
+                 for metric in metrics]
+        # one optimised run for all the metrics; the shared part of the plan is computed once
+        frames = pl.collect_all(plans)
+        return {metric: self._to_pandas(frame) for metric, frame in zip(metrics, frames)}
+
+
+ENGINES = {"pandas": _PandasEngine, "polars": _PolarsEngine}
+
+_engine = None
+
+
+def _create_engine(name):
+    """Returns an engine object for `name`; 'auto' falls back to pandas when polars isn't installed."""
+    if name == "auto":
+        try:
+            return _PolarsEngine()
+        except ImportError:
+            return _PandasEngine()
+
+    if name not in ENGINES:
+        raise ValueError(f"Unknown dataframe engine '{name}', use one of {list(ENGINES)} or 'auto'.")
+    try:
+        return ENGINES[name]()
+    except ImportError as ie:
+        raise ImportError(f"Dataframe engine '{name}' is not installed") from ie
+
+
+def available_engines():
+    """Returns the names of the engines that can be used (installed)."""
+    names = []
+    for name in ENGINES:
+        try:
+            _create_engine(name)
+            names.append(name)
+        except ImportError:
+            continue
+    return names
+
+
+def set_engine(name="pandas"):
+    """Sets the dataframe engine used by `video_features` and `metric_rankings`.
+
+    Parameters
+    ----------
+    name : string
+        'pandas', 'polars' or 'auto' (polars if it is installed, otherwise pandas).
+
+    Returns
+    -------
+    name : string
+        The name of the engine in use.
+
+    """
+    global _engine
+    _engine = _create_engine(name)
+    return _engine.name
+
+
+def _get_engine(name=None):
+    if name is not None:
+        return _create_engine(name)
+    if _engine is None:
+        set_engine(os.environ.get("OPENGOAL_DF_ENGINE", "pandas"))
+    return _engine
+
+
+def engine_name():
+    """Returns the name of the engine in use."""
+    return _get_engine().name
+
+
+@instrument("engine.video_features")
+def video_features(json_response_data, video_series_title=None, engine=None):
+    """Runs the processing chain on raw JSON responses: `json_response_to_dataframe` -> `clean_dataframe` ->
+    `create_duration_columns` -> `create_year_month_columns` -> `create_video_counts_columns` and, if
+    `video_series_title` is given, `split_into_video_series`.
+
+    Parameters
+    ----------
+    json_response_data : list
+        Raw responses, e.g. the contents of all_json_data.json.
+
+    video_series_title : string or list
+        Optional video series to keep (title, or part of the title).
+
+    engine : string
+        'pandas', 'polars' or 'auto'; defaults to the engine set with `set_engine`.
+
+    Returns
+    -------
+    df : pandas dataframe
+        The same dataframe (columns, dtypes and rows) whichever engine is used.
+    """
+    return _get_engine(engine).video_features(json_response_data, video_series_title)
+
+
+@instrument("engine.metric_rankings")
+def metric_rankings(json_response_data, metrics, video_series_title=None, engine=None):
+    """Runs the processing chain and ranks the videos by each metric, as `single_metric_dataframes` does.
+
+    Returns
+    -------
+    rankings : dict
+        {metric: dataframe with videoID, title, publishedAt, publishedAtYear and the metric, highest first}.
+    """
+    if isinstance(metrics, str):
+        metrics = [metrics]
+    return _get_engine(engine).metric_rankings(json_response_data, list(metrics), video_series_title)
+
+
+def check_parity(json_response_data, metrics, video_series_title=None, engines=None):
+    """Runs `video_features` and `metric_rankings` with each engine and checks that every engine gives the
+    same dataframes (columns, dtypes, values and row order, including the order of videos with the same
+    metric value) as the first one.
+
+    Parameters
+    ----------
+    json_response_data : list
+        Raw responses, e.g. the contents of all_json_data.json.
+
+    metrics : string or list
+        Metrics to rank the videos by.
+
+    video_series_title : string or list
+        Optional video series to keep.
+
+    engines : list
+        Engine names to compare; defaults to the installed engines (`available_engines`).
+
+    Returns
+    -------
+    engines : list
+        The names of the engines compared.
+
+    Raises
+    ------
+    AssertionError
+        If an engine's result differs, naming the engine and the dataframe.
+    """
+    if isinstance(metrics, str):
+        metrics = [metrics]
+    engines = list(engines or available_engines())
+
+    results = {name: (video_features(json_response_data, video_series_title, engine=name),
+                      metric_rankings(json_response_data, metrics, video_series_title, engine=name))
+               for name in engines}
+
+    reference, (expected_features, expected_rankings) = engines[0], results[engines[0]]
+    for name in engines[1:]:
+        features, rankings = results[name]
+        try:
+            pd.testing.assert_frame_equal(features, expected_features)
+        except AssertionError as ae:
+            raise AssertionError(f"'{name}' video_features differs from '{reference}': {ae}") from None
+        for metric in metrics:
+            try:
+                pd.testing.assert_frame_equal(rankings[metric], expected_rankings[metric])
+            except AssertionError as ae:
+                raise AssertionError(f"'{name}' {metric} ranking differs from '{reference}': {ae}") from None
+
+    return engines
@@ -9,6 +9,13 @@ Functions include:
     `create_video_counts_columns(df)`:
         Calculates the number of videos published in each month and year and creates a column for both.
 
+    `create_engagement_columns(df, as_of=None)`:
+        Calculates engagement ratios (likes and comments per view, views per minute and per day) and view
+        ranks within each month and series.
+
+    `create_duration_columns(df)`:
+        Converts the 'duration' column into 'duration_timedelta' and 'duration_hhmmss' columns.
+
     `duration_to_hhmmss(duration)`:
         Takes the duration value and returns two values: the duration as a timedelta object and the 
         duration as a string.
@@ -17,11 +24,29 @@ Functions include:
 """
 
 
-import pandas as pd
 import datetime as dt
 import re
 
+from src.monitoring.instrumentation import instrument
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+# columns added by `create_engagement_columns` and their types
+ENGAGEMENT_COLUMNS = {
+    "likesPerView": "float64",
+    "commentsPerView": "float64",
+    "viewsPerMinute": "float64",
+    "daysSincePublished": "float64",
+    "viewsPerDay": "float64",
+    "viewRankMonth": "Int64",
+    "viewRankSeries": "Int64",
+}
+
 # define a function that counts the number of videos released in a calendar month
+@instrument("features.create_year_month_columns")
 def create_year_month_columns(df):
     """Calculates the number of videos per month and per year based on the date in the 'publishedAt' column.
     
@@ -87,6 +112,7 @@ def create_year_month_columns(df):
 
 
 # define a function that counts the number of videos released in a calendar month
+@instrument("features.create_video_counts_columns")
 def create_video_counts_columns(df):
     """Calculates the number of videos per month and per year based on the date in the 'publishedAt' column.
     
@@ -184,6 +210,136 @@ def create_video_counts_columns(df):
 
 
 
+def _total_seconds(durations):
+    """Returns durations (timedelta objects, timedelta64 values or strings) as an array of seconds."""
+    try:
+        # numpy converts datetime.timedelta objects in C; pd.to_timedelta loops over them in Python
+        microseconds = durations.to_numpy().astype("timedelta64[us]")
+    except (TypeError, ValueError):
+        # e.g. strings from a CSV file
+        microseconds = pd.to_timedelta(durations).to_numpy().astype("timedelta64[us]")
+
+    seconds = microseconds.astype("int64").astype("float64") / 1e6
+    seconds[np.isnat(microseconds)] = np.nan
+    return seconds
+
+
+@instrument("features.create_engagement_columns")
+def create_engagement_columns(df, as_of=None):
+    """Calculates engagement features for every video with column-wise array operations (no row-wise
+    functions), so it scales to millions of rows.
+
+    Features
+    --------
+    - likesPerView, commentsPerView: likeCount / viewCount and commentCount / viewCount.
+    - viewsPerMinute: viewCount / duration in minutes.
+    - daysSincePublished: days between 'publishedAt' and `as_of`.
+    - viewsPerDay: viewCount / daysSincePublished (videos less than a day old count as one day).
+    - viewRankMonth: rank by viewCount within the publish month (1 = most viewed).
+    - viewRankSeries: rank by viewCount within the 'series' column, if the dataframe has one.
+
+    Ratios are missing (NaN) instead of infinite or an error when a count is missing or the divisor is 0,
+    and ranks are missing for videos without a viewCount.
+
+    Parameters
+    -----------
+    df : pandas dataframe
+        Dataframe with 'viewCount', 'likeCount', 'commentCount', 'publishedAt' and 'duration_timedelta'
+        columns (e.g. the output of `create_video_counts_columns`). Features whose input columns are
+        missing are left empty.
+
+    as_of : string or datetime
+        Date the video ages are measured to. Defaults to now (UTC).
+
+    Returns
+    -------
+    df : pandas dataframe
+        The input dataframe with the ENGAGEMENT_COLUMNS added, with the types given there.
+
+    Example Use
+    ------------
+    df = create_engagement_columns(df, as_of="2024-01-01T00:00:00Z")
+
+    """
+    df_ = df.copy()
+    n = len(df_)
+
+    def numeric(column):
+        # counts may still be strings straight from the API
+        if column not in df_.columns:
+            return np.full(n, np.nan)
+        return pd.to_numeric(df_[column], errors="coerce").to_numpy(dtype="float64")
+
+    def safe_divide(numerator, denominator):
+        # NaN where the denominator is 0, negative or missing
+        valid = denominator > 0
+        result = np.full(n, np.nan)
+        np.divide(numerator, denominator, out=result, where=valid)
+        return result
+
+    views = numeric("viewCount")
+
+    df_["likesPerView"] = safe_divide(numeric("likeCount"), views)
+    df_["commentsPerView"] = safe_divide(numeric("commentCount"), views)
+
+    ##### Views per minute #####
+    if "duration_timedelta" in df_.columns:
+        minutes = _total_seconds(df_["duration_timedelta"]) / 60
+    else:
+        minutes = np.full(n, np.nan)
+    df_["viewsPerMinute"] = safe_divide(views, minutes)
+
+    ##### Views per day #####
+    as_of = pd.Timestamp.now(tz="UTC") if as_of is None else pd.Timestamp(as_of)
+    if as_of.tzinfo is None:
+        as_of = as_of.tz_localize("UTC")
+
+    if "publishedAt" in df_.columns:
+        published = pd.to_datetime(df_["publishedAt"], utc=True)
+        days = ((as_of - published).dt.total_seconds() / 86400).to_numpy(dtype="float64")
+    else:
+        days = np.full(n, np.nan)
+    df_["daysSincePublished"] = days
+    df_["viewsPerDay"] = safe_divide(views, np.where(np.isnan(days), np.nan, np.maximum(days, 1.0)))
+
+    ##### Ranks #####
+    view_series = pd.Series(views, index=df_.index)
+    for column, group_column in [("viewRankMonth", "publishedAtYearMonth"), ("viewRankSeries", "series")]:
+        if group_column in df_.columns:
+            ranks = view_series.groupby(df_[group_column]).rank(ascending=False, method="min")
+        else:
+            ranks = pd.Series(np.nan, index=df_.index)
+        df_[column] = ranks.astype(ENGAGEMENT_COLUMNS[column])
+
+    return df_
+
+
+
+
+def create_duration_columns(df):
+    """Converts the API's 'duration' values (e.g. "PT1H21M36S") into 'duration_timedelta' and
+    'duration_hhmmss' columns using `duration_to_hhmmss`.
+
+    Parameters
+    -----------
+    df : pandas dataframe
+        Dataframe with 'duration' column.
+
+    Returns
+    -------
+    df : pandas dataframe
+        The input dataframe with additional 'duration_timedelta' and 'duration_hhmmss' columns.
+
+    """
+    df_ = df.copy()
+    durations = df_["duration"].apply(duration_to_hhmmss)
+    df_["duration_timedelta"] = durations.str[0]
+    df_["duration_hhmmss"] = durations.str[1]
+    return df_
+
+
+
+
 def duration_to_hhmmss(duration):
     """Takes in a string of YouTube's API duration 'response' and uses a regex to return two values:
         - the duration in sconds as a timedelta object
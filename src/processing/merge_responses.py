@@ -0,0 +1,122 @@
+# merge_responses.py
+"""Module contains functions that merge the video data from several raw JSON responses (e.g. overlapping
+date windows, backfills and incremental syncs) into one record per video, keeping the freshest statistics.
+
+The result only depends on the content of the responses, never on the order the files are listed or read:
+every record is given a freshness key and, for each video, the record with the highest key wins.
+
+Freshness key (compared left to right):
+    1. whether the response has a 'fetchedAt' timestamp (responses saved before it was added are older)
+    2. the 'fetchedAt' timestamp
+    3. the channel's total viewCount in the response (it only goes up, so it orders older responses)
+    4. the video's own viewCount, likeCount and commentCount (as a final tie-break)
+
+Functions include:
+
+    `response_freshness(channel_data)`:
+        Returns the freshness key of a single response for a channel.
+
+    `record_freshness(response_key, video_data)`:
+        Returns the freshness key of a single video record.
+
+    `merge_json_responses(json_response_data, keep_history=False)`:
+        Merges any number of responses in one pass and returns the merged data (and optionally the
+        statistics history of every video).
+
+"""
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+def response_freshness(channel_data):
+    """Returns the freshness key of one channel's data in a raw response
+    ({"channel_statistics": ..., "video_data": ..., "fetchedAt": ...})."""
+    fetched_at = channel_data.get("fetchedAt")
+    channel_views = _to_int(channel_data.get("channel_statistics", {}).get("viewCount"))
+
+    # ISO 8601 UTC timestamps ("2023-11-01T12:00:00Z") sort correctly as strings
+    return (fetched_at is not None, fetched_at or "", channel_views)
+
+
+def record_freshness(response_key, video_data):
+    """Returns the freshness key of a single video record within a response."""
+    statistics = video_data.get("statistics", {})
+    return response_key + (_to_int(statistics.get("viewCount")),
+                           _to_int(statistics.get("likeCount")),
+                           _to_int(statistics.get("commentCount")))
+
+
+def merge_json_responses(json_response_data, keep_history=False):
+    """Merges raw JSON responses into one record per video in a single pass over the records.
+
+    Parameters
+    ----------
+    json_response_data : list
+        List of raw responses ({channel_id: {"channel_statistics": ..., "video_data": ...}}), e.g. the
+        contents of all_json_data.json. Responses for different channels can be mixed.
+
+    keep_history : bool
+        If True, also return every distinct statistics record seen for each video.
+
+    Returns
+    -------
+    merged : dict
+        {channel_id: {"channel_statistics": ..., "video_data": ..., "fetchedAt": ...}} with the freshest
+        channel statistics and the freshest record of each video. Videos are ordered by video ID.
+
+    history : list
+        Only returned if `keep_history` is True. One dictionary per distinct (video, response) with
+        videoID, channelId, fetchedAt, viewCount, likeCount and commentCount, sorted by video and freshness.
+
+    Notes
+    ------
+    Each record is compared once against the best record seen so far for its video ID (a dictionary
+    lookup), so merging n records is O(n) however many overlapping files there are.
+
+    """
+    best_records = {}     # video_id -> (key, channel_id, video_data)
+    best_channel = {}     # channel_id -> (key, channel_data)
+    history = {}          # (video_id, key) -> row
+
+    for response in json_response_data:
+        for channel_id, channel_data in response.items():
+            response_key = response_freshness(channel_data)
+
+            if channel_id not in best_channel or response_key > best_channel[channel_id][0]:
+                best_channel[channel_id] = (response_key, channel_data)
+
+            for video_id, video_data in channel_data.get("video_data", {}).items():
+                key = record_freshness(response_key, video_data)
+
+                current = best_records.get(video_id)
+                if current is None or key > current[0]:
+                    best_records[video_id] = (key, channel_id, video_data)
+
+                if keep_history:
+                    statistics = video_data.get("statistics", {})
+                    history[(video_id, key)] = {"videoID": video_id,
+                                                "channelId": channel_id,
+                                                "fetchedAt": channel_data.get("fetchedAt"),
+                                                "viewCount": _to_int(statistics.get("viewCount")),
+                                                "likeCount": _to_int(statistics.get("likeCount")),
+                                                "commentCount": _to_int(statistics.get("commentCount"))}
+
+    merged = {}
+    for channel_id, (_, channel_data) in sorted(best_channel.items()):
+        merged[channel_id] = {"channel_statistics": channel_data.get("channel_statistics", {}),
+                              "video_data": {},
+                              "fetchedAt": channel_data.get("fetchedAt")}
+
+    for video_id in sorted(best_records):
+        _, channel_id, video_data = best_records[video_id]
+        merged[channel_id]["video_data"][video_id] = video_data
+
+    if keep_history:
+        return merged, [history[k] for k in sorted(history)]
+
+    return merged
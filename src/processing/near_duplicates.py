@@ -0,0 +1,325 @@
+# near_duplicates.py
+"""Contains the functions that find near-duplicate videos (re-uploads, clips cut from an episode, the same
+video posted with a reworded title) so their views aren't counted twice when the monthly totals are added up.
+
+Each video is described by a set of tokens: the words of its title, its tags and its duration (bucketed so
+videos within about 10% of each other share the token). Tokens that appear on most of the channel's videos
+(e.g. the 'open goal' and 'si ferry' tags) say nothing about which videos are the same, so they are dropped.
+Two videos are near duplicates if the Jaccard similarity of their token sets is at least `threshold` and
+their durations are within `duration_tolerance` of each other. Episodes of the same show share most of their
+tags, so without the duration check consecutive episodes would be matched; pass `duration_tolerance=None` to
+also match clips cut from a longer video.
+
+Comparing every pair of videos is quadratic, so the pairs are found with MinHash and locality-sensitive
+hashing (LSH):
+
+1. MinHash: each token set is reduced to a signature of `num_perm` values, the minimum of each of `num_perm`
+   hash functions over the tokens. The fraction of positions where two signatures agree estimates the
+   Jaccard similarity of the sets.
+2. LSH: the signature is cut into `bands` bands of `num_perm / bands` values. Videos with an identical band
+   fall in the same bucket and become a candidate pair. Pairs with a similarity above about
+   (1 / bands) ** (bands / num_perm) almost always share a band, pairs well below it almost never do.
+3. Each candidate pair is checked with its exact Jaccard similarity, and the pairs that pass are joined
+   into clusters (connected components).
+
+Hashing the videos into buckets is linear in the number of videos; only videos that share a bucket are
+compared. Videos with no tokens left (only channel-wide words and tags) can't be compared and are skipped.
+A bucket larger than MAX_BUCKET_SIZE (e.g. many videos with identical titles and tags) is chained instead:
+its videos are ordered by token set and duration and each one is compared with the next, which is enough to
+join identical videos into one cluster without comparing every pair.
+
+Functions include:
+
+    `video_tokens(df, max_df=0.2)`:
+        Returns the token set of each video.
+
+    `minhash_signatures(token_sets, num_perm=128, seed=1)`:
+        Returns the MinHash signature of each token set.
+
+    `near_duplicate_pairs(df, threshold=0.8, duration_tolerance=0.02, num_perm=128, bands=32, max_df=0.2)`:
+        Returns the near-duplicate pairs of videos and their similarity.
+
+    `add_cluster_column(df, threshold=0.8, duration_tolerance=0.02, num_perm=128, bands=32, max_df=0.2)`:
+        Adds a 'cluster_id' column; near duplicates share a cluster id.
+
+    `drop_near_duplicates(df)`:
+        Keeps one video (the first published) of each cluster.
+
+"""
+
+import math
+import re
+import zlib
+
+from src.monitoring.instrumentation import instrument, span
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+# buckets with more videos than this are chained (each video paired with the next) instead of comparing
+# every pair, so a large group of identical videos costs linear rather than quadratic time
+MAX_BUCKET_SIZE = 50
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def _duration_seconds(value):
+    """Seconds of a 'duration_timedelta' value or an API duration ("PT1H21M36S"); None if unknown."""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    match = re.match(r"^[A-Za-z]+(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?", str(value))
+    if match is None:
+        return None
+    hours, minutes, seconds = (int(x or 0) for x in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def _durations(df):
+    """Seconds of each video's duration (None where it is unknown)."""
+    column = "duration_timedelta" if "duration_timedelta" in df.columns else "duration"
+    if column not in df.columns:
+        return [None] * len(df)
+    return [_duration_seconds(value) for value in df[column]]
+
+
+def video_tokens(df, max_df=0.2):
+    """Returns the token set of each video: 'title:<word>' for the words of the title, 'tag:<tag>' for each
+    tag and 'duration:<bucket>' for the duration (buckets about 10% wide).
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        Dataframe with a 'title' column and, optionally, 'tags' (lists) and 'duration_timedelta' (or
+        'duration') columns.
+
+    max_df : float
+        Tokens on more than this fraction of the videos are dropped.
+
+    Returns
+    -------
+    token_sets : list
+        A set of strings per row of `df`.
+    """
+    titles = df["title"].fillna("").tolist()
+    tags = df["tags"].tolist() if "tags" in df.columns else [None] * len(df)
+
+    token_sets = []
+    for title, video_tags, seconds in zip(titles, tags, _durations(df)):
+        tokens = {"title:" + word for word in WORD_PATTERN.findall(str(title).lower())}
+        if isinstance(video_tags, (list, tuple, np.ndarray)):
+            tokens.update("tag:" + " ".join(str(tag).lower().split()) for tag in video_tags)
+        if seconds:
+            tokens.add(f"duration:{round(math.log(seconds) / math.log(1.1))}")
+        token_sets.append(tokens)
+
+    # drop the tokens most videos have (channel-wide tags, the show's name in the titles)
+    document_frequency = {}
+    for tokens in token_sets:
+        for token in tokens:
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    limit = max_df * len(token_sets)
+    common = {token for token, count in document_frequency.items() if count > limit}
+    if common:
+        token_sets = [tokens - common for tokens in token_sets]
+
+    return token_sets
+
+
+def minhash_signatures(token_sets, num_perm=128, seed=1):
+    """Returns the MinHash signatures of the token sets.
+
+    Parameters
+    ----------
+    token_sets : list
+        Sets of strings.
+
+    num_perm : int
+        Number of hash functions (length of a signature). More gives a closer estimate of the similarity.
+
+    seed : int
+        Seed of the hash functions; signatures are only comparable if they were made with the same seed.
+
+    Returns
+    -------
+    signatures : numpy array
+        uint64 array of shape (len(token_sets), num_perm). An empty set has a signature of MAX_HASH values.
+    """
+    rng = np.random.RandomState(seed)
+    # hash functions h(x) = (a * x + b) mod p, with p a Mersenne prime larger than the 32 bit token hashes
+    a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    signatures = np.full((len(token_sets), num_perm), MAX_HASH, dtype=np.uint64)
+    for i, tokens in enumerate(token_sets):
+        if not tokens:
+            continue
+        hashes = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokens), dtype=np.uint64,
+                             count=len(tokens))
+        # (a * x) overflows 64 bits and wraps, which keeps the values well mixed; the result is reduced to
+        # 32 bits like the token hashes
+        values = ((hashes[:, None] * a[None, :] + b[None, :]) % MERSENNE_PRIME) & np.uint64(MAX_HASH)
+        signatures[i] = values.min(axis=0)
+    return signatures
+
+
+def _candidate_pairs(signatures, bands, rank):
+    """Returns the pairs of rows (i < j) that have at least one identical band of their signatures. Rows in
+    a bucket are ordered by `rank`; in buckets larger than MAX_BUCKET_SIZE only neighbours are paired."""
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    candidates = set()
+    for band in range(bands):
+        band_values = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        # rows with an identical band get the same bucket number
+        _, buckets = np.unique(band_values.view(np.dtype((np.void, band_values.dtype.itemsize * rows))),
+                               return_inverse=True)
+        buckets = buckets.ravel()
+        order = np.argsort(buckets, kind="stable")
+        boundaries = np.flatnonzero(np.diff(buckets[order])) + 1
+        for members in np.split(order, boundaries):
+            if len(members) < 2:
+                continue
+            members = members[np.argsort(rank[members], kind="stable")]
+            if len(members) > MAX_BUCKET_SIZE:
+                links = zip(members[:-1], members[1:])
+            else:
+                links = ((members[x], members[y]) for x in range(len(members)) for y in range(x + 1, len(members)))
+            for a, b in links:
+                candidates.add((int(min(a, b)), int(max(a, b))))
+    return candidates
+
+
+@instrument("processing.near_duplicate_pairs")
+def near_duplicate_pairs(df, threshold=0.8, duration_tolerance=0.02, num_perm=128, bands=32, max_df=0.2):
+    """Finds the pairs of near-duplicate videos.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        Dataframe with 'videoID' and 'title' columns and, optionally, 'tags' and 'duration_timedelta'.
+
+    threshold : float
+        Smallest Jaccard similarity of the token sets (see `video_tokens`) for two videos to be near
+        duplicates.
+
+    duration_tolerance : float
+        Largest difference in duration, as a fraction of the longer video, between near duplicates. None
+        skips the check (e.g. to find clips). Videos without a duration aren't checked.
+
+    num_perm : int
+        Length of the MinHash signatures.
+
+    bands : int
+        Number of LSH bands; must divide `num_perm`. More bands find pairs with lower similarity (and
+        produce more candidates to check). With 128 / 32 pairs above a similarity of about 0.4 are found.
+
+    max_df : float
+        Tokens on more than this fraction of the videos are ignored.
+
+    Returns
+    -------
+    pairs : pandas dataframe
+        'videoID_a', 'videoID_b' and 'similarity' of each pair, most similar first.
+    """
+    if num_perm % bands:
+        raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm}).")
+
+    token_sets = video_tokens(df, max_df=max_df)
+    video_ids = df["videoID"].tolist()
+    seconds = _durations(df)
+
+    # videos with no distinctive tokens can't be compared (and would all share every bucket)
+    rows = np.flatnonzero([len(tokens) > 0 for tokens in token_sets])
+    signatures = minhash_signatures([token_sets[i] for i in rows], num_perm=num_perm)
+
+    # identical token sets next to each other, then by duration, so chained buckets link the right videos
+    set_ids = pd.factorize(pd.Series([frozenset(token_sets[i]) for i in rows], dtype=object))[0]
+    durations = np.array([seconds[i] or 0 for i in rows], dtype=np.float64)
+    rank = np.empty(len(rows), dtype=np.int64)
+    rank[np.lexsort((durations, set_ids))] = np.arange(len(rows))
+
+    candidates = {(int(rows[i]), int(rows[j])) for i, j in _candidate_pairs(signatures, bands, rank)}
+
+    pairs = []
+    for i, j in candidates:
+        if video_ids[i] == video_ids[j]:
+            continue
+        if duration_tolerance is not None and seconds[i] and seconds[j]:
+            if abs(seconds[i] - seconds[j]) > duration_tolerance * max(seconds[i], seconds[j]):
+                continue
+        union = len(token_sets[i] | token_sets[j])
+        similarity = len(token_sets[i] & token_sets[j]) / union if union else 0.0
+        if similarity >= threshold:
+            pairs.append((video_ids[i], video_ids[j], similarity))
+
+    print(f"{len(candidates)} candidate pairs from {len(df)} videos, {len(pairs)} near duplicates")
+    return (pd.DataFrame(pairs, columns=["videoID_a", "videoID_b", "similarity"])
+            .sort_values(by=["similarity", "videoID_a", "videoID_b"], ascending=[False, True, True])
+            .reset_index(drop=True))
+
+
+def add_cluster_column(df, threshold=0.8, duration_tolerance=0.02, num_perm=128, bands=32, max_df=0.2):
+    """Adds a 'cluster_id' column: near-duplicate videos (see `near_duplicate_pairs`), directly or through
+    other videos, share a cluster id. Videos without a near duplicate have a cluster of their own.
+
+    Returns
+    -------
+    df_ : pandas dataframe
+        Copy of `df` with an int64 'cluster_id' column. Cluster ids are numbered in the order the clusters
+        first appear in `df`.
+    """
+    with span("processing.add_cluster_column", rows_in=len(df)):
+        pairs = near_duplicate_pairs(df, threshold=threshold, duration_tolerance=duration_tolerance,
+                                     num_perm=num_perm, bands=bands, max_df=max_df)
+
+        # union-find over the row positions of each video ID (rows of the same video are one cluster)
+        codes, _ = pd.factorize(df["videoID"])
+        parent = list(range(codes.max() + 1 if len(codes) else 0))
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        position = {video_id: code for video_id, code in zip(df["videoID"], codes)}
+        for video_a, video_b in zip(pairs["videoID_a"], pairs["videoID_b"]):
+            root_a, root_b = find(position[video_a]), find(position[video_b])
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        roots = np.fromiter((find(code) for code in codes), dtype=np.int64, count=len(codes))
+
+        df_ = df.copy()
+        df_["cluster_id"] = pd.factorize(roots)[0].astype(np.int64)
+    return df_
+
+
+def drop_near_duplicates(df):
+    """Keeps one video of each cluster: the first one published (the original upload), or the first row
+    if there is no 'publishedAt' column. The dataframe must have a 'cluster_id' column (see
+    `add_cluster_column`).
+
+    Returns
+    -------
+    df_ : pandas dataframe
+        `df` without the other videos of each cluster, in the original row order.
+    """
+    if "cluster_id" not in df.columns:
+        raise KeyError("'cluster_id' column not found; add it with `add_cluster_column` first.")
+
+    keep = np.zeros(len(df), dtype=bool)
+    if "publishedAt" in df.columns:
+        order = np.argsort(pd.to_datetime(df["publishedAt"], utc=True).to_numpy(), kind="stable")
+    else:
+        order = np.arange(len(df))
+    first = ~pd.Series(df["cluster_id"].to_numpy()[order]).duplicated().to_numpy()
+    keep[order[first]] = True
+    return df.loc[keep]
@@ -5,31 +5,47 @@ YouTube API.
 
 Functions include:
 
-    `combine_all_json_files(folder_path)`:
+    `combine_all_json_files(folder_path, pretty=True)`:
         Combines multiple JSON files into one file whilst maintaining the same file and JSON structure.
 
     `json_response_to_dataframe(json_response_data)`:
         Takes the JSON response data and turns it into a dataframe.
 
+    `json_files_to_dataframe(folder_path, workers=None)`:
+        Parses and flattens each raw JSON file in a separate process and combines the results into one
+        dataframe.
+
     `remove_prefixes(column_name)`:
         Removes the 'snippet.' and 'statistics.' and other prefixes from the column names.
 
     `drop_columns(df)`:
         Drops the columns not needed for analysis.
+
+    `clean_dataframe(df)`:
+        Removes the column prefixes, drops the columns not needed and converts the counts to numbers.
     
 
 """
 
 
-import pandas as pd
 import datetime
 from datetime import datetime as dt
 import glob
 import re
-import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from src.monitoring.instrumentation import instrument
+from src.processing.merge_responses import merge_json_responses, response_freshness, record_freshness
+from src.utils import json_codec
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
 
 
-def combine_all_json_files(folder_path):
+@instrument("processing.combine_all_json_files")
+def combine_all_json_files(folder_path, pretty=True):
     """Combines multiple JSON files into one file whilst maintaining the same
     file and JSON structure.
     
@@ -38,7 +54,10 @@ def combine_all_json_files(folder_path):
     folder_path: str
         String of the path to the folder that contains the json files you
         want to combine into one json file.
-    
+
+    pretty: bool
+        If True (default) the file is indented (indent=4) like the raw files; False writes compact JSON,
+        which is much faster to write and read.
     
     Returns
     --------
@@ -48,6 +67,7 @@ def combine_all_json_files(folder_path):
     
     Notes
     -------
+    JSON is read and written with `src.utils.json_codec`, which uses orjson or ujson when installed.
 
     """
     
@@ -59,31 +79,28 @@ def combine_all_json_files(folder_path):
     
     # loop through the files in the foler and append them to the list
     for file in glob.glob(input_path):
-        with open(file, "r") as f:
-            data.append(json.loads(f.read()))
+        data.append(json_codec.load(file))
             
             
     # create a new file with all the json data and save in the output folder path
-    with open(f"{output_path}/all_json_data.json", "w") as f:
-        json.dump(data, f, indent=4)
+    json_codec.dump(data, f"{output_path}/all_json_data.json", pretty=pretty)
         
     return
 
         
 
 # function that places response into dataframe
+@instrument("processing.json_response_to_dataframe")
 def json_response_to_dataframe(json_response_data):
     """Takes JSON response data, performs some processing operations and outputs a dataframe.
     
     
     Processing Operations
     -----------------------
-    - Grabs and stores the channel ID from the JSON response.
-    - Creates empty dictionary that will house all the JSON data
-    - Loops through the json_response_data and appends a dictionary of video data to the dictionary
-    - Loops through the json_response_data and appends the most up to date channel statistics to
-        the dictionary.
-    - Create lists of the video IDs and the video dictionaries, joins these and then creates a dataframe.
+    - Merges the JSON files with `merge_json_responses`, keeping one record per video: the one with the
+        freshest statistics (see `src.processing.merge_responses` for how freshness is decided).
+    - Adds the video ID to each video dictionary and creates a dataframe, with one row per video ordered
+        by video ID.
     
     
     
@@ -104,76 +121,26 @@ def json_response_to_dataframe(json_response_data):
     
     Notes
     -----
+    The same files in any order, or with overlapping date windows, give the same dataframe.
     
     """
-    # get channel ID by grabbing it from the first JSON file (the key of each file is the channel ID) 
-    channel_id = [key for key in json_response_data[0].keys()][0]
-
-    
-    # create empty dictionary
-    json_data = {}
-
-    # create key for dictionary and give this key two values which are empty dictionaries
-    json_data[channel_id] = {'channel_statistics': {}, 
-                                'video_data': {}
-                                }
-    
-    ##### Video data #####
-    # loop through the json_response_data, access and then append the video data to our json_data dictionary 
-    # as a value for the 'video_data' key
-    for i, v in enumerate(json_response_data):
-
-        # accss video data from the json response data
-        video_data_ = json_response_data[i][channel_id]["video_data"]
-
-        # store this in the json_data dictionary
-        json_data[channel_id]["video_data"].update(video_data_)
-        
-      
-    ##### Channel statistics #####
-    # Next we need to access the channel statistics data, and then append it as a value for the 'channel_statistics' key in the 
-    # json_data dictionary 
-    # NOTE: the channel statistics data is NOT the same in each JSON file (the video count varies so set the video
-    # count to 0 and use this as a starting value for the logic to be used in the for loop to make sure we get the 
-    # most up to date channel statistics
-    
-    # set videoCount to 0
-    json_data[channel_id]["channel_statistics"]["videoCount"] = 0
-
-    
-    # loop through the json_response_data, access channel statistics and select the one to append to dictionary
-    for i, v in enumerate(json_response_data):
-
-        # accss channel statistics from the first file in the json response data
-        channel_statistics_ = json_response_data[i][channel_id]["channel_statistics"]
-        # convert the string to integer
-        channel_statistics_["videoCount"] = int(channel_statistics_["videoCount"])
-
-        # add channel statistics to json_data if the video count is higher than previous file
-        # NOTE: videoCount might need to be changed to viewCount as the logic could be affected if videos are
-        # deleted from channel
-        if channel_statistics_["videoCount"] > json_data[channel_id]["channel_statistics"]["videoCount"]:
-            # update json_data dictionary with new videoCount and the up to date channel statistics
-            json_data[channel_id]["channel_statistics"] = channel_statistics_
-    
+    # merge the files into one record per video, keeping the freshest statistics for videos that appear
+    # in more than one file (overlapping date windows, backfills, incremental syncs) and the most up to
+    # date channel statistics; the result doesn't depend on the order of the files
+    json_data = merge_json_responses(json_response_data)
 
     ##### Create DataFrame #####
     # Using the dictionary created above with pd.json_normalize() won't work so we need to do a bit of 
-    # further processing to get the data in a format that we can use pd.json_normalize()
-    
-    # store a list of the "video_data" dictionaries
-    video_data = json_data[channel_id]["video_data"]
-    # get list of video IDs and a list of the video data dictionaries dictionaries
-    # store the video ids in a list
-    video_ids = [vid_id for vid_id in video_data.keys()]
-    video_data_dictionaries = [video_data_dict for video_data_dict in video_data.values()]
+    # further processing to get the data in a format that we can use pd.json_normalize()
     
-    # loop through the list of video data dictionaries and add the video ID to the dictionary 
-    for index, data_dict in enumerate(video_data_dictionaries):
-        data_dict['videoID'] = video_ids[index] 
+    # loop through the video data of every channel and add the video ID to a copy of each dictionary (the
+    # input data is left unchanged)
+    video_data_dictionaries = [dict(video_data_dict, videoID=video_id)
+                               for channel_data in json_data.values()
+                               for video_id, video_data_dict in channel_data["video_data"].items()]
     
-    # video_data_dictionaries now has the data in a format we can use with pd.json_normalize()
-    # to create a dataframe
+    # video_data_dictionaries now has the data in a format we can use with pd.json_normalize()
+    # to create a dataframe
     df = pd.json_normalize(video_data_dictionaries)
     
     
@@ -182,6 +149,114 @@ def json_response_to_dataframe(json_response_data):
 
 
 
+def _flatten_json_file(file_path):
+    """Reads a single raw JSON response file and flattens its video data into a dataframe with a
+    'videoID' column. Runs in a worker process when called by `json_files_to_dataframe`.
+    """
+    json_response = json_codec.load(file_path)
+
+    # a raw file has the channel ID as its key; a combined file is a list of those dictionaries
+    if isinstance(json_response, dict):
+        json_response = [json_response]
+
+    video_data_dictionaries = []
+    freshness = []
+    for channel_data in json_response:
+        for channel_id, data in channel_data.items():
+            response_key = response_freshness(data)
+            for video_id, video_data_dict in data["video_data"].items():
+                video_data_dictionaries.append(dict(video_data_dict, videoID=video_id))
+                freshness.append(record_freshness(response_key, video_data_dict))
+
+    df = pd.json_normalize(video_data_dictionaries)
+    # freshness key of each row, used by the parent process to pick one row per video
+    df["_freshness"] = pd.Series(freshness, index=df.index, dtype=object)
+
+    return df
+
+
+
+@instrument("processing.json_files_to_dataframe")
+def json_files_to_dataframe(folder_path, workers=None):
+    """Parses the raw JSON response files in parallel and returns the same dataframe as calling
+    `combine_all_json_files` followed by `json_response_to_dataframe`.
+
+    Each file is read and flattened into a dataframe in its own worker process; the parent process then
+    concatenates the dataframes. Files are processed in sorted file name order (the file names contain the
+    date window) and if a video appears in more than one file the freshest row is kept, using the same rule
+    as `merge_json_responses`, so the result doesn't depend on the order the files are listed or finish in.
+
+    Parameters
+    ----------
+    folder_path : string or list
+        Path to the folder that holds the raw JSON files, a list of file paths, or the path of an archive
+        created by `src.storage.raw_archive` (read in the current process).
+
+    workers : int
+        Number of worker processes. Defaults to the number of CPU cores; 1 parses the files in the current
+        process.
+
+    Returns
+    -------
+    df : pandas dataframe
+        Dataframe of the video data. Columns and column names are untouched.
+
+    Example Use
+    -----------
+    df = json_files_to_dataframe("data/raw/JSON_response")
+
+    """
+    # a compacted archive already holds every response; read it directly
+    if isinstance(folder_path, str) and os.path.isfile(folder_path):
+        from src.storage.raw_archive import RawArchive
+
+        return json_response_to_dataframe(RawArchive(folder_path).responses())
+
+    # get a sorted list of the files so the output is deterministic
+    if isinstance(folder_path, str):
+        file_paths = sorted(glob.glob(os.path.join(folder_path, "*.json")))
+    else:
+        file_paths = sorted(folder_path)
+
+    if not file_paths:
+        print(f"No JSON files found in {folder_path}")
+        return pd.DataFrame()
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(file_paths))
+
+    # parse the files; executor.map returns results in the order of file_paths regardless of which
+    # worker finishes first
+    if workers == 1:
+        chunks = [_flatten_json_file(file_path) for file_path in file_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_flatten_json_file, file_paths))
+
+    # concatenate the chunks and keep the freshest row for each video (same rule as `merge_json_responses`)
+    df = pd.concat(chunks, ignore_index=True, sort=False)
+
+    best_rows = {}
+    for row, (video_id, key) in enumerate(zip(df["videoID"], df["_freshness"])):
+        if video_id not in best_rows or key > best_rows[video_id][0]:
+            best_rows[video_id] = (key, row)
+
+    df = (df
+          .iloc[[best_rows[video_id][1] for video_id in sorted(best_rows)]]
+          .drop(columns="_freshness")
+          .reset_index(drop=True))
+
+    # match the column order of `json_response_to_dataframe`: videoID first, then the other columns in the
+    # order they first appear in the (video ID ordered) rows
+    present = df.notna().to_numpy()
+    first_row = np.where(present.any(axis=0), present.argmax(axis=0), len(df))
+    columns = [df.columns[j] for j in sorted(range(df.shape[1]), key=lambda j: (first_row[j], j))]
+    df = df[["videoID"] + [col for col in columns if col != "videoID"]]
+
+    return df
+
+
+
 # functions that clean the data
 
 def remove_prefixes(column_name):
@@ -220,6 +295,7 @@ def remove_prefixes(column_name):
 
 
 
+@instrument("processing.drop_columns")
 def drop_columns(df):
     """Drops columns and returns a dataframe.
     
@@ -267,3 +343,29 @@ def drop_columns(df):
     return df_
 
 
+
+def clean_dataframe(df):
+    """Removes the column prefixes, drops the columns not needed for analysis and converts the count
+    columns (which the API returns as strings) to numbers.
+
+    Parameters
+    -----------
+    df (dataframe):
+        Dataframe of the video data, e.g. the output of `json_response_to_dataframe`.
+
+    Returns
+    --------
+    df_ (dataframe)
+        Cleaned dataframe.
+
+    """
+    df_ = df.copy()
+    df_.columns = df_.columns.map(remove_prefixes)
+    df_ = drop_columns(df_)
+
+    # the API returns counts as strings; the notebooks got numbers by saving and re-reading the CSV
+    for column in ["viewCount", "likeCount", "favoriteCount", "commentCount"]:
+        if column in df_.columns:
+            df_[column] = pd.to_numeric(df_[column], errors="coerce")
+
+    return df_
@@ -0,0 +1,284 @@
+# tag_analysis.py
+"""Contains the class that indexes video tags so they can be analysed with array operations: which tags
+appear together (e.g. which guests appear with which), the top tags per series or month, and which videos
+share tags with a given video.
+
+The tags of every video are parsed once into:
+    - a vocabulary: each distinct tag is stored once and given an integer id
+    - a sparse video x tag matrix in CSR form (`indptr`, `indices`): the tag ids of video i are
+      indices[indptr[i]:indptr[i + 1]]
+    - the same matrix in CSC form (built when first needed): the videos that have tag t
+
+Only numpy is needed. With thousands of videos and tens of thousands of tags the matrices hold one int32 per
+(video, tag) pair, and every query below is a handful of vectorised numpy calls (bincount, unique, repeat)
+rather than Python loops over tag lists.
+
+Class TagIndex:
+- `TagIndex(video_ids, tag_lists, normalise=True)`
+- `TagIndex.from_dataframe(df, tag_column="tags", normalise=True)`
+- `TagIndex.load(path)`
+
+TagIndex methods:
+- `save(self, path)`
+- `tag_counts(self, n=None)`
+- `videos_with_tag(self, tag)`
+- `cooccurrence(self, tag, n=10)`
+- `tag_pairs(self, min_count=2, n=None)`
+- `top_tags_by(self, labels, n=5)`
+- `similar_videos(self, video_id, n=10)`
+
+Functions include:
+
+    `parse_tags(value)`:
+        Returns a list of tags from a list or from the stringified list stored in the CSV files.
+
+"""
+
+import ast
+
+from src.monitoring.instrumentation import instrument
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+def parse_tags(value):
+    """Returns a list of tags from a list, or from the string form of a list saved in the CSV files
+    ("['open goal', 'si ferry']"). Missing values give an empty list."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return list(value)
+
+    if isinstance(value, str) and value.startswith("["):
+        try:
+            return list(ast.literal_eval(value))
+        except (ValueError, SyntaxError):
+            return []
+
+    return []
+
+
+class TagIndex:
+    """Interned tag vocabulary and sparse video x tag matrix.
+
+    Parameters
+    ----------
+    video_ids : list
+        ID of each video.
+
+    tag_lists : list
+        List of tags (or stringified list) for each video, in the same order as `video_ids`.
+
+    normalise : bool
+        If True, tags are lower-cased and stripped so 'Rangers' and 'rangers ' are the same tag. Repeated
+        tags within a video are counted once.
+
+    """
+
+    def __init__(self, video_ids, tag_lists, normalise=True):
+        self.video_ids = np.asarray(list(video_ids), dtype=object)
+        self.vocabulary = []
+        self.tag_to_id = {}
+
+        indptr = [0]
+        indices = []
+        for tags in tag_lists:
+            row = set()
+            for tag in parse_tags(tags):
+                if normalise:
+                    tag = str(tag).strip().lower()
+                if not tag:
+                    continue
+                tag_id = self.tag_to_id.get(tag)
+                if tag_id is None:
+                    tag_id = len(self.vocabulary)
+                    self.tag_to_id[tag] = tag_id
+                    self.vocabulary.append(tag)
+                row.add(tag_id)
+            indices.extend(sorted(row))
+            indptr.append(len(indices))
+
+        self._set_arrays(np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int32))
+
+    def _set_arrays(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        self.row_lengths = np.diff(indptr)
+        # row number of every stored (video, tag) pair
+        self.rows = np.repeat(np.arange(len(self.row_lengths)), self.row_lengths)
+        self.video_to_row = {video_id: i for i, video_id in enumerate(self.video_ids)}
+        self._csc = None
+
+    @classmethod
+    @instrument("tags.from_dataframe")
+    def from_dataframe(cls, df, tag_column="tags", normalise=True):
+        """Builds the index from a dataframe with 'videoID' and `tag_column` columns."""
+        return cls(df["videoID"], df[tag_column], normalise=normalise)
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    @property
+    def n_tags(self):
+        return len(self.vocabulary)
+
+    ##### Saving and loading #####
+
+    def save(self, path):
+        """Saves the index to a .npz file so the tags don't need to be parsed again."""
+        np.savez_compressed(path, indptr=self.indptr, indices=self.indices,
+                            video_ids=self.video_ids.astype(str), vocabulary=np.asarray(self.vocabulary, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index saved with `save`."""
+        data = np.load(path, allow_pickle=False)
+        index = cls.__new__(cls)
+        index.video_ids = data["video_ids"].astype(object)
+        index.vocabulary = data["vocabulary"].tolist()
+        index.tag_to_id = {tag: i for i, tag in enumerate(index.vocabulary)}
+        index._set_arrays(data["indptr"], data["indices"])
+        return index
+
+    ##### Helpers #####
+
+    def _tag_id(self, tag):
+        tag_id = self.tag_to_id.get(tag, self.tag_to_id.get(str(tag).strip().lower()))
+        if tag_id is None:
+            raise KeyError(f"Tag '{tag}' is not in the index.")
+        return tag_id
+
+    def _csc_arrays(self):
+        """Returns (col_indptr, col_rows): the videos that have tag t are col_rows[col_indptr[t]:col_indptr[t + 1]]."""
+        if self._csc is None:
+            order = np.argsort(self.indices, kind="stable")
+            col_indptr = np.zeros(self.n_tags + 1, dtype=np.int64)
+            col_indptr[1:] = np.cumsum(np.bincount(self.indices, minlength=self.n_tags))
+            self._csc = (col_indptr, self.rows[order])
+        return self._csc
+
+    def _rows_with_tag(self, tag_id):
+        col_indptr, col_rows = self._csc_arrays()
+        return col_rows[col_indptr[tag_id]:col_indptr[tag_id + 1]]
+
+    def _counts_to_series(self, counts, n, name):
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0]
+        if n is not None:
+            order = order[:n]
+        return pd.Series(counts[order], index=pd.Index([self.vocabulary[i] for i in order], name="tag"), name=name)
+
+    ##### Queries #####
+
+    def tag_counts(self, n=None):
+        """Returns the number of videos with each tag, most used first (top `n` if given)."""
+        return self._counts_to_series(np.bincount(self.indices, minlength=self.n_tags), n, "videos")
+
+    def videos_with_tag(self, tag):
+        """Returns the IDs of the videos that have `tag`."""
+        return self.video_ids[self._rows_with_tag(self._tag_id(tag))].tolist()
+
+    def cooccurrence(self, tag, n=10):
+        """Returns the tags that appear most often on the same videos as `tag`, with the number of videos
+        they share (e.g. the guests that appear most often with a given guest)."""
+        tag_id = self._tag_id(tag)
+
+        has_tag = np.zeros(len(self), dtype=bool)
+        has_tag[self._rows_with_tag(tag_id)] = True
+
+        counts = np.bincount(self.indices[has_tag[self.rows]], minlength=self.n_tags)
+        counts[tag_id] = 0
+        return self._counts_to_series(counts, n, "shared_videos")
+
+    def tag_pairs(self, min_count=2, n=None):
+        """Returns every pair of tags that appear together on at least `min_count` videos: the edges of the
+        tag (guest) network.
+
+        Returns
+        -------
+        df : pandas dataframe
+            Columns 'tag_a', 'tag_b' and 'videos', sorted by 'videos' (highest first).
+        """
+        # pair every stored (video, tag) with every tag of the same video
+        lengths = self.row_lengths[self.rows]
+        left = np.repeat(self.indices, lengths)
+        starts = np.repeat(self.indptr[:-1][self.rows], lengths)
+        offsets = np.arange(len(left)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        right = self.indices[starts + offsets]
+
+        # keep each unordered pair once and count the videos it appears on
+        keep = left < right
+        pair_keys = left[keep].astype(np.int64) * self.n_tags + right[keep]
+        keys, counts = np.unique(pair_keys, return_counts=True)
+
+        keep = counts >= min_count
+        keys, counts = keys[keep], counts[keep]
+        order = np.argsort(-counts, kind="stable")
+        if n is not None:
+            order = order[:n]
+
+        vocabulary = np.asarray(self.vocabulary, dtype=object)
+        return pd.DataFrame({"tag_a": vocabulary[keys[order] // self.n_tags],
+                             "tag_b": vocabulary[keys[order] % self.n_tags],
+                             "videos": counts[order]})
+
+    def top_tags_by(self, labels, n=5):
+        """Returns the top `n` tags for each group of videos, e.g. per series or per month.
+
+        Parameters
+        ----------
+        labels : array-like
+            Group label of each video, in the same order as the index (e.g. df["publishedAtYearMonth"]).
+
+        Returns
+        -------
+        df : pandas dataframe
+            Columns 'group', 'tag' and 'videos', sorted by group and then by 'videos' (highest first).
+        """
+        codes, groups = pd.factorize(pd.Series(list(labels)), sort=True)
+        element_groups = codes[self.rows]
+
+        valid = element_groups >= 0
+        keys, counts = np.unique(element_groups[valid].astype(np.int64) * self.n_tags + self.indices[valid],
+                                 return_counts=True)
+
+        df = pd.DataFrame({"group": groups[keys // self.n_tags],
+                           "tag": np.asarray(self.vocabulary, dtype=object)[keys % self.n_tags],
+                           "videos": counts})
+        return (df
+                .sort_values(["group", "videos", "tag"], ascending=[True, False, True])
+                .groupby("group", sort=False)
+                .head(n)
+                .reset_index(drop=True))
+
+    def similar_videos(self, video_id, n=10):
+        """Returns the videos that share the most tags with `video_id`.
+
+        Returns
+        -------
+        df : pandas dataframe
+            Columns 'videoID', 'shared_tags' and 'jaccard' (shared tags / tags on either video), sorted by
+            'shared_tags' and then 'jaccard'.
+        """
+        row = self.video_to_row.get(video_id)
+        if row is None:
+            raise KeyError(f"Video '{video_id}' is not in the index.")
+
+        col_indptr, col_rows = self._csc_arrays()
+        tag_ids = self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+        # every video that has one of the tags, once per shared tag
+        starts, ends = col_indptr[tag_ids], col_indptr[tag_ids + 1]
+        lengths = ends - starts
+        positions = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        shared = np.bincount(col_rows[positions], minlength=len(self))
+        shared[row] = 0
+
+        candidates = np.flatnonzero(shared)
+        union = self.row_lengths[candidates] + len(tag_ids) - shared[candidates]
+        jaccard = shared[candidates] / union
+
+        order = np.lexsort((-jaccard, -shared[candidates]))[:n]
+        return pd.DataFrame({"videoID": self.video_ids[candidates[order]],
+                             "shared_tags": shared[candidates[order]],
+                             "jaccard": jaccard[order]})
@@ -0,0 +1,357 @@
+# raw_archive.py
+"""Contains the class that packs raw API responses into a single compressed archive with an index by video
+ID, so the history of one video can be read without decompressing (or even reading) the rest.
+
+The raw responses are kept as pretty-printed JSON files, and `combine_all_json_files` writes all of them
+again into data/processed; every new fetch adds another full copy of the video data. The archive instead
+stores each (response, video) record once, as compact JSON, in zlib compressed blocks:
+
+File layout
+-----------
+    MAGIC (8 bytes)
+    then, for each append:
+    block n, block n + 1, ...
+        zlib compressed lines of "<videoID>\\t<record JSON>", sorted by video ID within each append, so the
+        records of a video are usually in a single block
+    index
+        zlib compressed JSON of what the append added: the new responses (channel, channel statistics,
+        fetchedAt, source file, content hash), the (offset, length) of the new blocks and, for every video ID
+        in them, the new blocks holding its records
+    trailer (32 bytes)
+        index offset, index length, end of the previous append's trailer (len(MAGIC) for the first), MAGIC
+
+Opening the archive follows the chain of trailers back from the end of the file and merges the indexes, oldest
+first. Reading one video then decompresses only that video's blocks. New responses are appended after the
+current trailer: the new blocks, then the index of the append and its trailer, so nothing already written is
+changed and the archive grows by the compressed size of the new data only.
+If an append is interrupted, the file ends in an incomplete write; opening it finds the last complete
+trailer instead, so the archive is read as it was before the append, and the next append overwrites the
+incomplete part. A response that is already in the archive (same content hash, e.g. a copy of a file) is
+skipped.
+
+Usage (from the repository root):
+
+    python -m src archive --raw-folder data/raw/JSON_response --output data/raw/archive.oga
+    python -m src archive --output data/raw/archive.oga --video-id uaI_p7L3128
+
+Class RawArchive:
+- `RawArchive(path)`
+
+RawArchive methods:
+- `append_responses(self, responses, sources=None)`
+- `append_files(self, file_paths)`
+- `video_ids(self)`
+- `video_history(self, video_id)`
+- `iter_records(self)`
+- `responses(self)`
+- `stats(self)`
+
+"""
+
+import glob
+import hashlib
+import json
+import os
+import struct
+import zlib
+
+from src.monitoring.instrumentation import instrument
+from src.processing.merge_responses import record_freshness, response_freshness
+from src.utils import json_codec
+
+
+MAGIC = b"OGARCH02"
+TRAILER = struct.Struct("<QQQ8s")  # index offset, index length, end of the previous trailer, MAGIC
+
+BLOCK_SIZE = 1 << 16       # uncompressed bytes of records per block
+COMPRESSION_LEVEL = 6
+
+
+def _content_hash(response):
+    """Returns the sha256 of a canonical serialisation of `response`. It is made with the standard library
+    json module, not `json_codec`, so the hash doesn't depend on which JSON backend is in use (they differ in
+    key order, escaping of non-ASCII characters and of '/')."""
+    canonical = json.dumps(response, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RawArchive:
+    """Compressed, block based archive of raw API responses with a video ID index.
+
+    Parameters
+    ----------
+    path : string
+        The archive file; created by the first append if it doesn't exist.
+
+    block_size : int
+        Target uncompressed size of a block in bytes. Smaller blocks make single video reads cheaper,
+        larger blocks compress better.
+
+    """
+
+    def __init__(self, path, block_size=BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+
+        # responses: [{"channelId", "fetchedAt", "channel_statistics", "source", "hash"}]
+        # blocks: [[offset, length]]; videos: {video_id: [block numbers]}
+        self.index = {"responses": [], "blocks": [], "videos": {}}
+        # end of the last complete trailer: appends are written from here
+        self.end_offset = len(MAGIC)
+
+        if os.path.exists(path):
+            self._read_index()
+
+    def _read_index(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a raw response archive.")
+            if os.path.getsize(self.path) == len(MAGIC):
+                return
+
+            # the last trailer is normally at the very end
+            trailer_start = os.path.getsize(self.path) - TRAILER.size
+            index = self._index_at(f, trailer_start) if trailer_start >= len(MAGIC) else None
+
+            # after an interrupted append it is further back: search for the last complete one
+            if index is None:
+                f.seek(0)
+                data = f.read()
+                position = len(data)
+                while index is None:
+                    position = data.rfind(MAGIC, 0, position)
+                    if position < TRAILER.size:
+                        # even the first append is incomplete: the archive is empty
+                        print(f"{self.path}: ignoring an incomplete append after byte {len(MAGIC)}")
+                        return
+                    trailer_start = position - (TRAILER.size - len(MAGIC))
+                    index = self._index_at(f, trailer_start)
+                print(f"{self.path}: ignoring an incomplete append after byte {trailer_start + TRAILER.size}")
+
+            self.end_offset = trailer_start + TRAILER.size
+
+            # each append's index only holds what it added: collect them back to the first append
+            indexes = [index]
+            while index["previous"] > len(MAGIC):
+                index = self._index_at(f, index["previous"] - TRAILER.size)
+                if index is None:
+                    raise ValueError(f"{self.path} has a broken index chain.")
+                indexes.append(index)
+
+        for index in reversed(indexes):
+            self.index["responses"].extend(index["responses"])
+            self.index["blocks"].extend(index["blocks"])
+            for video_id, block_numbers in index["videos"].items():
+                self.index["videos"].setdefault(video_id, []).extend(block_numbers)
+
+    def _index_at(self, f, trailer_start):
+        """Returns the index of the append whose trailer starts at `trailer_start`, with the end of the
+        previous trailer under "previous", or None if there isn't a complete trailer and index there."""
+        f.seek(trailer_start)
+        index_offset, index_length, previous, _ = TRAILER.unpack(f.read(TRAILER.size))
+        if index_offset + index_length != trailer_start or not len(MAGIC) <= previous <= index_offset:
+            return None
+        f.seek(index_offset)
+        try:
+            index = json_codec.loads(zlib.decompress(f.read(index_length)))
+        except (zlib.error, ValueError):
+            return None
+        index["previous"] = previous
+        return index
+
+    def __len__(self):
+        return len(self.index["responses"])
+
+    ##### Writing #####
+
+    def _blocks(self, lines):
+        """Groups encoded record lines into compressed blocks. Yields (compressed bytes, video IDs)."""
+        block, video_ids, size = [], set(), 0
+        for video_id, line in lines:
+            block.append(line)
+            video_ids.add(video_id)
+            size += len(line)
+            if size >= self.block_size:
+                yield zlib.compress(b"".join(block), COMPRESSION_LEVEL), video_ids
+                block, video_ids, size = [], set(), 0
+        if block:
+            yield zlib.compress(b"".join(block), COMPRESSION_LEVEL), video_ids
+
+    @instrument("archive.append_responses")
+    def append_responses(self, responses, sources=None):
+        """Adds raw responses ({channel_id: {"channel_statistics": ..., "video_data": ..., "fetchedAt": ...}})
+        to the archive. Responses already in the archive are skipped.
+
+        Parameters
+        ----------
+        responses : list
+            Raw responses, e.g. `json_codec.load(file)` of each raw file, or the list in all_json_data.json.
+
+        sources : list
+            Optional name of each response (e.g. its file name), stored in the index.
+
+        Returns
+        -------
+        added : int
+            Number of (channel) responses added.
+        """
+        known = {response["hash"] for response in self.index["responses"]}
+        first_response, first_block = len(self.index["responses"]), len(self.index["blocks"])
+        lines = []
+        added = 0
+
+        for i, response in enumerate(responses):
+            source = sources[i] if sources else None
+            for channel_id, channel_data in response.items():
+                content_hash = _content_hash({channel_id: channel_data})
+                if content_hash in known:
+                    continue
+                known.add(content_hash)
+
+                response_number = len(self.index["responses"])
+                self.index["responses"].append({"channelId": channel_id,
+                                                "fetchedAt": channel_data.get("fetchedAt"),
+                                                "channel_statistics": channel_data.get("channel_statistics", {}),
+                                                "source": source,
+                                                "hash": content_hash})
+                for video_id, video_data in channel_data.get("video_data", {}).items():
+                    record = json_codec.dumps({"response": response_number, "video_data": video_data})
+                    lines.append((video_id, f"{video_id}\t{record}\n".encode("utf-8")))
+                added += 1
+
+        if not added:
+            return 0
+
+        # records of the same video next to each other, so reading a video touches as few blocks as possible
+        lines.sort(key=lambda line: line[0])
+
+        mode = "r+b" if os.path.exists(self.path) else "wb"
+        with open(self.path, mode) as f:
+            if mode == "wb":
+                f.write(MAGIC)
+            # new blocks go after the current trailer (only the remains of an interrupted append, if any, are
+            # overwritten), so the previous index stays valid until the new trailer is complete
+            f.seek(self.end_offset)
+            f.truncate()
+
+            offset = self.end_offset
+            new_videos = {}
+            for compressed, video_ids in self._blocks(lines):
+                block_number = len(self.index["blocks"])
+                self.index["blocks"].append([offset, len(compressed)])
+                for video_id in video_ids:
+                    self.index["videos"].setdefault(video_id, []).append(block_number)
+                    new_videos.setdefault(video_id, []).append(block_number)
+                f.write(compressed)
+                offset += len(compressed)
+
+            # only what this append added; earlier indexes are reached through the trailer chain
+            index = {"responses": self.index["responses"][first_response:],
+                     "blocks": self.index["blocks"][first_block:],
+                     "videos": new_videos}
+            index = zlib.compress(json_codec.dumps(index).encode("utf-8"), COMPRESSION_LEVEL)
+            f.write(index)
+            f.write(TRAILER.pack(offset, len(index), self.end_offset, MAGIC))
+
+        self.end_offset = offset + len(index) + TRAILER.size
+        return added
+
+    def append_files(self, file_paths):
+        """Adds raw JSON response files (or a folder of them) to the archive. Combined files (a list of
+        responses, e.g. all_json_data.json) are accepted too.
+
+        Returns
+        -------
+        added : int
+            Number of (channel) responses added.
+        """
+        if isinstance(file_paths, str):
+            file_paths = sorted(glob.glob(os.path.join(file_paths, "*.json")))
+
+        responses, sources = [], []
+        for file_path in file_paths:
+            data = json_codec.load(file_path)
+            for response in (data if isinstance(data, list) else [data]):
+                responses.append(response)
+                sources.append(os.path.basename(file_path))
+
+        return self.append_responses(responses, sources)
+
+    ##### Reading #####
+
+    def _read_block(self, f, block_number):
+        offset, length = self.index["blocks"][block_number]
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+    def _record(self, video_id, record_json):
+        record = json_codec.loads(record_json)
+        response = self.index["responses"][record["response"]]
+        return {"videoID": video_id, "channelId": response["channelId"], "fetchedAt": response["fetchedAt"],
+                "response": record["response"], "video_data": record["video_data"]}
+
+    def _freshness(self, record):
+        response = self.index["responses"][record["response"]]
+        return record_freshness(response_freshness(response), record["video_data"])
+
+    def video_ids(self):
+        """Returns the IDs of every video in the archive, sorted."""
+        return sorted(self.index["videos"])
+
+    def video_history(self, video_id):
+        """Returns every record of `video_id`, oldest first (by the freshness rule of
+        `src.processing.merge_responses`). Only the blocks holding the video are decompressed.
+
+        Returns
+        -------
+        history : list
+            Dictionaries with videoID, channelId, fetchedAt, response (number) and video_data (the video's
+            raw snippet, statistics and contentDetails).
+        """
+        prefix = f"{video_id}\t".encode("utf-8")
+        records = []
+        with open(self.path, "rb") as f:
+            for block_number in self.index["videos"].get(video_id, []):
+                for line in self._read_block(f, block_number).splitlines():
+                    if line.startswith(prefix):
+                        records.append(self._record(video_id, line[len(prefix):]))
+
+        records.sort(key=self._freshness)
+        return records
+
+    def iter_records(self):
+        """Yields every record in the archive, one block at a time."""
+        if not self.index["blocks"]:
+            return
+        with open(self.path, "rb") as f:
+            for block_number in range(len(self.index["blocks"])):
+                for line in self._read_block(f, block_number).splitlines():
+                    video_id, record_json = line.split(b"\t", 1)
+                    yield self._record(video_id.decode("utf-8"), record_json)
+
+    def responses(self):
+        """Rebuilds the raw responses, in the order they were added, in the layout of the raw files (and of
+        all_json_data.json), so they can be passed to `json_response_to_dataframe` or
+        `merge_json_responses`."""
+        responses = []
+        for response in self.index["responses"]:
+            channel_data = {"channel_statistics": response["channel_statistics"], "video_data": {}}
+            if response["fetchedAt"] is not None:
+                channel_data["fetchedAt"] = response["fetchedAt"]
+            responses.append({response["channelId"]: channel_data})
+
+        for record in self.iter_records():
+            video_data = responses[record["response"]][record["channelId"]]["video_data"]
+            video_data[record["videoID"]] = record["video_data"]
+
+        # videos in the order of the original responses isn't kept; order them by video ID
+        for response in responses:
+            for channel_data in response.values():
+                channel_data["video_data"] = dict(sorted(channel_data["video_data"].items()))
+
+        return responses
+
+    def stats(self):
+        """Returns the number of responses, videos and blocks and the size of the archive in bytes."""
+        return {"responses": len(self), "videos": len(self.index["videos"]), "blocks": len(self.index["blocks"]),
+                "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
@@ -0,0 +1,344 @@
+# rollup_cube.py
+"""Contains the class that stores pre-aggregated totals of the video data (a rollup cube), so monthly totals,
+video counts and "views between X and Y for series Z" questions are answered without going back to the
+row-level data.
+
+The cube holds, for every (channel, series, month) cell, the number of videos published and the sum of their
+views, likes and comments. Along the month axis it also keeps cumulative (prefix) sums, so the total for any
+range of months is the difference of two stored values: an O(1) lookup per (channel, series) cell, however
+many months or videos the range covers.
+
+The cube is updated incrementally: adding new videos (or new statistics for videos already in the cube)
+only adds the difference to the affected cells, then the prefix sums are recalculated (one cumulative sum
+over the cube, which has one cell per channel, series and month, however many videos there are).
+
+Class RollupCube:
+- `RollupCube()`
+- `RollupCube.from_dataframe(df, series=None, dedupe=False)`
+- `RollupCube.load(path)`
+
+RollupCube methods:
+- `update(self, df, series=None, dedupe=False)`
+- `total(self, start=None, end=None, channel=None, series=None)`
+- `average(self, metric, start=None, end=None, channel=None, series=None)`
+- `monthly(self, channel=None, series=None)`
+- `video_counts(self, channel=None, series=None)`
+- `save(self, path)`
+
+"""
+
+import json
+
+from src.processing.near_duplicates import drop_near_duplicates
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+METRICS = ["videos", "viewCount", "likeCount", "commentCount"]
+
+NO_SERIES = ""  # series label of videos that don't belong to a series
+
+
+def _month_number(year, month):
+    """Months since January of year 0, so consecutive months are consecutive integers."""
+    return int(year) * 12 + int(month) - 1
+
+
+def _month_label(month_number):
+    return f"{month_number // 12:04d}-{month_number % 12 + 1:02d}"
+
+
+def _parse_month(value):
+    """Returns the month number of 'YYYY-MM', 'YYYY-MM-DD...', a 'YYYY' year (its first month), a datetime or
+    a month number."""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    timestamp = pd.Timestamp(str(value) + "-01" if len(str(value)) == 4 else value)
+    return _month_number(timestamp.year, timestamp.month)
+
+
+def assign_series(titles, series):
+    """Returns the series label of each title from title substrings (case insensitive), e.g.
+    {"Keeping the Ball on the Ground": ["keeping the ball on the ground"]}. Titles matching no series get
+    NO_SERIES; titles matching more than one get the first series that matches (the same rule as
+    `src.storage.sql_store.label_video_series`)."""
+    titles = pd.Series(titles, dtype=object).fillna("").str.lower()
+    labels = pd.Series(NO_SERIES, index=titles.index, dtype=object)
+
+    for label, title_substrings in series.items():
+        if isinstance(title_substrings, str):
+            title_substrings = [title_substrings]
+        matches = pd.Series(False, index=titles.index)
+        for substring in title_substrings:
+            matches |= titles.str.contains(substring.lower(), regex=False)
+        labels[matches & (labels == NO_SERIES)] = label
+
+    return labels.to_numpy()
+
+
+class RollupCube:
+    """Totals per (channel, series, month) with prefix sums along the month axis."""
+
+    def __init__(self):
+        self.channels = []
+        self.series = []
+        self.first_month = None            # month number of the first month on the month axis
+        self.values = np.zeros((0, 0, 0, len(METRICS)), dtype=np.int64)       # [channel, series, month, metric]
+        self.prefix = np.zeros((0, 0, 1, len(METRICS)), dtype=np.int64)       # prefix[..., m] = sum of months < m
+
+        # the cell and values each video currently contributes, so updated statistics replace the old ones
+        self.contributions = {}            # video_id -> (channel, series, month, (videos, views, likes, comments))
+
+    ##### Building and updating #####
+
+    @classmethod
+    def from_dataframe(cls, df, series=None, dedupe=False):
+        """Builds a cube from a dataframe of videos (see `update`)."""
+        cube = cls()
+        cube.update(df, series=series, dedupe=dedupe)
+        return cube
+
+    def _indices(self, vocabulary, values):
+        """Returns the position of each value in `vocabulary`, adding new values to the end of it."""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        positions = []
+        for value in uniques:
+            if value not in vocabulary:
+                vocabulary.append(value)
+            positions.append(vocabulary.index(value))
+        return np.asarray(positions, dtype=np.int64)[codes]
+
+    def _resize(self, n_months):
+        """Grows the arrays to fit the channel and series vocabularies and `n_months` months."""
+        shape = (len(self.channels), len(self.series), n_months, len(METRICS))
+        if shape == self.values.shape:
+            return
+        values = np.zeros(shape, dtype=np.int64)
+        c, s, m, _ = self.values.shape
+        values[:c, :s, :m] = self.values
+        self.values = values
+
+    def update(self, df, series=None, dedupe=False):
+        """Adds videos to the cube, or replaces the statistics of videos already in it.
+
+        Parameters
+        ----------
+        df : pandas dataframe
+            One row per video with 'videoID', 'publishedAt', 'viewCount', 'likeCount' and 'commentCount'
+            columns, and 'channelId' if there is more than one channel. The series of each video comes from
+            a 'series' column if there is one, otherwise from `series`. If a video has more than one row
+            (e.g. overlapping fetches), its last row is used.
+
+        series : dict
+            Optional {series label: [title substrings]} used to assign series from the 'title' column.
+
+        dedupe : bool
+            If True, only the first published video of each 'cluster_id' (near duplicates, see
+            `src.processing.near_duplicates.add_cluster_column`) is added; the other videos of the cluster
+            are left out, and taken out of the cube if an earlier update added them.
+
+        Returns
+        -------
+        n : int
+            Number of videos added or updated.
+
+        """
+        # one row per video, otherwise np.add.at below would add each of its rows but `contributions` would
+        # only remember (and later take out) the last one
+        df = df.drop_duplicates(subset="videoID", keep="last")
+
+        dropped = []
+        if dedupe:
+            df_kept = drop_near_duplicates(df)
+            kept = set(df_kept["videoID"])
+            dropped = [v for v in df["videoID"] if v not in kept and v in self.contributions]
+            df = df_kept
+
+        if len(df) == 0:
+            if dropped:
+                self._remove(dropped)
+                self._update_prefix()
+            return 0
+
+        published = pd.to_datetime(df["publishedAt"], utc=True)
+        months = (published.dt.year * 12 + published.dt.month - 1).to_numpy()
+
+        channels = df["channelId"].to_numpy() if "channelId" in df.columns else np.full(len(df), NO_SERIES)
+        if "series" in df.columns:
+            labels = df["series"].fillna(NO_SERIES).to_numpy()
+        elif series is not None:
+            labels = assign_series(df["title"], series)
+        else:
+            labels = np.full(len(df), NO_SERIES)
+
+        counts = np.column_stack([np.ones(len(df), dtype=np.int64)] +
+                                 [pd.to_numeric(df[metric], errors="coerce").fillna(0).to_numpy(dtype=np.int64)
+                                  for metric in METRICS[1:]])
+
+        # extend the month axis if the new videos fall outside it
+        old_first = self.first_month
+        first = int(months.min()) if old_first is None else min(old_first, int(months.min()))
+        last = int(months.max()) if old_first is None else max(old_first + self.values.shape[2] - 1,
+                                                                   int(months.max()))
+        channel_idx = self._indices(self.channels, channels)
+        series_idx = self._indices(self.series, labels)
+
+        self._resize(self.values.shape[2] if old_first is not None else 0)
+        if old_first is not None and first < old_first:
+            pad = np.zeros(self.values.shape[:2] + (old_first - first, len(METRICS)), dtype=np.int64)
+            self.values = np.concatenate([pad, self.values], axis=2)
+        self.first_month = first
+        self._resize(last - first + 1)
+
+        # remove the previous contribution of videos already in the cube (and of near duplicates left out),
+        # then add the new ones
+        self._remove([v for v in df["videoID"] if v in self.contributions] + dropped)
+
+        month_idx = months - first
+        np.add.at(self.values, (channel_idx, series_idx, month_idx), counts)
+
+        for video_id, c, s, m, v in zip(df["videoID"], channel_idx, series_idx, months, counts):
+            self.contributions[video_id] = (int(c), int(s), int(m), tuple(int(x) for x in v))
+
+        self._update_prefix()
+        return len(df)
+
+    def _remove(self, video_ids):
+        """Takes the contributions of `video_ids` out of the cube (without updating the prefix sums)."""
+        old = [self.contributions.pop(v) for v in dict.fromkeys(video_ids) if v in self.contributions]
+        if old:
+            c, s, m, v = zip(*old)
+            np.subtract.at(self.values, (np.array(c), np.array(s), np.array(m) - self.first_month), np.array(v))
+
+    def _update_prefix(self):
+        shape = self.values.shape
+        self.prefix = np.zeros(shape[:2] + (shape[2] + 1, shape[3]), dtype=np.int64)
+        np.cumsum(self.values, axis=2, out=self.prefix[:, :, 1:])
+
+    ##### Queries #####
+
+    def _selection(self, vocabulary, value):
+        """Index array for the channels or series asked for (None = all)."""
+        if value is None:
+            return np.arange(len(vocabulary))
+        values = [value] if isinstance(value, str) else list(value)
+        return np.array([vocabulary.index(v) for v in values if v in vocabulary], dtype=np.int64)
+
+    def _month_bounds(self, start, end):
+        """Positions on the month axis of the range [start, end] (both inclusive, months or years)."""
+        n_months = self.values.shape[2]
+        lo = 0 if start is None else _parse_month(start) - self.first_month
+        if end is None:
+            hi = n_months
+        else:
+            end = str(end)
+            # a year as the end means up to and including December of that year
+            hi = (_parse_month(end) + (12 if len(end) == 4 else 1)) - self.first_month
+        return min(max(lo, 0), n_months), min(max(hi, 0), n_months)
+
+    def total(self, start=None, end=None, channel=None, series=None):
+        """Returns the number of videos and the total views, likes and comments of the videos published
+        between `start` and `end` (inclusive; 'YYYY-MM', 'YYYY' or dates), for the given channel(s) and
+        series (None = all).
+
+        Example Use
+        -----------
+        cube.total("2022-01", "2022-06", series="Keeping the Ball on the Ground")["viewCount"]
+
+        """
+        if self.first_month is None:
+            return dict.fromkeys(METRICS, 0)
+
+        lo, hi = self._month_bounds(start, end)
+        cells = np.ix_(self._selection(self.channels, channel), self._selection(self.series, series))
+        if hi <= lo:
+            totals = np.zeros(len(METRICS), dtype=np.int64)
+        else:
+            totals = (self.prefix[cells + (hi,)] - self.prefix[cells + (lo,)]).reshape(-1, len(METRICS)).sum(axis=0)
+
+        return dict(zip(METRICS, (int(t) for t in totals)))
+
+    def average(self, metric, start=None, end=None, channel=None, series=None):
+        """Returns the average `metric` per video over the same selection as `total` (None if no videos)."""
+        totals = self.total(start, end, channel, series)
+        return totals[metric] / totals["videos"] if totals["videos"] else None
+
+    def _monthly_values(self, channel, series):
+        cells = np.ix_(self._selection(self.channels, channel), self._selection(self.series, series))
+        return self.values[cells].reshape(-1, self.values.shape[2], len(METRICS)).sum(axis=0)
+
+    def video_counts(self, channel=None, series=None):
+        """Returns the number of videos per month and per year ('videoCountMonth' and 'videoCountYear')
+        for every month that has videos, without merging row-level data."""
+        if self.first_month is None:
+            return pd.DataFrame(columns=["publishedAtYearMonth", "publishedAtYear", "publishedAtMonth",
+                                         "videoCountMonth", "videoCountYear"])
+
+        month_counts = self._monthly_values(channel, series)[:, 0]
+        month_numbers = np.arange(self.first_month, self.first_month + len(month_counts))
+        years = month_numbers // 12
+
+        df = pd.DataFrame({"publishedAtYearMonth": [_month_label(m) for m in month_numbers],
+                           "publishedAtYear": [f"{y:04d}" for y in years],
+                           "publishedAtMonth": [f"{m % 12 + 1:02d}" for m in month_numbers],
+                           "videoCountMonth": month_counts})
+        df["videoCountYear"] = df.groupby("publishedAtYear")["videoCountMonth"].transform("sum")
+
+        return df[df["videoCountMonth"] > 0].reset_index(drop=True)
+
+    def monthly(self, channel=None, series=None):
+        """Returns the monthly totals in the same layout as `prep_df_for_visualisation`.
+
+        As in the pipeline (where `create_video_counts_columns` runs before the series are split),
+        'videoCountMonth' and 'videoCountYear' count all of the selected channels' videos, not just those in
+        `series`.
+        """
+        columns = ["publishedAtYearMonth", "publishedAtYear", "publishedAtMonth",
+                   "viewCount", "likeCount", "commentCount", "videoCountMonth", "videoCountYear"]
+        if self.first_month is None:
+            return pd.DataFrame(columns=columns)
+
+        values = self._monthly_values(channel, series)
+        counts = self.video_counts(channel=channel).set_index("publishedAtYearMonth")
+
+        df = pd.DataFrame(values[:, 1:], columns=METRICS[1:])
+        df["publishedAtYearMonth"] = [_month_label(m) for m in range(self.first_month,
+                                                                     self.first_month + len(values))]
+        df = df[values[:, 0] > 0]
+        df["publishedAtYear"] = df["publishedAtYearMonth"].str[:4]
+        df["publishedAtMonth"] = df["publishedAtYearMonth"].str[5:]
+        df["videoCountMonth"] = df["publishedAtYearMonth"].map(counts["videoCountMonth"]).astype(int)
+        df["videoCountYear"] = df["publishedAtYearMonth"].map(counts["videoCountYear"]).astype(int)
+
+        return df[columns].reset_index(drop=True)
+
+    ##### Saving and loading #####
+
+    def save(self, path):
+        """Saves the cube (including the per-video contributions needed for later updates) to a .npz file."""
+        video_ids = list(self.contributions)
+        cells = np.array([self.contributions[v][:3] for v in video_ids], dtype=np.int64).reshape(-1, 3)
+        counts = np.array([self.contributions[v][3] for v in video_ids], dtype=np.int64).reshape(-1, len(METRICS))
+        meta = {"channels": self.channels, "series": self.series, "first_month": self.first_month}
+
+        np.savez_compressed(path, values=self.values, video_ids=np.array(video_ids, dtype=str),
+                            cells=cells, counts=counts, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path):
+        """Loads a cube saved with `save`."""
+        data = np.load(path, allow_pickle=False)
+        meta = json.loads(str(data["meta"]))
+
+        cube = cls()
+        cube.channels, cube.series, cube.first_month = meta["channels"], meta["series"], meta["first_month"]
+        cube.values = data["values"]
+        cube.contributions = {video_id: (int(c), int(s), int(m), tuple(int(x) for x in v))
+                              for video_id, (c, s, m), v in zip(data["video_ids"].tolist(), data["cells"],
+                                                                 data["counts"])}
+        cube._update_prefix()
+        return cube
@@ -0,0 +1,464 @@
+# snapshot_store.py
+"""Contains the class that stores snapshots of video statistics (view, like and comment counts) over time so
+that growth can be analysed, rather than just the counts at the time of the latest fetch.
+
+Layout on disk
+--------------
+    <root>/video_ids.txt
+        Append-only vocabulary; line i holds the video ID stored as integer i in the segments.
+
+    <root>/partitions/<YYYY-MM-DD>/seg-<n>/<column>.npy
+        One folder per UTC day of snapshot timestamps. Each append writes a new segment; each column of a
+        segment is a separate .npy file so it can be memory-mapped and read on its own. Rows in a segment
+        are sorted by (video_idx, snapshot_ts).
+
+Columns: video_idx (int32), snapshot_ts (int64, seconds since the epoch, UTC), viewCount, likeCount,
+commentCount (int64, -1 where the count was hidden/missing).
+
+Class SnapshotStore:
+- `SnapshotStore(root="data/snapshots")`
+
+SnapshotStore methods:
+- `append(video_ids, snapshot_ts, view_counts, like_counts, comment_counts)`
+- `append_dataframe(self, df, snapshot_ts=None)`
+- `append_video_data(self, video_data, snapshot_ts)`
+- `iter_read(self, start=None, end=None, video_ids=None, columns=None)`
+- `read(self, start=None, end=None, video_ids=None, columns=None)`
+- `iter_daily_velocity(self, metric="viewCount", start=None, end=None, video_ids=None)`
+- `daily_velocity(self, metric="viewCount", start=None, end=None, video_ids=None)`
+- `compact(self, day=None)`
+
+"""
+
+import datetime as dt
+import os
+import shutil
+
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+COUNT_COLUMNS = ["viewCount", "likeCount", "commentCount"]
+COLUMNS = ["video_idx", "snapshot_ts"] + COUNT_COLUMNS
+DTYPES = {"video_idx": "int32", "snapshot_ts": "int64",
+          "viewCount": "int64", "likeCount": "int64", "commentCount": "int64"}
+
+SECONDS_PER_DAY = 86400
+
+
+def _to_epoch_seconds(value):
+    """Converts a timestamp (string, datetime, pandas Timestamp or number of seconds) to integer seconds
+    since the epoch (UTC)."""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer, float, np.floating)):
+        # numbers are seconds (e.g. `time.time()`); pandas would read them as nanoseconds
+        return int(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("UTC")
+    return int(ts.timestamp())
+
+
+def _day_name(epoch_seconds):
+    return dt.datetime.fromtimestamp(int(epoch_seconds), tz=dt.timezone.utc).strftime("%Y-%m-%d")
+
+
+def _to_counts(values):
+    """Converts counts (the API returns them as strings, hidden counts are missing) to int64 with -1 for
+    missing."""
+    return pd.to_numeric(pd.Series(values), errors="coerce").fillna(-1).to_numpy(dtype=np.int64)
+
+
+class SnapshotStore:
+    """Append-only, columnar store of video statistics snapshots partitioned by day.
+
+    Parameters
+    ----------
+    root : string
+        Folder the store lives in; created if it doesn't exist.
+
+    """
+
+    def __init__(self, root="data/snapshots"):
+        self.root = root
+        self.partitions_folder = os.path.join(root, "partitions")
+        self.vocabulary_path = os.path.join(root, "video_ids.txt")
+        os.makedirs(self.partitions_folder, exist_ok=True)
+
+        # load the video id vocabulary
+        self.video_ids = []
+        if os.path.exists(self.vocabulary_path):
+            with open(self.vocabulary_path, "r") as f:
+                self.video_ids = [line.rstrip("\n") for line in f if line.strip()]
+        self._video_idx = {video_id: i for i, video_id in enumerate(self.video_ids)}
+
+    def __len__(self):
+        """Number of snapshot rows in the store (reads only the segment headers)."""
+        return sum(len(np.load(os.path.join(seg, "video_idx.npy"), mmap_mode="r"))
+                   for _, seg in self._segments())
+
+    ##### Writing #####
+
+    def _intern(self, video_ids):
+        """Returns the integer ids of `video_ids`, adding unseen ids to the vocabulary."""
+        new_ids = []
+        indices = np.empty(len(video_ids), dtype=np.int32)
+
+        for i, video_id in enumerate(video_ids):
+            idx = self._video_idx.get(video_id)
+            if idx is None:
+                idx = len(self.video_ids)
+                self._video_idx[video_id] = idx
+                self.video_ids.append(video_id)
+                new_ids.append(video_id)
+            indices[i] = idx
+
+        if new_ids:
+            with open(self.vocabulary_path, "a") as f:
+                f.write("".join(f"{video_id}\n" for video_id in new_ids))
+
+        return indices
+
+    def append(self, video_ids, snapshot_ts, view_counts, like_counts, comment_counts):
+        """Appends snapshots to the store. Rows already in the store (same video and timestamp) and
+        duplicates within the batch are dropped.
+
+        Parameters
+        ----------
+        video_ids : list
+            Video ID of each snapshot.
+
+        snapshot_ts : timestamp or list
+            Time each snapshot was taken: a single value for the whole batch or one per row.
+
+        view_counts, like_counts, comment_counts : list
+            The counts for each snapshot (strings or numbers; missing values are stored as -1).
+
+        Returns
+        -------
+        rows_written : int
+            Number of new rows added.
+
+        """
+        n = len(video_ids)
+        if n == 0:
+            return 0
+
+        if np.ndim(snapshot_ts) == 0:
+            ts = np.full(n, _to_epoch_seconds(snapshot_ts), dtype=np.int64)
+        else:
+            ts = np.array([_to_epoch_seconds(t) for t in snapshot_ts], dtype=np.int64)
+
+        batch = pd.DataFrame({"video_idx": self._intern(list(video_ids)),
+                              "snapshot_ts": ts,
+                              "viewCount": _to_counts(view_counts),
+                              "likeCount": _to_counts(like_counts),
+                              "commentCount": _to_counts(comment_counts)})
+
+        # de-duplicate within the batch (last row wins)
+        batch = batch.drop_duplicates(subset=["video_idx", "snapshot_ts"], keep="last")
+        batch["day"] = batch["snapshot_ts"] // SECONDS_PER_DAY
+
+        rows_written = 0
+        for day, rows in batch.groupby("day", sort=True):
+            rows_written += self._append_day(int(day), rows.drop(columns="day"))
+
+        return rows_written
+
+    def _append_day(self, day, rows):
+        """Writes the rows for a single day as a new segment, skipping rows that already exist."""
+        day_folder = os.path.join(self.partitions_folder, _day_name(day * SECONDS_PER_DAY))
+
+        # drop rows already stored for this day; the key packs (video, second of day) into one integer
+        keys = rows["video_idx"].to_numpy(np.int64) * SECONDS_PER_DAY + rows["snapshot_ts"].to_numpy() % SECONDS_PER_DAY
+        existing = [self._segment_keys(seg) for seg in self._day_segments(day_folder)]
+        if existing:
+            rows = rows[~np.isin(keys, np.concatenate(existing))]
+
+        if rows.empty:
+            return 0
+
+        rows = rows.sort_values(["video_idx", "snapshot_ts"])
+
+        # write to a temporary folder then rename, so readers never see a half-written segment
+        segment_folder = os.path.join(day_folder, f"seg-{self._next_segment_number(day_folder):06d}")
+        tmp_folder = segment_folder + ".tmp"
+        os.makedirs(tmp_folder, exist_ok=True)
+
+        for column in COLUMNS:
+            np.save(os.path.join(tmp_folder, f"{column}.npy"), rows[column].to_numpy(dtype=DTYPES[column]))
+
+        os.replace(tmp_folder, segment_folder)
+
+        return len(rows)
+
+    def append_dataframe(self, df, snapshot_ts=None):
+        """Appends snapshots from a dataframe with 'videoID', 'viewCount', 'likeCount' and 'commentCount'
+        columns (e.g. the output of `json_response_to_dataframe` after `remove_prefixes`).
+
+        Parameters
+        ----------
+        df : pandas dataframe
+            Dataframe of video statistics.
+
+        snapshot_ts : timestamp
+            Time the statistics were fetched. If None the dataframe must have a 'snapshot_ts' column.
+
+        """
+        ts = df["snapshot_ts"].tolist() if snapshot_ts is None else snapshot_ts
+
+        return self.append(df["videoID"].tolist(), ts,
+                           df["viewCount"].tolist() if "viewCount" in df else [None] * len(df),
+                           df["likeCount"].tolist() if "likeCount" in df else [None] * len(df),
+                           df["commentCount"].tolist() if "commentCount" in df else [None] * len(df))
+
+    def append_video_data(self, video_data, snapshot_ts):
+        """Appends snapshots from a `video_data` dictionary in the layout used by `YouTubeStats` and the raw
+        JSON files ({video_id: {"statistics": {...}, ...}}).
+        """
+        video_ids = list(video_data)
+        stats = [video_data[video_id].get("statistics", {}) for video_id in video_ids]
+
+        return self.append(video_ids, snapshot_ts,
+                           [s.get("viewCount") for s in stats],
+                           [s.get("likeCount") for s in stats],
+                           [s.get("commentCount") for s in stats])
+
+    ##### Reading #####
+
+    @staticmethod
+    def _day_segments(day_folder):
+        if not os.path.isdir(day_folder):
+            return []
+        return [os.path.join(day_folder, name) for name in sorted(os.listdir(day_folder))
+                if name.startswith("seg-") and not name.endswith(".tmp")]
+
+    @staticmethod
+    def _next_segment_number(day_folder):
+        """Number of the next segment of a day: one more than the highest segment, so a new segment never
+        reuses the name of one left by `compact`."""
+        numbers = [int(os.path.basename(seg)[4:]) for seg in SnapshotStore._day_segments(day_folder)]
+        return max(numbers) + 1 if numbers else 0
+
+    def _segments(self, start=None, end=None):
+        """Yields (day, segment folder) for the days between `start` and `end` (epoch seconds), in order."""
+        first_day = _day_name(start) if start is not None else None
+        last_day = _day_name(end) if end is not None else None
+
+        for day in sorted(os.listdir(self.partitions_folder)):
+            if first_day is not None and day < first_day:
+                continue
+            if last_day is not None and day > last_day:
+                break
+            for segment in self._day_segments(os.path.join(self.partitions_folder, day)):
+                yield day, segment
+
+    @staticmethod
+    def _segment_keys(segment):
+        video_idx = np.load(os.path.join(segment, "video_idx.npy"), mmap_mode="r")
+        ts = np.load(os.path.join(segment, "snapshot_ts.npy"), mmap_mode="r")
+        return video_idx.astype(np.int64) * SECONDS_PER_DAY + ts % SECONDS_PER_DAY
+
+    def _video_filter(self, video_ids):
+        """Returns a sorted array of the integer ids for `video_ids` (None means all videos)."""
+        if video_ids is None:
+            return None
+        if isinstance(video_ids, str):
+            video_ids = [video_ids]
+        return np.array(sorted(self._video_idx[v] for v in video_ids if v in self._video_idx), dtype=np.int32)
+
+    def _read_segment(self, segment, start, end, wanted, columns):
+        video_idx = np.load(os.path.join(segment, "video_idx.npy"), mmap_mode="r")
+        ts = np.load(os.path.join(segment, "snapshot_ts.npy"), mmap_mode="r")
+
+        mask = np.ones(len(video_idx), dtype=bool)
+        if wanted is not None:
+            # segments are sorted by video, so a binary search would also work; isin is fast enough and
+            # only touches the video_idx column
+            mask &= np.isin(video_idx, wanted)
+        if start is not None:
+            mask &= ts >= start
+        if end is not None:
+            mask &= ts < end
+
+        if not mask.any():
+            return None
+
+        data = {"video_idx": np.asarray(video_idx[mask]), "snapshot_ts": np.asarray(ts[mask])}
+        for column in columns:
+            data[column] = np.asarray(np.load(os.path.join(segment, f"{column}.npy"), mmap_mode="r")[mask])
+
+        return data
+
+    def _to_frame(self, data):
+        df = pd.DataFrame({"videoID": np.asarray(self.video_ids, dtype=object)[data.pop("video_idx")],
+                           "snapshot_ts": pd.to_datetime(data.pop("snapshot_ts"), unit="s", utc=True)})
+        for column, values in data.items():
+            df[column] = pd.array(np.where(values < 0, np.nan, values), dtype="Int64") if (values < 0).any() \
+                else values
+        return df
+
+    def iter_read(self, start=None, end=None, video_ids=None, columns=None):
+        """Yields one dataframe per segment with the snapshots taken in [`start`, `end`) for `video_ids`.
+        Only the partitions in the time range and the requested columns are read, so memory use is bounded
+        by the size of a single segment.
+
+        Parameters
+        ----------
+        start, end : timestamp
+            Time range to read (either can be None for an open range).
+
+        video_ids : list
+            Video IDs to read (None for all videos).
+
+        columns : list
+            Count columns to read (defaults to all of 'viewCount', 'likeCount' and 'commentCount').
+
+        """
+        start, end = _to_epoch_seconds(start), _to_epoch_seconds(end)
+        wanted = self._video_filter(video_ids)
+        columns = columns or COUNT_COLUMNS
+
+        if wanted is not None and len(wanted) == 0:
+            return
+
+        for _, segment in self._segments(start, end):
+            data = self._read_segment(segment, start, end, wanted, columns)
+            if data is not None:
+                yield self._to_frame(data)
+
+    def read(self, start=None, end=None, video_ids=None, columns=None):
+        """Same as `iter_read` but returns a single dataframe sorted by video and snapshot time."""
+        frames = list(self.iter_read(start, end, video_ids, columns))
+        if not frames:
+            return pd.DataFrame(columns=["videoID", "snapshot_ts"] + (columns or COUNT_COLUMNS))
+
+        return (pd.concat(frames, ignore_index=True)
+                .sort_values(["videoID", "snapshot_ts"])
+                .reset_index(drop=True))
+
+    ##### Analysis #####
+
+    def iter_daily_velocity(self, metric="viewCount", start=None, end=None, video_ids=None):
+        """Yields, for each day in the range, a dataframe of how much `metric` grew per day for every video
+        that has a snapshot on that day.
+
+        Each video's value for a day is its latest snapshot on that day. The velocity is the change since
+        the video's previous snapshot divided by the number of days between them. Only the last value and
+        day for each video are carried between days, so memory use doesn't grow with the number of days.
+
+        Parameters
+        ----------
+        metric : string
+            'viewCount', 'likeCount' or 'commentCount'.
+
+        start, end : timestamp
+            Time range (a snapshot before `start` is not used as a baseline).
+
+        video_ids : list
+            Video IDs to include (None for all videos).
+
+        Yields
+        ------
+        df : pandas dataframe
+            Columns: videoID, date, <metric>, <metric>Delta, <metric>PerDay.
+
+        """
+        start, end = _to_epoch_seconds(start), _to_epoch_seconds(end)
+        wanted = self._video_filter(video_ids)
+
+        # state carried between days, indexed by video_idx
+        last_value = np.full(len(self.video_ids), -1, dtype=np.int64)
+        last_day = np.full(len(self.video_ids), -1, dtype=np.int64)
+
+        segments_by_day = {}
+        for day, segment in self._segments(start, end):
+            segments_by_day.setdefault(day, []).append(segment)
+
+        for day, segments in segments_by_day.items():
+            parts = [self._read_segment(seg, start, end, wanted, [metric]) for seg in segments]
+            parts = [p for p in parts if p is not None]
+            if not parts:
+                continue
+
+            video_idx = np.concatenate([p["video_idx"] for p in parts])
+            ts = np.concatenate([p["snapshot_ts"] for p in parts])
+            values = np.concatenate([p[metric] for p in parts])
+
+            # keep the latest snapshot of the day for each video
+            order = np.lexsort((ts, video_idx))
+            video_idx, ts, values = video_idx[order], ts[order], values[order]
+            is_last = np.append(video_idx[1:] != video_idx[:-1], True)
+            video_idx, values = video_idx[is_last], values[is_last]
+            day_number = ts[is_last] // SECONDS_PER_DAY
+
+            previous_value = last_value[video_idx]
+            previous_day = last_day[video_idx]
+            has_previous = (previous_day >= 0) & (previous_value >= 0) & (values >= 0)
+
+            delta = np.where(has_previous, values - previous_value, 0)
+            days_between = np.where(has_previous, day_number - previous_day, 1)
+
+            df = pd.DataFrame({"videoID": np.asarray(self.video_ids, dtype=object)[video_idx],
+                               "date": pd.Timestamp(day),
+                               metric: values,
+                               f"{metric}Delta": pd.array(np.where(has_previous, delta, 0), dtype="Int64"),
+                               f"{metric}PerDay": np.where(has_previous, delta / days_between, np.nan)})
+            df.loc[~has_previous, f"{metric}Delta"] = pd.NA
+
+            # update the carried state
+            valid = values >= 0
+            last_value[video_idx[valid]] = values[valid]
+            last_day[video_idx[valid]] = day_number[valid]
+
+            yield df
+
+    def daily_velocity(self, metric="viewCount", start=None, end=None, video_ids=None):
+        """Same as `iter_daily_velocity` but returns a single dataframe (rows without a previous snapshot
+        are dropped)."""
+        frames = [df.dropna(subset=[f"{metric}PerDay"])
+                  for df in self.iter_daily_velocity(metric, start, end, video_ids)]
+        if not frames:
+            return pd.DataFrame(columns=["videoID", "date", metric, f"{metric}Delta", f"{metric}PerDay"])
+        return pd.concat(frames, ignore_index=True)
+
+    ##### Maintenance #####
+
+    def compact(self, day=None):
+        """Merges the segments of a day partition (or every partition if `day` is None) into a single
+        sorted, de-duplicated segment. Appends create one segment each, so compacting keeps reads fast.
+
+        Parameters
+        ----------
+        day : string
+            Partition to compact, format 'YYYY-MM-DD'.
+
+        """
+        days = [day] if day is not None else sorted(os.listdir(self.partitions_folder))
+
+        for day_ in days:
+            day_folder = os.path.join(self.partitions_folder, day_)
+            segments = self._day_segments(day_folder)
+            if len(segments) < 2:
+                continue
+
+            parts = [self._read_segment(seg, None, None, None, COUNT_COLUMNS) for seg in segments]
+            merged = pd.DataFrame({column: np.concatenate([p[column] for p in parts if p is not None])
+                                   for column in COLUMNS})
+            merged = (merged
+                      .drop_duplicates(subset=["video_idx", "snapshot_ts"], keep="last")
+                      .sort_values(["video_idx", "snapshot_ts"]))
+
+            tmp_folder = os.path.join(day_folder, "compacted.tmp")
+            os.makedirs(tmp_folder, exist_ok=True)
+            for column in COLUMNS:
+                np.save(os.path.join(tmp_folder, f"{column}.npy"), merged[column].to_numpy(dtype=DTYPES[column]))
+
+            # move the new segment into place before removing the old ones, so an interruption never loses
+            # data (it can only leave rows twice, which the next compact removes)
+            os.replace(tmp_folder, os.path.join(day_folder, f"seg-{self._next_segment_number(day_folder):06d}"))
+            for segment in segments:
+                shutil.rmtree(segment)
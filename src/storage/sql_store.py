@@ -0,0 +1,372 @@
+# sql_store.py
+"""Contains functions that store the processed video data in an embedded local database and answer the
+questions asked of it (top videos, video series, monthly totals) with SQL queries instead of in-memory
+pandas operations.
+
+SQLite (part of the standard library) is used by default. DuckDB is used instead if `backend="duckdb"` is
+passed to `connect` and the duckdb package is installed. Both are queried with the same SQL.
+
+Table `videos` (one row per video, primary key videoID) with indexes on videoID, channelId, publishedAt and
+series.
+
+Functions include:
+
+    `connect(db_path="data/processed/open_goal.db", backend="sqlite")`:
+        Opens (and if necessary creates) the database.
+
+    `is_connection(obj)`:
+        Returns True if `obj` is a database connection rather than a dataframe.
+
+    `write_videos_table(df, con, series=None)`:
+        Inserts or replaces the rows of a processed dataframe in the videos table.
+
+    `label_video_series(con, series)`:
+        Sets the series label of each video from title substrings.
+
+    `query(con, sql, params=())`:
+        Runs a query and returns a dataframe.
+
+    `query_single_metric(con, metrics, video_series_title=None)`:
+        SQL version of `single_metric_dataframes`.
+
+    `query_video_series(con, video_series_title, video_ids=None)`:
+        SQL version of `split_into_video_series`.
+
+    `query_monthly_totals(con, video_series_title=None, channel_id=None)`:
+        SQL version of `prep_df_for_visualisation`.
+
+    `query_top_per_series_year(con, metric="viewCount", n=10)`:
+        Top `n` videos per series per year.
+
+"""
+
+import os
+import sqlite3
+
+from src.utils.lazy_import import lazy_import
+
+pd = lazy_import("pandas")
+
+
+VIDEO_COLUMNS = {
+    "videoID": "TEXT PRIMARY KEY",
+    "publishedAt": "TEXT",
+    "publishedAtYear": "TEXT",
+    "publishedAtMonth": "TEXT",
+    "publishedAtYearMonth": "TEXT",
+    "channelTitle": "TEXT",
+    "channelId": "TEXT",
+    "title": "TEXT",
+    "description": "TEXT",
+    "duration_seconds": "INTEGER",
+    "duration_hhmmss": "TEXT",
+    "tags": "TEXT",
+    "viewCount": "BIGINT",
+    "likeCount": "BIGINT",
+    "favoriteCount": "BIGINT",
+    "commentCount": "BIGINT",
+    "videoCountMonth": "INTEGER",
+    "videoCountYear": "INTEGER",
+    "series": "TEXT",
+}
+
+INDEXES = {
+    "idx_videos_channel": "channelId",
+    "idx_videos_published": "publishedAt",
+    "idx_videos_series": "series",
+    "idx_videos_year_month": "publishedAtYearMonth",
+}
+
+METRIC_COLUMNS = ["viewCount", "likeCount", "favoriteCount", "commentCount"]
+
+
+def connect(db_path="data/processed/open_goal.db", backend="sqlite"):
+    """Opens the database (creating it and the videos table if they don't exist).
+
+    Parameters
+    ----------
+    db_path : string
+        Path of the database file; ':memory:' for an in-memory database.
+
+    backend : string
+        'sqlite' (default) or 'duckdb' (requires the duckdb package).
+
+    Returns
+    -------
+    con : database connection
+
+    """
+    if db_path != ":memory:":
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+
+    if backend == "duckdb":
+        try:
+            import duckdb
+        except ImportError as ie:
+            raise ImportError("backend='duckdb' requires the duckdb package (pip install duckdb)") from ie
+        con = duckdb.connect(db_path)
+
+    elif backend == "sqlite":
+        con = sqlite3.connect(db_path)
+
+    else:
+        raise ValueError(f"Unknown backend '{backend}', use 'sqlite' or 'duckdb'.")
+
+    columns_sql = ", ".join(f"{name} {sql_type}" for name, sql_type in VIDEO_COLUMNS.items())
+    con.execute(f"CREATE TABLE IF NOT EXISTS videos ({columns_sql})")
+    for index_name, column in INDEXES.items():
+        con.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON videos ({column})")
+    con.commit()
+
+    return con
+
+
+def is_connection(obj):
+    """Returns True if `obj` is a database connection (anything with an `execute` method that isn't a
+    dataframe), so functions can accept either a dataframe or a connection."""
+    return not isinstance(obj, (pd.DataFrame, pd.Series)) and hasattr(obj, "execute")
+
+
+def _to_rows(df, series):
+    """Converts a processed dataframe into a list of tuples in the order of VIDEO_COLUMNS."""
+    df_ = pd.DataFrame(index=df.index)
+
+    for column in VIDEO_COLUMNS:
+        if column in df.columns:
+            df_[column] = df[column]
+        else:
+            df_[column] = None
+
+    # store dates as ISO strings and durations as whole seconds
+    if "publishedAt" in df.columns:
+        df_["publishedAt"] = pd.to_datetime(df["publishedAt"]).dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+        published = pd.to_datetime(df["publishedAt"])
+        for column, fmt in [("publishedAtYear", "%Y"), ("publishedAtMonth", "%m"), ("publishedAtYearMonth", "%Y-%m")]:
+            if column not in df.columns:
+                df_[column] = published.dt.strftime(fmt)
+
+    if "duration_timedelta" in df.columns:
+        df_["duration_seconds"] = pd.to_timedelta(df["duration_timedelta"]).dt.total_seconds().round()
+
+    if "tags" in df.columns:
+        df_["tags"] = df["tags"].astype(str)
+
+    if series is not None:
+        df_["series"] = series
+
+    for column in METRIC_COLUMNS + ["duration_seconds", "videoCountMonth", "videoCountYear"]:
+        df_[column] = pd.to_numeric(df_[column], errors="coerce").astype("Int64")
+
+    # replace pandas missing values with None so they're stored as NULL
+    df_ = df_.astype(object).where(df_.notna(), None)
+
+    return list(df_.itertuples(index=False, name=None))
+
+
+def write_videos_table(df, con, series=None):
+    """Inserts the rows of a processed dataframe into the videos table, replacing any rows with the same
+    videoID (so re-running after a new fetch updates the statistics).
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        Processed dataframe, e.g. the output of `create_video_counts_columns`. Missing columns are stored
+        as NULL.
+
+    con : database connection
+        Connection returned by `connect`.
+
+    series : string
+        Optional series label to store for every row in `df`.
+
+    Returns
+    -------
+    rows : int
+        Number of rows written.
+
+    """
+    rows = _to_rows(df, series)
+
+    columns_sql = ", ".join(VIDEO_COLUMNS)
+    placeholders = ", ".join("?" for _ in VIDEO_COLUMNS)
+    con.executemany(f"INSERT OR REPLACE INTO videos ({columns_sql}) VALUES ({placeholders})", rows)
+    con.commit()
+
+    return len(rows)
+
+
+def label_video_series(con, series):
+    """Sets the 'series' column from title substrings (case insensitive), e.g.
+    {"Keeping the Ball on the Ground": ["keeping the ball on the ground"],
+     "Open Goal Meets": ["open goal meets", "si ferry meets"]}.
+
+    Videos matching more than one series keep the label of the first series that matches.
+    """
+    con.execute("UPDATE videos SET series = NULL")
+
+    for label, title_substrings in series.items():
+        if isinstance(title_substrings, str):
+            title_substrings = [title_substrings]
+        condition = " OR ".join("instr(lower(title), ?) > 0" for _ in title_substrings)
+        con.execute(f"UPDATE videos SET series = ? WHERE series IS NULL AND ({condition})",
+                    [label] + [s.lower() for s in title_substrings])
+
+    con.commit()
+
+
+def query(con, sql, params=()):
+    """Runs a query and returns the result as a dataframe."""
+    if isinstance(con, sqlite3.Connection):
+        return pd.read_sql_query(sql, con, params=list(params))
+
+    # duckdb
+    return con.execute(sql, list(params)).df()
+
+
+def _series_labels(con):
+    """Returns {label in lower case: label} for the series labels set by `label_video_series` (read from the
+    series index)."""
+    rows = con.execute("SELECT DISTINCT series FROM videos WHERE series IS NOT NULL").fetchall()
+    return {label.lower(): label for (label,) in rows}
+
+
+def _series_condition(con, video_series_title):
+    """Returns the WHERE clause and parameters that select the videos of the given series (case insensitive).
+
+    A series that `label_video_series` has labelled is selected with the indexed 'series' column; any other
+    string is matched against the titles, which scans the whole table.
+    """
+    if video_series_title is None:
+        return "1 = 1", []
+
+    if isinstance(video_series_title, str):
+        video_series_title = [video_series_title]
+
+    if len(video_series_title) == 0:
+        return "1 = 1", []
+
+    labels = _series_labels(con)
+
+    conditions, params = [], []
+    for s in video_series_title:
+        if s.lower() in labels:
+            conditions.append("series = ?")
+            params.append(labels[s.lower()])
+        else:
+            conditions.append("instr(lower(title), ?) > 0")
+            params.append(s.lower())
+
+    return f"({' OR '.join(conditions)})", params
+
+
+def query_single_metric(con, metrics, video_series_title=None):
+    """SQL version of `single_metric_dataframes`: returns a dataframe per metric, sorted from highest to
+    lowest, with the sort done by the database.
+
+    Returns a single dataframe if one metric is given, otherwise a list of dataframes.
+    """
+    if isinstance(metrics, str):
+        metrics = [metrics]
+
+    condition, params = _series_condition(con, video_series_title)
+
+    df_list = []
+    for metric in metrics:
+        # metric is used as a column name, so only allow known columns
+        if metric not in VIDEO_COLUMNS:
+            print(f"'{metric}' is not a column of the videos table.")
+            continue
+
+        df_list.append(query(con, f"""
+            SELECT videoID, title, publishedAt, publishedAtYear, {metric}
+            FROM videos
+            WHERE {condition}
+            ORDER BY {metric} DESC
+            """, params))
+
+    if len(df_list) == 1:
+        return df_list[0]
+
+    elif len(df_list) > 1:
+        return df_list
+
+
+def query_video_series(con, video_series_title, video_ids=None):
+    """SQL version of `split_into_video_series`: returns the videos of the given series (by series label, or
+    titles containing any of the given strings), sorted by publish date.
+
+    Parameters
+    ----------
+    con : database connection
+
+    video_series_title : string or list
+        Series labels (see `label_video_series`) or parts of the video titles.
+
+    video_ids : iterable
+        If given, the videos with these IDs (e.g. a series' playlist videos) are returned instead, looked up
+        by the primary key; `video_series_title` is then ignored.
+
+    """
+    if video_ids is None:
+        condition, params = _series_condition(con, video_series_title)
+        return query(con, f"SELECT * FROM videos WHERE {condition} ORDER BY publishedAt", params)
+
+    # a temporary table rather than an IN list, which is limited to a few hundred parameters in older SQLite
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_videos (videoID TEXT PRIMARY KEY)")
+    con.execute("DELETE FROM wanted_videos")
+    con.executemany("INSERT INTO wanted_videos VALUES (?)", [(video_id,) for video_id in set(video_ids)])
+
+    return query(con, """
+        SELECT videos.* FROM videos JOIN wanted_videos ON videos.videoID = wanted_videos.videoID
+        ORDER BY publishedAt
+        """)
+
+
+def query_monthly_totals(con, video_series_title=None, channel_id=None):
+    """SQL version of `prep_df_for_visualisation`: returns the monthly view, like and comment totals with
+    the same columns as that function.
+
+    Parameters
+    ----------
+    con : database connection
+
+    video_series_title : string or list
+        Only include videos with one of these series labels, or whose titles contain one of these strings.
+
+    channel_id : string
+        Only include videos from this channel.
+
+    """
+    condition, params = _series_condition(con, video_series_title)
+
+    if channel_id is not None:
+        condition += " AND channelId = ?"
+        params.append(channel_id)
+
+    return query(con, f"""
+        SELECT publishedAtYearMonth, publishedAtYear, publishedAtMonth,
+               SUM(viewCount) AS viewCount, SUM(likeCount) AS likeCount, SUM(commentCount) AS commentCount,
+               MAX(videoCountMonth) AS videoCountMonth, MAX(videoCountYear) AS videoCountYear
+        FROM videos
+        WHERE {condition}
+        GROUP BY publishedAtYearMonth, publishedAtYear, publishedAtMonth
+        ORDER BY publishedAtYearMonth
+        """, params)
+
+
+def query_top_per_series_year(con, metric="viewCount", n=10):
+    """Returns the top `n` videos by `metric` for every (series, year) combination."""
+    if metric not in VIDEO_COLUMNS:
+        raise ValueError(f"'{metric}' is not a column of the videos table.")
+
+    return query(con, f"""
+        SELECT series, publishedAtYear, rank, videoID, title, {metric}
+        FROM (
+            SELECT series, publishedAtYear, videoID, title, {metric},
+                   ROW_NUMBER() OVER (PARTITION BY series, publishedAtYear ORDER BY {metric} DESC) AS rank
+            FROM videos
+            WHERE series IS NOT NULL
+        ) ranked
+        WHERE rank <= ?
+        ORDER BY series, publishedAtYear, rank
+        """, [n])
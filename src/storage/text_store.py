@@ -0,0 +1,263 @@
+# text_store.py
+"""Contains the class that keeps long text columns (video descriptions, optionally titles) out of the
+dataframes, so the copies and merges made by the feature engineering and series functions move a column of
+integers instead of megabytes of text.
+
+Texts are split into lines and each distinct line is stored once, so the boilerplate repeated at the end of
+every description ("SUBSCRIBE to Open Goal", the social media links, the sponsor lines) takes the space of a
+single copy. Identical texts (e.g. the same video in two raw files) get the same id. The dataframe holds the
+text id (int64, -1 for a missing value) and the text is only rebuilt when it is asked for.
+
+Layout on disk
+--------------
+    <root>/segments.bin
+        The UTF-8 bytes of every distinct line, one after another (append-only, memory-mapped when read).
+
+    <root>/segment_offsets.npy
+        int64; line i is segments.bin[segment_offsets[i]:segment_offsets[i + 1]].
+
+    <root>/text_offsets.npy, <root>/text_parts.npy
+        int64 / int32; text t is made of lines text_parts[text_offsets[t]:text_offsets[t + 1]].
+
+Ids never change once given, so dataframes (and cached pipeline outputs) holding ids stay valid as the store
+grows.
+
+Class TextStore:
+- `TextStore(root="data/text_store")`
+
+TextStore methods:
+- `add(self, text)`
+- `add_many(self, texts)`
+- `get(self, text_id)`
+- `get_many(self, text_ids)`
+- `flush(self)`
+
+Functions include:
+
+    `externalise_text(df, store, columns=("description",))`:
+        Moves text columns into the store, leaving the text ids in the dataframe.
+
+    `materialise_text(df, store, columns=("description",))`:
+        Puts the text back in place of the ids.
+
+"""
+
+import mmap
+import os
+
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+MISSING = -1  # id stored for a missing (NaN / None) text
+
+
+class TextStore:
+    """Deduplicated, memory-mapped store of texts.
+
+    Parameters
+    ----------
+    root : string
+        Folder holding the store; created on the first `flush`.
+
+    """
+
+    def __init__(self, root="data/text_store"):
+        self.root = root
+
+        self._blob = None        # memory map of segments.bin
+        self._blob_file = None
+        self.segment_offsets = np.zeros(1, dtype=np.int64)
+        self.text_offsets = np.zeros(1, dtype=np.int64)
+        self.text_parts = np.zeros(0, dtype=np.int32)
+
+        offsets_path = os.path.join(root, "segment_offsets.npy")
+        if os.path.exists(offsets_path):
+            self.segment_offsets = np.load(offsets_path, mmap_mode="r")
+            self.text_offsets = np.load(os.path.join(root, "text_offsets.npy"), mmap_mode="r")
+            self.text_parts = np.load(os.path.join(root, "text_parts.npy"), mmap_mode="r")
+
+        # additions not yet written by `flush`
+        self._new_segments = []
+        self._new_texts = []
+
+        # lookups used when adding, built on the first `add`
+        self._segment_ids = None
+        self._text_ids = None
+
+    def __len__(self):
+        return len(self.text_offsets) - 1 + len(self._new_texts)
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    ##### Reading #####
+
+    def _segment_bytes(self, segment_id):
+        n_saved = len(self.segment_offsets) - 1
+        if segment_id >= n_saved:
+            return self._new_segments[segment_id - n_saved]
+
+        if self._blob is None:
+            # map the file once; the operating system pages in only the lines that are read
+            self._blob_file = open(self._path("segments.bin"), "rb")
+            self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._blob[self.segment_offsets[segment_id]:self.segment_offsets[segment_id + 1]]
+
+    def _parts(self, text_id):
+        n_saved = len(self.text_offsets) - 1
+        if text_id >= n_saved:
+            return self._new_texts[text_id - n_saved]
+        return self.text_parts[self.text_offsets[text_id]:self.text_offsets[text_id + 1]]
+
+    def get(self, text_id):
+        """Returns the text with id `text_id` (None for the missing id, -1)."""
+        text_id = int(text_id)
+        if text_id == MISSING:
+            return None
+        if not 0 <= text_id < len(self):
+            raise KeyError(f"Text id {text_id} is not in the store.")
+        return b"".join(self._segment_bytes(int(s)) for s in self._parts(text_id)).decode("utf-8")
+
+    def get_many(self, text_ids):
+        """Returns the texts for an array of ids, in the same order. Each distinct id is rebuilt once."""
+        cache = {}
+        texts = []
+        for text_id in text_ids:
+            text_id = int(text_id)
+            if text_id not in cache:
+                cache[text_id] = self.get(text_id)
+            texts.append(cache[text_id])
+        return texts
+
+    def __getitem__(self, text_id):
+        return self.get(text_id)
+
+    ##### Adding #####
+
+    def _build_lookups(self):
+        self._segment_ids = {}
+        for segment_id in range(len(self.segment_offsets) - 1 + len(self._new_segments)):
+            self._segment_ids[bytes(self._segment_bytes(segment_id))] = segment_id
+
+        self._text_ids = {}
+        for text_id in range(len(self)):
+            self._text_ids[tuple(int(s) for s in self._parts(text_id))] = text_id
+
+    def add(self, text):
+        """Adds `text` (if it isn't already stored) and returns its id. Missing values return -1."""
+        if text is None or (isinstance(text, float) and text != text):
+            return MISSING
+
+        if self._segment_ids is None:
+            self._build_lookups()
+
+        parts = []
+        for line in str(text).encode("utf-8").splitlines(keepends=True):
+            segment_id = self._segment_ids.get(line)
+            if segment_id is None:
+                segment_id = self._segment_ids[line] = len(self.segment_offsets) - 1 + len(self._new_segments)
+                self._new_segments.append(line)
+            parts.append(segment_id)
+
+        key = tuple(parts)
+        text_id = self._text_ids.get(key)
+        if text_id is None:
+            text_id = self._text_ids[key] = len(self)
+            self._new_texts.append(key)
+        return text_id
+
+    def add_many(self, texts):
+        """Adds every text and returns their ids as an int64 numpy array."""
+        return np.fromiter((self.add(text) for text in texts), dtype=np.int64, count=len(texts))
+
+    def flush(self):
+        """Writes the texts added since the last flush to disk."""
+        if not self._new_segments and not self._new_texts and os.path.exists(self._path("segment_offsets.npy")):
+            return
+        os.makedirs(self.root, exist_ok=True)
+        self._close()
+
+        # append the new lines at the end of the valid part of segments.bin (anything after it was left by
+        # an interrupted flush and is overwritten)
+        blob_path = self._path("segments.bin")
+        end = int(self.segment_offsets[-1])
+        with open(blob_path, "r+b" if os.path.exists(blob_path) else "wb") as f:
+            f.seek(end)
+            f.truncate()
+            for segment in self._new_segments:
+                f.write(segment)
+
+        lengths = np.fromiter((len(s) for s in self._new_segments), dtype=np.int64, count=len(self._new_segments))
+        segment_offsets = np.concatenate([self.segment_offsets, end + np.cumsum(lengths)])
+
+        new_parts = [s for parts in self._new_texts for s in parts]
+        text_lengths = np.fromiter((len(p) for p in self._new_texts), dtype=np.int64, count=len(self._new_texts))
+        text_offsets = np.concatenate([self.text_offsets, self.text_offsets[-1] + np.cumsum(text_lengths)])
+        text_parts = np.concatenate([self.text_parts, np.asarray(new_parts, dtype=np.int32)])
+
+        # the offsets are written last, so a flush that is interrupted leaves the previous store readable
+        for name, array in [("text_parts", text_parts), ("text_offsets", text_offsets),
+                            ("segment_offsets", segment_offsets)]:
+            with open(self._path(f"{name}.npy.tmp"), "wb") as f:
+                np.save(f, array)
+            os.replace(self._path(f"{name}.npy.tmp"), self._path(f"{name}.npy"))
+
+        self.segment_offsets, self.text_offsets, self.text_parts = segment_offsets, text_offsets, text_parts
+        self._new_segments = []
+        self._new_texts = []
+
+    def _close(self):
+        if self._blob is not None:
+            self._blob.close()
+            self._blob_file.close()
+            self._blob = self._blob_file = None
+
+
+def externalise_text(df, store, columns=("description",)):
+    """Replaces the text in `columns` with the ids of the texts in `store`.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+
+    store : TextStore or string
+        The store (or its folder) to add the texts to. The store is flushed so the ids are on disk.
+
+    columns : list
+        Text columns to move out of the dataframe; columns that are missing (or already hold ids) are skipped.
+
+    Returns
+    -------
+    df_ : pandas dataframe
+        Copy of `df` with int64 text ids (-1 for missing values) in place of the text.
+    """
+    if isinstance(store, str):
+        store = TextStore(store)
+
+    df_ = df.copy()
+    for column in columns:
+        if column in df_.columns and not pd.api.types.is_integer_dtype(df_[column]):
+            df_[column] = store.add_many(df_[column].tolist())
+    store.flush()
+    return df_
+
+
+def materialise_text(df, store, columns=("description",)):
+    """Puts the text back into `columns` of a dataframe created by `externalise_text`.
+
+    Returns
+    -------
+    df_ : pandas dataframe
+        Copy of `df` with the texts in place of their ids (None where the text was missing).
+    """
+    if isinstance(store, str):
+        store = TextStore(store)
+
+    df_ = df.copy()
+    for column in columns:
+        if column in df_.columns and pd.api.types.is_integer_dtype(df_[column]):
+            df_[column] = store.get_many(df_[column].to_numpy())
+    return df_
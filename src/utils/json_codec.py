@@ -0,0 +1,208 @@
+# json_codec.py
+"""Contains the functions used for all JSON reading and writing in `src`, so a faster JSON library can be
+used when one is installed.
+
+Backends, in order of preference: orjson, ujson, then the standard library's json (always available). The
+backend is picked automatically, or set with the OPENGOAL_JSON_BACKEND environment variable or
+`set_backend(name)`.
+
+Two file formats are supported:
+- regular JSON files, written compact (the default, fastest) or pretty-printed. Pretty output is always
+  made by the standard library (indent=4, the format of the raw files), so it is the same whichever backend
+  is installed
+- line-delimited JSON (one record per line), which can be written and read record by record
+
+Functions include:
+
+    `set_backend(name="auto")`, `backend_name()`:
+        Choose / report the JSON backend.
+
+    `loads(data)`, `dumps(obj, pretty=False)`:
+        Parse / serialise a string or bytes.
+
+    `load(path)`, `dump(obj, path, pretty=False)`:
+        Read / write a JSON file.
+
+    `iter_lines(path)`, `write_lines(records, path, append=False)`:
+        Read / write a line-delimited JSON file one record at a time.
+
+"""
+
+import json
+import os
+
+
+def _pretty_dumps(obj):
+    # the fast libraries indent differently (orjson only supports two spaces), so pretty files are always
+    # written like the existing raw files
+    return json.dumps(obj, indent=4).encode("utf-8")
+
+
+class _StdlibBackend:
+    name = "json"
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj, pretty=False):
+        if pretty:
+            return _pretty_dumps(obj)
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+class _UjsonBackend:
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, obj, pretty=False):
+        if pretty:
+            return _pretty_dumps(obj)
+        return self._ujson.dumps(obj).encode("utf-8")
+
+
+class _OrjsonBackend:
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def dumps(self, obj, pretty=False):
+        if pretty:
+            return _pretty_dumps(obj)
+        return self._orjson.dumps(obj)
+
+
+BACKENDS = {"orjson": _OrjsonBackend, "ujson": _UjsonBackend, "json": _StdlibBackend}
+
+_backend = None
+
+
+def available_backends():
+    """Returns the names of the backends that can be used (installed), fastest first."""
+    names = []
+    for name, backend_class in BACKENDS.items():
+        try:
+            backend_class()
+            names.append(name)
+        except ImportError:
+            continue
+    return names
+
+
+def set_backend(name="auto"):
+    """Sets the JSON backend.
+
+    Parameters
+    ----------
+    name : string
+        'orjson', 'ujson', 'json' or 'auto' (the fastest installed backend).
+
+    Returns
+    -------
+    name : string
+        The name of the backend in use.
+
+    """
+    global _backend
+
+    if name == "auto":
+        for backend_class in BACKENDS.values():
+            try:
+                _backend = backend_class()
+                break
+            except ImportError:
+                continue
+
+    elif name in BACKENDS:
+        try:
+            _backend = BACKENDS[name]()
+        except ImportError as ie:
+            raise ImportError(f"JSON backend '{name}' is not installed") from ie
+
+    else:
+        raise ValueError(f"Unknown JSON backend '{name}', use one of {list(BACKENDS)} or 'auto'.")
+
+    return _backend.name
+
+
+def _get_backend():
+    if _backend is None:
+        set_backend(os.environ.get("OPENGOAL_JSON_BACKEND", "auto"))
+    return _backend
+
+
+def backend_name():
+    """Returns the name of the backend in use."""
+    return _get_backend().name
+
+
+def loads(data):
+    """Parses a JSON string or bytes."""
+    return _get_backend().loads(data)
+
+
+def dumps(obj, pretty=False):
+    """Serialises `obj` to a JSON string (compact unless `pretty` is True)."""
+    return _get_backend().dumps(obj, pretty=pretty).decode("utf-8")
+
+
+def load(path):
+    """Reads a JSON file."""
+    with open(path, "rb") as f:
+        return _get_backend().loads(f.read())
+
+
+def dump(obj, path, pretty=False):
+    """Writes `obj` to a JSON file, compact unless `pretty` is True."""
+    with open(path, "wb") as f:
+        f.write(_get_backend().dumps(obj, pretty=pretty))
+
+
+def iter_lines(path):
+    """Yields the records of a line-delimited JSON file one at a time, so the whole file never has to be
+    held in memory. Blank lines are skipped."""
+    backend = _get_backend()
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield backend.loads(line)
+
+
+def write_lines(records, path, append=False):
+    """Writes records to a line-delimited JSON file, one compact record per line.
+
+    Parameters
+    ----------
+    records : iterable
+        Records to write (can be a generator).
+
+    path : string
+        File to write.
+
+    append : bool
+        If True, records are added to the end of the file instead of replacing it.
+
+    Returns
+    -------
+    n : int
+        Number of records written.
+
+    """
+    backend = _get_backend()
+    n = 0
+    with open(path, "ab" if append else "wb") as f:
+        for record in records:
+            f.write(backend.dumps(record))
+            f.write(b"\n")
+            n += 1
+    return n
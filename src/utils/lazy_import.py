@@ -0,0 +1,79 @@
+# lazy_import.py
+"""Contains a helper that defers importing heavy dependencies (pandas, numpy, plotly) until they are first
+used, so commands that don't need them (e.g. fetching data from the API) start quickly.
+
+Functions include:
+
+    `lazy_import(name)`:
+        Returns a module object that is only loaded when one of its attributes is first accessed.
+
+Example Use
+-----------
+    from src.utils.lazy_import import lazy_import
+
+    pd = lazy_import("pandas")   # nothing is imported yet
+    pd.DataFrame()               # pandas is imported here
+
+"""
+
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+class _LazyModule(types.ModuleType):
+    """Stands in for a module until one of its attributes is first accessed, then imports it."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_lock"] = threading.Lock()
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        # the lock makes threads that touch the module at the same time wait for one complete import
+        # (importlib.util.LazyLoader exposes a half-initialised module to them on Python < 3.12)
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                module = importlib.import_module(self.__name__)
+                # copy the attributes so later lookups don't go through __getattr__
+                self.__dict__.update(module.__dict__)
+                self.__dict__["_lazy_module"] = module
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    """Returns the module `name`, loading it on first attribute access rather than now.
+
+    If the module has already been imported it is returned as is.
+
+    Parameters
+    ----------
+    name : string
+        Full module name, e.g. 'pandas' or 'plotly.express'.
+
+    Returns
+    -------
+    module : module
+
+    Notes
+    ------
+    A missing module still raises ImportError straight away, so missing dependencies are reported where they
+    are imported rather than deep inside a function. The first load is done under a lock, so the module can
+    be used from several threads.
+
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named '{name}'")
+
+    return _LazyModule(name)
@@ -0,0 +1,341 @@
+# html_report.py
+"""Contains the class that assembles many plotly figures into a single, self-contained HTML report.
+
+Writing every chart as its own PNG (`viz_line_chart`, `viz_video_counts`) means a static image export per
+chart, which takes far longer than building the figure. A report instead:
+
+- embeds the plotly.js bundle once, however many figures it holds (or links it from the CDN)
+- stores each figure's data compactly: numeric arrays are written as base64 encoded binary rather than as
+  JSON numbers, arrays repeated across figures (e.g. the same months on the x axis of every chart of a
+  series) are stored once, and so is the layout template (about 7 KB of JSON for 'plotly_white')
+- renders figures lazily: each figure's data sits in its own JSON script tag and is only parsed and drawn
+  when the figure is about to scroll into view (IntersectionObserver), so a report with hundreds of charts
+  opens as quickly as one with a handful
+
+Usage:
+
+    report = HTMLReport("OpenGoal YouTube statistics")
+    report.add_figure(viz_line_chart(df_group, "viewCount", "Views per month", show=False, save_image=False),
+                      section="Keeping the Ball on the Ground")
+    report.write("reports/opengoal.html")
+
+or, for the charts the pipeline renders, `python -m src render --report reports/opengoal.html`.
+
+Class HTMLReport:
+- `HTMLReport(title="Report", include_plotlyjs=True)`
+
+HTMLReport methods:
+- `add_figure(self, fig, section=None)`
+- `to_html(self)`
+- `write(self, path)`
+
+Functions include:
+
+    `series_report(groups, metrics, title="OpenGoal YouTube statistics", max_points=None)`:
+        Returns a report with the video count chart and a line chart per metric for each video series.
+
+"""
+
+import base64
+import html
+import os
+
+from src.monitoring.instrumentation import instrument
+from src.utils import json_codec
+from src.utils.lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+
+# numeric arrays with at least this many values are stored as base64 binary (short ones are smaller as JSON)
+MIN_BINARY_LENGTH = 8
+
+DEFAULT_FIGURE_HEIGHT = 450  # pixels reserved for a figure before it is drawn
+
+# decodes the shared arrays and templates and draws each figure when it comes near the viewport
+_RENDER_SCRIPT = """
+(function () {
+  var arrays = JSON.parse(document.getElementById("report-arrays").textContent);
+  var templates = JSON.parse(document.getElementById("report-templates").textContent);
+  var types = {f8: Float64Array, i4: Int32Array};
+  var decoded = {};
+
+  function decodeArray(i) {
+    if (!(i in decoded)) {
+      var entry = arrays[i];
+      if (Array.isArray(entry)) {
+        decoded[i] = entry;
+      } else {
+        var raw = atob(entry.b), bytes = new Uint8Array(raw.length);
+        for (var j = 0; j < raw.length; j++) bytes[j] = raw.charCodeAt(j);
+        var flat = new types[entry.t](bytes.buffer);
+        if (entry.s.length === 2) {
+          // 2D arrays (e.g. customdata) are passed to plotly as an array of rows
+          var rows = [], width = entry.s[1];
+          for (var r = 0; r < entry.s[0]; r++) rows.push(flat.subarray(r * width, (r + 1) * width));
+          decoded[i] = rows;
+        } else {
+          decoded[i] = flat;
+        }
+      }
+    }
+    return decoded[i];
+  }
+
+  // replaces references to shared arrays and templates (copying the rest, as plotly changes its inputs)
+  function resolve(value) {
+    if (Array.isArray(value)) return value.map(resolve);
+    if (value === null || typeof value !== "object") return value;
+    if ("__array" in value) return decodeArray(value.__array);
+    if ("__template" in value) return resolve(templates[value.__template]);
+    var out = {};
+    for (var key in value) out[key] = resolve(value[key]);
+    return out;
+  }
+
+  function render(element) {
+    var spec = JSON.parse(document.getElementById(element.dataset.spec).textContent);
+    element.style.height = "";
+    Plotly.newPlot(element, resolve(spec.data), resolve(spec.layout), {responsive: true});
+  }
+
+  var figures = document.querySelectorAll(".report-figure");
+  if (!("IntersectionObserver" in window)) {
+    figures.forEach(render);
+    return;
+  }
+  var observer = new IntersectionObserver(function (entries) {
+    entries.forEach(function (entry) {
+      if (!entry.isIntersecting) return;
+      observer.unobserve(entry.target);
+      render(entry.target);
+    });
+  }, {rootMargin: "800px 0px"});
+  figures.forEach(function (element) { observer.observe(element); });
+})();
+"""
+
+_STYLE = """
+body { font-family: sans-serif; margin: 0 auto; max-width: 1100px; padding: 0 20px; color: #2a3f5f; }
+nav ul { columns: 2; }
+.report-figure { margin-bottom: 30px; }
+"""
+
+
+def _script_json(obj):
+    """JSON for a <script> tag: '</' is escaped so text in the data can't close the tag early."""
+    return json_codec.dumps(obj).replace("</", "<\\/")
+
+
+class _ArrayPool:
+    """Stores the arrays of every figure once, keyed by their contents."""
+
+    def __init__(self):
+        self.entries = []
+        self.keys = {}
+
+    def add(self, array):
+        array = np.asarray(array)
+
+        if array.dtype.kind in "iuf" and array.ndim in (1, 2) and array.size >= MIN_BINARY_LENGTH:
+            # integers that fit are stored as int32 (half the size), everything else as float64
+            if array.dtype.kind in "iu" and array.size and -2**31 <= array.min() and array.max() < 2**31:
+                array, dtype = array.astype("<i4"), "i4"
+            else:
+                array, dtype = array.astype("<f8"), "f8"
+            data = np.ascontiguousarray(array).tobytes()
+            key = (dtype, array.shape, data)
+            entry = {"t": dtype, "s": list(array.shape), "b": base64.b64encode(data).decode("ascii")}
+        else:
+            entry = _to_builtin(array.tolist())
+            key = json_codec.dumps(entry)
+
+        index = self.keys.get(key)
+        if index is None:
+            index = self.keys[key] = len(self.entries)
+            self.entries.append(entry)
+        return {"__array": index}
+
+
+def _to_builtin(value):
+    """Converts numpy scalars and dates left in a figure's lists to JSON serialisable values."""
+    if isinstance(value, dict):
+        return {k: _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None  # NaN, which plotly treats as a gap
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    # dates and timestamps
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+class HTMLReport:
+    """A single HTML file holding many plotly figures.
+
+    Parameters
+    ----------
+    title : string
+        Title shown at the top of the report and in the browser tab.
+
+    include_plotlyjs : bool or string
+        True (default) embeds the plotly.js bundle in the file so the report works offline. 'cdn' links it
+        from the plotly CDN instead, which makes the file about 3.5 MB smaller.
+
+    """
+
+    def __init__(self, title="Report", include_plotlyjs=True):
+        self.title = title
+        self.include_plotlyjs = include_plotlyjs
+
+        self.arrays = _ArrayPool()
+        self.templates = []
+        self._template_keys = {}
+        # section -> list of (element id, figure title, height, compact figure)
+        self.sections = {}
+
+    def __len__(self):
+        return sum(len(figures) for figures in self.sections.values())
+
+    def _compact(self, value):
+        # arrays go to the shared pool, everything else is copied as is
+        if isinstance(value, np.ndarray):
+            return self.arrays.add(value)
+        if isinstance(value, dict):
+            return {k: self._compact(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._compact(v) for v in value]
+        return _to_builtin(value)
+
+    def _template(self, template):
+        template = _to_builtin(template)
+        key = json_codec.dumps(template)
+        index = self._template_keys.get(key)
+        if index is None:
+            index = self._template_keys[key] = len(self.templates)
+            self.templates.append(template)
+        return {"__template": index}
+
+    def add_figure(self, fig, section=None):
+        """Adds a plotly figure to the report.
+
+        Parameters
+        ----------
+        fig : plotly figure
+            E.g. the figure returned by `viz_line_chart(..., show=False, save_image=False)`.
+
+        section : string
+            Heading to list the figure under (figures without one go under the report title).
+        """
+        fig_json = fig.to_plotly_json()
+        layout = dict(fig_json.get("layout", {}))
+        template = layout.pop("template", None)
+
+        compact = {"data": [self._compact(trace) for trace in fig_json.get("data", [])],
+                   "layout": self._compact(layout)}
+        if template is not None:
+            compact["layout"]["template"] = self._template(template)
+
+        title = layout.get("title", {}).get("text") or f"Figure {len(self) + 1}"
+        height = layout.get("height") or DEFAULT_FIGURE_HEIGHT
+        self.sections.setdefault(section, []).append((f"figure-{len(self)}", title, height, compact))
+        return self
+
+    def to_html(self):
+        """Returns the report as a string of HTML."""
+        if self.include_plotlyjs == "cdn":
+            from plotly.offline import get_plotlyjs_version
+
+            plotly_script = f'<script src="https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"></script>'
+        elif self.include_plotlyjs:
+            from plotly.offline import get_plotlyjs
+
+            plotly_script = f'<script type="text/javascript">{get_plotlyjs()}</script>'
+        else:
+            plotly_script = ""
+
+        # table of contents (only when there are sections to jump between)
+        contents = []
+        if any(section is not None for section in self.sections):
+            contents.append("<nav><ul>")
+            for i, section in enumerate(self.sections):
+                contents.append(f'<li><a href="#section-{i}">{html.escape(section or self.title)}</a></li>')
+            contents.append("</ul></nav>")
+
+        body = []
+        for i, (section, figures) in enumerate(self.sections.items()):
+            if section is not None:
+                body.append(f'<h2 id="section-{i}">{html.escape(section)}</h2>')
+            for element_id, title, height, compact in figures:
+                body.append(f'<div class="report-figure" id="{element_id}" data-spec="{element_id}-spec" '
+                            f'style="height: {int(height)}px" title="{html.escape(title)}"></div>')
+                body.append(f'<script type="application/json" id="{element_id}-spec">{_script_json(compact)}</script>')
+
+        return "\n".join([
+            "<!DOCTYPE html>",
+            '<html lang="en">',
+            "<head>",
+            '<meta charset="utf-8">',
+            f"<title>{html.escape(self.title)}</title>",
+            f"<style>{_STYLE}</style>",
+            plotly_script,
+            "</head>",
+            "<body>",
+            f"<h1>{html.escape(self.title)}</h1>",
+            *contents,
+            *body,
+            f'<script type="application/json" id="report-arrays">{_script_json(self.arrays.entries)}</script>',
+            f'<script type="application/json" id="report-templates">{_script_json(self.templates)}</script>',
+            f"<script>{_RENDER_SCRIPT}</script>",
+            "</body>",
+            "</html>",
+        ])
+
+    @instrument("visualisation.report.write")
+    def write(self, path):
+        """Writes the report to `path` and returns the path."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_html())
+        print(f"Saved report with {len(self)} figures: {path}")
+        return path
+
+
+@instrument("visualisation.series_report")
+def series_report(groups, metrics, title="OpenGoal YouTube statistics", max_points=None):
+    """Returns a report with, for each video series, the number of videos per month and a line chart per
+    metric (the charts `python -m src render` saves as images).
+
+    Parameters
+    ----------
+    groups : dict
+        {series title: grouped dataframe from `prep_df_for_visualisation`}.
+
+    metrics : list
+        Metrics to chart for each series, e.g. ["viewCount", "likeCount", "commentCount"].
+
+    title : string
+        Title of the report.
+
+    max_points : int
+        If set, each line chart is downsampled to at most this many points (see `viz_line_chart`).
+
+    Returns
+    -------
+    report : HTMLReport
+    """
+    from src.visualisation.visualisations import viz_line_chart, viz_video_counts
+
+    report = HTMLReport(title)
+    for series, df_group in groups.items():
+        report.add_figure(viz_video_counts(df_group, f"OpenGoal {series} videos per month",
+                                           show=False, save_image=False), section=series)
+        for metric in metrics:
+            fig = viz_line_chart(df_group, metric, f"OpenGoal {series} {metric} per month", max_points=max_points,
+                                 show=False, save_image=False)
+            report.add_figure(fig, section=series)
+
+    return report
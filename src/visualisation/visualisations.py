@@ -3,33 +3,59 @@
 
 Functions:
 
-    `prep_df_for_visualisation(df)`: 
+    `prep_df_for_visualisation(df, dedupe=False)`: 
         Prepares the dataframe for easy visualisation (groups columns etc.)
 
-    `viz_video_counts(df, chart_title)`:
+    `viz_video_counts(df, chart_title, show=True, save_image=True)`:
         Bar charts the number of videos per month.
 
-    `viz_line_chart(df, metric, chart_title)`:
+    `viz_line_chart(df, metric, chart_title, max_points=None, downsample_method="lttb", show=True, save_image=True)`:
         Returns a line graph with the given metric over time.
 
+    `downsample_lttb(x, y, max_points)`:
+        Returns the indices of the points kept by the largest-triangle-three-buckets algorithm.
+
+    `downsample_minmax(x, y, max_points)`:
+        Returns the indices of the minimum and maximum point in each bucket (min/max envelope).
+
+    `downsample_dataframe(df, x, y, max_points, method="lttb")`:
+        Reduces a dataframe to at most `max_points` rows for plotting, keeping the shape of the series.
+
 """
 
-import pandas as pd
-import plotly.express as px
-import numpy as np
 import re
 
+from src.monitoring.instrumentation import instrument
+from src.processing.near_duplicates import drop_near_duplicates
+from src.storage.rollup_cube import RollupCube
+from src.storage.sql_store import is_connection, query_monthly_totals
+from src.utils.lazy_import import lazy_import
+
+# pandas, numpy and plotly are only loaded when a function first uses them
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+px = lazy_import("plotly.express")
 
-def prep_df_for_visualisation(df):
+
+@instrument("visualisation.prep_df_for_visualisation")
+def prep_df_for_visualisation(df, dedupe=False):
     """Groups the dataframe so it is structured in a way so that it can be passed
     to the visualisation functions for quick and easy visualisation.
 
     Parameters
     ----------
-    df : pandas dataframe
+    df : pandas dataframe or database connection
         A pandas dataframe that contains the following columns:
             publishedAtYearMonth, publishedAtYear, publishedAtMonth, videoCountMonth, 
             videoCountYear, viewCount, likeCount, commentCount.
+        If a connection from `src.storage.sql_store.connect` is passed, the monthly totals are calculated
+        by the database (see `query_monthly_totals`).
+        If a `RollupCube` is passed, its precomputed monthly totals are returned (see `RollupCube.monthly`).
+
+    dedupe : bool
+        If True, near-duplicate videos (re-uploads; same 'cluster_id', see
+        `src.processing.near_duplicates.add_cluster_column`) are counted once: only the first published video
+        of each cluster is summed and the others are taken off the video counts.
 
     Returns
     -------
@@ -41,6 +67,25 @@ def prep_df_for_visualisation(df):
     
     
     """
+    # push the work down to the database if a connection was passed instead of a dataframe
+    if is_connection(df):
+        return query_monthly_totals(df)
+
+    # a rollup cube already holds the monthly totals
+    if isinstance(df, RollupCube):
+        return df.monthly()
+
+    # count each cluster of near duplicates once
+    if dedupe:
+        df_kept = drop_near_duplicates(df)
+        removed_month = (df.groupby("publishedAtYearMonth").size()
+                         .sub(df_kept.groupby("publishedAtYearMonth").size(), fill_value=0))
+        removed_year = (df.groupby("publishedAtYear").size()
+                        .sub(df_kept.groupby("publishedAtYear").size(), fill_value=0))
+        df = df_kept.assign(
+            videoCountMonth=df_kept["videoCountMonth"] - df_kept["publishedAtYearMonth"].map(removed_month).astype(int),
+            videoCountYear=df_kept["videoCountYear"] - df_kept["publishedAtYear"].map(removed_year).astype(int))
+
     # group the views, likes and comment numbers by year and month
     df_group = (
         df.groupby(by=[df['publishedAtYearMonth'], df['publishedAtYear'], df['publishedAtMonth'], 
@@ -63,8 +108,200 @@ def prep_df_for_visualisation(df):
 
 
 
+def _x_to_numeric(x):
+    """Converts the x axis values of a chart to floats so distances between points can be measured.
+    Dates (e.g. the 'publishedAtYearMonth' strings) are converted to nanoseconds since the epoch.
+    """
+    x = pd.Series(x)
+
+    if pd.api.types.is_numeric_dtype(x):
+        return x.to_numpy(dtype=float)
+
+    # anything that isn't numeric is treated as a date
+    return pd.to_datetime(x).astype("int64").to_numpy(dtype=float)
+
+
+
+def downsample_lttb(x, y, max_points):
+    """Selects at most `max_points` points from a series using the largest-triangle-three-buckets
+    (LTTB) algorithm.
+
+    The first and last points are always kept. The points in between are split into equal sized
+    buckets and from each bucket the point that forms the largest triangle with the point selected
+    from the previous bucket and the average of the next bucket is kept. This keeps the visual shape of
+    the line, including spikes such as the Kieran Tierney episode, with a fraction of the points.
+
+    Parameters
+    ----------
+    x : array-like
+        The x axis values (numbers or dates), sorted in ascending order.
+
+    y : array-like
+        The y axis values.
+
+    max_points : int
+        The maximum number of points to keep (must be at least 3).
+
+    Returns
+    -------
+    indices : numpy array
+        The positions of the points to keep, in ascending order.
+
+    Raises
+    ------
+    ValueError
+        If `max_points` is less than 3.
+
+    Notes
+    ------
+    Algorithm from Sveinn Steinarsson, "Downsampling Time Series for Visual Representation" (2013).
+
+    """
+    x = _x_to_numeric(x)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+
+    # the first and last point plus at least one bucket
+    if max_points is not None and max_points < 3:
+        raise ValueError(f"max_points must be at least 3 for LTTB, got {max_points}.")
+
+    # nothing to do if the series already fits
+    if max_points is None or max_points >= n:
+        return np.arange(n)
+
+    # bucket boundaries for the points between the first and last point
+    bucket_edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+
+    indices = np.empty(max_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    # the point selected in the previous bucket (starts with the first point)
+    a = 0
+
+    for i in range(max_points - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+
+        # average point of the next bucket (the last bucket uses the final point)
+        next_start, next_end = end, bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # triangle area for every point in the current bucket, computed in one go
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+
+        a = start + int(np.nanargmax(areas)) if not np.all(np.isnan(areas)) else start
+        indices[i + 1] = a
+
+    return indices
+
+
+
+def downsample_minmax(x, y, max_points):
+    """Selects at most `max_points` points from a series by keeping the minimum and maximum point of
+    each bucket (a min/max envelope). Unlike LTTB this guarantees that every local peak and trough
+    survives, at the cost of a slightly noisier line.
+
+    Parameters
+    ----------
+    x : array-like
+        The x axis values (numbers or dates), sorted in ascending order.
+
+    y : array-like
+        The y axis values.
+
+    max_points : int
+        The maximum number of points to keep (must be at least 4).
+
+    Returns
+    -------
+    indices : numpy array
+        The positions of the points to keep, in ascending order.
+
+    Raises
+    ------
+    ValueError
+        If `max_points` is less than 4.
+
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+
+    # the first and last point plus one bucket (its minimum and maximum)
+    if max_points is not None and max_points < 4:
+        raise ValueError(f"max_points must be at least 4 for minmax, got {max_points}.")
+
+    if max_points is None or max_points >= n:
+        return np.arange(n)
+
+    # first and last point are always kept, every bucket in between contributes two points
+    n_buckets = (max_points - 2) // 2
+    bucket_edges = np.linspace(1, n - 1, n_buckets + 1).astype(int)
+
+    indices = [0, n - 1]
+
+    for start, end in zip(bucket_edges[:-1], bucket_edges[1:]):
+        if end <= start:
+            continue
+
+        bucket = y[start:end]
+        if np.all(np.isnan(bucket)):
+            continue
+
+        indices.append(start + int(np.nanargmin(bucket)))
+        indices.append(start + int(np.nanargmax(bucket)))
+
+    return np.unique(indices)
+
+
+
+def downsample_dataframe(df, x, y, max_points, method="lttb"):
+    """Reduces a dataframe to at most `max_points` rows so a chart of column `y` against column `x`
+    keeps its shape while the figure stays small.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        Dataframe sorted by the `x` column.
+
+    x : string
+        Name of the x axis column (e.g. 'publishedAtYearMonth').
+
+    y : string
+        Name of the metric column (e.g. 'viewCount').
+
+    max_points : int
+        The maximum number of rows to keep. If None, or the dataframe is already small enough, the
+        dataframe is returned unchanged.
+
+    method : string
+        'lttb' (largest-triangle-three-buckets) or 'minmax' (min/max envelope).
+
+    Returns
+    -------
+    df_ : pandas dataframe
+        The downsampled dataframe; all columns of the kept rows are retained so hover data still works.
+
+    """
+    if max_points is None or len(df) <= max_points:
+        return df
+
+    if method == "lttb":
+        indices = downsample_lttb(df[x], df[y], max_points)
+
+    elif method == "minmax":
+        indices = downsample_minmax(df[x], df[y], max_points)
+
+    else:
+        raise ValueError(f"Unknown downsample method '{method}', use 'lttb' or 'minmax'.")
+
+    return df.iloc[indices].reset_index(drop=True)
+
+
+
 # define a function that visualises the volume of a metric over time, given a dataframe and a metric name as input
-def viz_line_chart(df, metric, chart_title):
+@instrument("visualisation.viz_line_chart")
+def viz_line_chart(df, metric, chart_title, max_points=None, downsample_method="lttb", show=True, save_image=True):
     """Returns a line chart given a dataframe and metric.
 
     Parameters
@@ -78,16 +315,35 @@ def viz_line_chart(df, metric, chart_title):
     chart_title : string
         Title for the graph.
 
+    max_points : int, optional
+        If set, the dataframe is downsampled to at most this many points before plotting (see
+        `downsample_dataframe`). Useful for daily or per-snapshot series that span several years.
+
+    downsample_method : string
+        'lttb' (default) or 'minmax'; only used when `max_points` is set.
+
+    show : bool
+        If True (default) the figure is opened with `fig.show()`. Set to False when running without a
+        display (e.g. from the pipeline) to have the figure returned instead.
+
+    save_image : bool
+        If True (default) the chart is saved as a PNG in the images folder. Set to False when the figure is
+        only needed for an HTML report (see `src.visualisation.html_report`), as the static image export is
+        by far the slowest step.
+
     Returns
     -------
     fig : plotly line chart
         A line chart created with plotly.
 
     Notes
-    ------    
-    
+    ------
+
     """
 
+    # reduce the number of points per trace so long series stay small and responsive
+    df = downsample_dataframe(df, "publishedAtYearMonth", metric, max_points, method=downsample_method)
+
     fig = px.line(df, 
               x=df["publishedAtYearMonth"], 
               y=f"{metric}",
@@ -112,15 +368,19 @@ def viz_line_chart(df, metric, chart_title):
     # save as a static image
     # image_name = chart_title.replace(" ", "_").replace("-", "_").replace(":", "_")
     image_name = re.sub(r"[\W]+", "_", chart_title) # replace any non-word character with an underscore
-    fig.write_image(f"images/{image_name}.png")
-    
-    
+    if save_image:
+        fig.write_image(f"images/{image_name}.png")
+
+    if not show:
+        return fig
+
     return fig.show()
 
 
 
 # define a function that visualises the volume of a metric over time, given a dataframe and a metric name as input
-def viz_video_counts(df, chart_title):
+@instrument("visualisation.viz_video_counts")
+def viz_video_counts(df, chart_title, show=True, save_image=True):
     """Returns a bar chart displaying the number of videos released in each month.
 
     Parameters
@@ -131,6 +391,12 @@ def viz_video_counts(df, chart_title):
     title : string
         The title of the bar chart.
 
+    show : bool
+        If True (default) the figure is opened with `fig.show()`, otherwise the figure is returned.
+
+    save_image : bool
+        If True (default) the chart is saved as a PNG in the images folder.
+
     Returns
     -------
     fig : plotly line chart
@@ -158,7 +424,10 @@ def viz_video_counts(df, chart_title):
     # image_name = chart_title.replace(" ", "_")
     image_name = re.sub(r"[\W]+", "_", chart_title) # replace any non-word character with an underscore
 
-    fig.write_image(f"images/{image_name}.png")
+    if save_image:
+        fig.write_image(f"images/{image_name}.png")
+
+    if not show:
+        return fig
 
-    
     fig.show()
\ No newline at end of file